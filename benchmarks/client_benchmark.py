@@ -0,0 +1,151 @@
+"""Drives ResponsysClient against the in-process FakeResponsysServer and reports throughput.
+
+Run from the repository root with, for example:
+
+    python benchmarks/client_benchmark.py --records 20000 --max-in-flight 8 --latency 0.02
+
+The report covers records per second for bulk merges and lookups, p50/p99 latency per route,
+how many connections the server accepted compared to requests served, and the time spent
+waiting on the client-side rate limiter and retry backoff.
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from responsys_client.client import ResponsysClient  # noqa: E402
+from responsys_client.fake_server import FakeResponsysServer  # noqa: E402
+from responsys_client.ratelimit import RateLimiter  # noqa: E402
+from responsys_client.retry import RetryPolicy  # noqa: E402
+from responsys_client.transport import RequestsTransport  # noqa: E402
+
+
+PROFILE_LIST = 'BENCHMARK_LIST'
+
+
+class TimingTransport(RequestsTransport):
+    """Records the latency of every request by method and fake server route."""
+
+    def __init__(self, server, **kwargs):
+        super(TimingTransport, self).__init__(**kwargs)
+        self.server = server
+        self.latencies = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def request(self, method, url, **kwargs):
+        started = time.time()
+        try:
+            return super(TimingTransport, self).request(method, url, **kwargs)
+        finally:
+            elapsed = time.time() - started
+            route = self.server.route_for(url) or 'unknown'
+
+            with self._lock:
+                self.latencies['{} {}'.format(method, route)].append(elapsed)
+
+
+class WaitRecorder(object):
+
+    def __init__(self):
+        self.total = 0.0
+        self._lock = threading.Lock()
+
+    def sleep(self, seconds):
+        with self._lock:
+            self.total += seconds
+        time.sleep(seconds)
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    index = min(int(round(fraction * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+def timed(function):
+    started = time.time()
+    result = function()
+    return result, time.time() - started
+
+
+def run(args):
+    rate_limit_waits = WaitRecorder()
+    retry_waits = WaitRecorder()
+
+    server = FakeResponsysServer(latency=args.latency, rate_limit_per_second=args.rate_limit)
+    with server:
+        transport = TimingTransport(server, pool_maxsize=args.max_in_flight)
+        client = ResponsysClient(server.username, server.password, server.url,
+                                 transport=transport,
+                                 rate_limiter=RateLimiter(budgets=args.budgets,
+                                                          sleep=rate_limit_waits.sleep),
+                                 retry_policy=RetryPolicy(max_attempts=5,
+                                                          sleep=retry_waits.sleep))
+
+        profiles = ({'CUSTOMER_ID_': str(customer_id),
+                     'EMAIL_ADDRESS_': 'member{}@example.com'.format(customer_id)}
+                    for customer_id in range(args.records))
+        customer_ids = [str(customer_id) for customer_id in range(args.records)]
+
+        with client:
+            merge_results, merge_seconds = timed(lambda: list(
+                client.merge_profile_list_members_concurrently(
+                    PROFILE_LIST, profiles, 'CUSTOMER_ID_', max_in_flight=args.max_in_flight)))
+
+            client.riid_cache.clear()
+            members, lookup_seconds = timed(lambda: client.get_profile_list_members(
+                PROFILE_LIST, customer_ids, fields=('RIID_',), max_in_flight=args.max_in_flight))
+
+            delete_ids = customer_ids[:args.deletes]
+            delete_results, delete_seconds = timed(lambda: client.delete_profile_list_members(
+                PROFILE_LIST, delete_ids, max_in_flight=args.max_in_flight))
+
+    failed_batches = sum(1 for result in merge_results if result.error is not None)
+
+    print('records: {}, max in flight: {}, server latency: {:.3f}s'
+          .format(args.records, args.max_in_flight, args.latency))
+    print('bulk merge:    {:>10.0f} records/s ({} batches, {} failed)'
+          .format(args.records / merge_seconds, len(merge_results), failed_batches))
+    print('bulk lookup:   {:>10.0f} records/s ({} found)'
+          .format(args.records / lookup_seconds, len(members)))
+    print('bulk delete:   {:>10.0f} records/s ({} deleted, {} failed)'
+          .format(len(delete_ids) / delete_seconds if delete_ids else 0,
+                  len(delete_results.deleted), len(delete_results.failed)))
+    print('connections:   {} accepted for {} requests'
+          .format(server.connection_count, server.request_count))
+    print('throttling:    {} responses were 429, {:.2f}s waiting on the rate limiter, '
+          '{:.2f}s in retry backoff'
+          .format(server.throttled_count, rate_limit_waits.total, retry_waits.total))
+    print('')
+    print('{:<36} {:>8} {:>10} {:>10}'.format('route', 'count', 'p50 ms', 'p99 ms'))
+    for route, latencies in sorted(transport.latencies.items()):
+        print('{:<36} {:>8} {:>10.2f} {:>10.2f}'
+              .format(route, len(latencies), percentile(latencies, 0.5) * 1000,
+                      percentile(latencies, 0.99) * 1000))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--records', type=int, default=10000)
+    parser.add_argument('--deletes', type=int, default=1000)
+    parser.add_argument('--max-in-flight', type=int, default=4)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds the fake server waits before every response')
+    parser.add_argument('--rate-limit', type=int, default=None,
+                        help='requests per second the fake server allows per endpoint class')
+    args = parser.parse_args()
+
+    # the fake server is local, so the default Responsys budgets would only measure the limiter
+    unlimited = (600000, 1000)
+    args.budgets = dict((endpoint_class, unlimited)
+                        for endpoint_class in RateLimiter.DEFAULT_BUDGETS)
+
+    return args
+
+
+if __name__ == '__main__':
+    run(parse_args())
@@ -0,0 +1,70 @@
+"""Compares utils.convert_to_table_structure with the original nested-loop implementation.
+
+Run from the repository root with:
+
+    python benchmarks/convert_to_table_structure.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from responsys_client.utils import convert_to_table_structure  # noqa: E402
+
+
+BATCH_SIZE = 200
+FIELD_COUNT = 40
+REPEAT = 5
+NUMBER = 200
+
+
+def legacy_convert_to_table_structure(list_of_dicts):
+    header_row = sorted(list_of_dicts[0].keys())
+    data_rows = []
+
+    for dictionary in list_of_dicts:
+        data_row = []
+
+        for key in header_row:
+            data_row.append(dictionary.get(key))
+
+        data_rows.append(data_row)
+
+    return header_row, data_rows
+
+
+def build_batch():
+    return [dict(('FIELD_{}_'.format(field), '{}-{}'.format(record, field))
+                 for field in range(FIELD_COUNT))
+            for record in range(BATCH_SIZE)]
+
+
+def time_call(function, *args):
+    timings = timeit.repeat(lambda: function(*args), repeat=REPEAT, number=NUMBER)
+    return min(timings) / NUMBER
+
+
+def main():
+    batch = build_batch()
+    field_names = sorted(batch[0])
+    columns = dict((field, [record[field] for record in batch]) for field in field_names)
+
+    assert legacy_convert_to_table_structure(batch) == convert_to_table_structure(batch)
+
+    legacy = time_call(legacy_convert_to_table_structure, batch)
+    results = [
+        ('legacy nested loop', legacy),
+        ('list of dicts', time_call(convert_to_table_structure, batch)),
+        ('list of dicts, explicit schema',
+         time_call(convert_to_table_structure, batch, field_names)),
+        ('dict of columns', time_call(convert_to_table_structure, columns)),
+    ]
+
+    print('{} records x {} fields per batch'.format(BATCH_SIZE, FIELD_COUNT))
+    for name, seconds in results:
+        print('{:<32} {:>9.1f} us/batch {:>6.2f}x'.format(name, seconds * 1e6, legacy / seconds))
+
+
+if __name__ == '__main__':
+    main()
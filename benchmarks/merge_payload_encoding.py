@@ -0,0 +1,73 @@
+"""Compares encoding a merge payload with the stdlib json module against PayloadEncoder.
+
+Run from the repository root with:
+
+    python benchmarks/merge_payload_encoding.py
+"""
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from responsys_client.base import BaseResponsysClient  # noqa: E402
+from responsys_client.serialization import JSONCodec, PayloadEncoder, orjson  # noqa: E402
+from responsys_client.utils import convert_to_table_structure  # noqa: E402
+
+
+BATCH_SIZE = 200
+FIELD_COUNT = 40
+REPEAT = 5
+NUMBER = 200
+
+
+def build_batch():
+    return [dict(('FIELD_{}_'.format(field), '{}-{}'.format(record, field))
+                 for field in range(FIELD_COUNT))
+            for record in range(BATCH_SIZE)]
+
+
+def encode_with_stdlib(field_names, records):
+    payload = BaseResponsysClient._build_extension_table_merge_json('CUSTOMER_ID_', field_names,
+                                                                    records)
+    return json.dumps(payload).encode('utf-8')
+
+
+def encode_with(encoder):
+    def encode(field_names, records):
+        payload = BaseResponsysClient._build_extension_table_merge_json('CUSTOMER_ID_',
+                                                                        field_names, records)
+        return encoder.encode_merge(payload).data
+
+    return encode
+
+
+def time_call(function, *args):
+    timings = timeit.repeat(lambda: function(*args), repeat=REPEAT, number=NUMBER)
+    return min(timings) / NUMBER
+
+
+def main():
+    field_names, records = convert_to_table_structure(build_batch())
+
+    candidates = [
+        ('stdlib json.dumps', encode_with_stdlib),
+        ('stdlib codec', encode_with(PayloadEncoder(codec=JSONCodec()))),
+    ]
+    if orjson is not None:
+        candidates.append(('orjson codec', encode_with(PayloadEncoder())))
+    candidates.append(('default codec, gzip',
+                       encode_with(PayloadEncoder(compress_threshold=0))))
+
+    baseline = None
+    print('{} records x {} fields per batch'.format(BATCH_SIZE, FIELD_COUNT))
+    for name, encode in candidates:
+        seconds = time_call(encode, field_names, records)
+        baseline = baseline or seconds
+        print('{:<32} {:>9.1f} us/batch {:>6.2f}x {:>8} bytes'.format(
+            name, seconds * 1e6, baseline / seconds, len(encode(field_names, records))))
+
+
+if __name__ == '__main__':
+    main()
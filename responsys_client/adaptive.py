@@ -0,0 +1,143 @@
+import threading
+from collections import deque, namedtuple
+from itertools import islice
+
+from .dispatch import ConcurrentBatchDispatcher
+
+
+AdaptiveSettings = namedtuple('AdaptiveSettings', ['batch_size', 'max_in_flight'])
+
+
+class AdaptiveController(object):
+    """Tunes merge batch size and concurrency with additive increase, multiplicative decrease.
+
+    Every batch that succeeds within target_latency grows the batch size by batch_size_step and
+    concurrency by about one per round of max_in_flight batches. A 429 halves concurrency; a 5xx
+    or failed request halves both, and a slow batch halves the batch size. With max_payload_bytes,
+    the batch size is also capped at the number of records of the observed width that fit.
+    """
+
+    DEFAULT_MIN_BATCH_SIZE = 10
+    DEFAULT_MAX_BATCH_SIZE = 200
+    DEFAULT_INITIAL_BATCH_SIZE = 50
+    DEFAULT_MAX_IN_FLIGHT = 16
+    DEFAULT_INITIAL_IN_FLIGHT = 2
+    DEFAULT_TARGET_LATENCY_IN_SECONDS = 4.0
+    DEFAULT_BATCH_SIZE_STEP = 10
+    DECREASE_FACTOR = 0.5
+
+    def __init__(self, min_batch_size=DEFAULT_MIN_BATCH_SIZE,
+                 max_batch_size=DEFAULT_MAX_BATCH_SIZE,
+                 initial_batch_size=DEFAULT_INITIAL_BATCH_SIZE, min_in_flight=1,
+                 max_in_flight=DEFAULT_MAX_IN_FLIGHT, initial_in_flight=DEFAULT_INITIAL_IN_FLIGHT,
+                 target_latency=DEFAULT_TARGET_LATENCY_IN_SECONDS, max_payload_bytes=None,
+                 batch_size_step=DEFAULT_BATCH_SIZE_STEP):
+        self.min_batch_size = min_batch_size
+        self.max_batch_size = max_batch_size
+        self.min_in_flight = min_in_flight
+        self.max_in_flight = max_in_flight
+        self.target_latency = target_latency
+        self.max_payload_bytes = max_payload_bytes
+        self.batch_size_step = batch_size_step
+
+        self.batch_size = self._clamp(initial_batch_size, min_batch_size, max_batch_size)
+        self.in_flight = float(self._clamp(initial_in_flight, min_in_flight, max_in_flight))
+        self.counts = {'succeeded': 0, 'slow': 0, 'throttled': 0, 'failed': 0}
+        self.last_latency = None
+        self._lock = threading.Lock()
+
+    @property
+    def settings(self):
+        with self._lock:
+            return AdaptiveSettings(self.batch_size, int(self.in_flight))
+
+    def snapshot(self):
+        with self._lock:
+            snapshot = dict(self.counts)
+            snapshot.update(batch_size=self.batch_size, max_in_flight=int(self.in_flight),
+                            last_latency=self.last_latency)
+
+            return snapshot
+
+    def record(self, latency, payload_bytes, record_count, status_code):
+        """Adjusts the settings after a batch; status_code is None when the request raised."""
+        with self._lock:
+            self.last_latency = latency
+
+            if status_code == 429:
+                self.counts['throttled'] += 1
+                self._decrease_in_flight()
+            elif status_code is None or status_code >= 500:
+                self.counts['failed'] += 1
+                self._decrease_in_flight()
+                self._decrease_batch_size()
+            elif status_code < 400:
+                self._record_success(latency, payload_bytes, record_count)
+
+    def _record_success(self, latency, payload_bytes, record_count):
+        if latency > self.target_latency:
+            self.counts['slow'] += 1
+            self._decrease_batch_size()
+        else:
+            self.counts['succeeded'] += 1
+            self.batch_size = min(self.batch_size + self.batch_size_step, self.max_batch_size)
+            self.in_flight = min(self.in_flight + 1.0 / self.in_flight, self.max_in_flight)
+
+        if self.max_payload_bytes and payload_bytes and record_count:
+            fitting_records = int(self.max_payload_bytes * record_count / payload_bytes)
+            self.batch_size = self._clamp(min(self.batch_size, fitting_records),
+                                          self.min_batch_size, self.max_batch_size)
+
+    def _decrease_in_flight(self):
+        self.in_flight = max(self.in_flight * self.DECREASE_FACTOR, self.min_in_flight)
+
+    def _decrease_batch_size(self):
+        self.batch_size = max(int(self.batch_size * self.DECREASE_FACTOR), self.min_batch_size)
+
+    @staticmethod
+    def _clamp(value, minimum, maximum):
+        return max(minimum, min(value, maximum))
+
+
+class AdaptiveBatchDispatcher(ConcurrentBatchDispatcher):
+    """Sends records in batches whose size and concurrency follow an AdaptiveController.
+
+    send_batch(batch, record_attempt) is called for every batch and must call
+    record_attempt(latency, payload_bytes, status_code) for every request attempt it makes,
+    retries included, with status_code None when the attempt raised. Results are yielded in input
+    order, like ConcurrentBatchDispatcher.
+    """
+
+    def __init__(self, controller, executor=None):
+        super(AdaptiveBatchDispatcher, self).__init__(max_in_flight=controller.max_in_flight,
+                                                      executor=executor)
+        self.controller = controller
+
+    def dispatch(self, send_batch, records):
+        iterator = iter(records)
+        pending = deque()
+        index = 0
+
+        with self._executor() as executor:
+            while True:
+                settings = self.controller.settings
+
+                while len(pending) < settings.max_in_flight:
+                    batch = list(islice(iterator, settings.batch_size))
+                    if not batch:
+                        break
+
+                    future = executor.submit(send_batch, batch, self._attempt_recorder(batch))
+                    pending.append((index, batch, future))
+                    index += 1
+
+                if not pending:
+                    return
+
+                yield self._collect(*pending.popleft())
+
+    def _attempt_recorder(self, batch):
+        def record_attempt(latency, payload_bytes, status_code):
+            self.controller.record(latency, payload_bytes, len(batch), status_code)
+
+        return record_attempt
@@ -0,0 +1,431 @@
+import asyncio
+import json as json_module
+from urllib.parse import urljoin, urlsplit
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from .base import BaseResponsysClient
+from .exceptions import ResponsysClientError
+from .instrumentation import AUTH_LOGIN, AUTH_REFRESH, AUTH_RELOGIN
+from .retry import RetryPolicy
+from .utils import convert_to_table_structure, split_dict
+
+
+class AsyncResponse(object):
+    """A fully read HTTP response exposing the parts of the requests API the clients rely on."""
+
+    class Request(object):
+        def __init__(self, method, url, body):
+            self.method = method
+            self.path_url = urlsplit(url).path
+            self.body = body
+
+    def __init__(self, status_code, text, headers, request):
+        self.status_code = status_code
+        self.text = text
+        self.headers = headers
+        self.request = request
+
+    def json(self):
+        return json_module.loads(self.text)
+
+
+class AiohttpTransport(object):
+    """Sends HTTP requests through a shared aiohttp session with a keep-alive connection pool.
+
+    The session is created on first use so that it binds to the running event loop.
+    """
+
+    DEFAULT_LIMIT = 100
+    DEFAULT_LIMIT_PER_HOST = 10
+    DEFAULT_KEEPALIVE_TIMEOUT_IN_SECONDS = 30
+
+    def __init__(self, limit=DEFAULT_LIMIT, limit_per_host=DEFAULT_LIMIT_PER_HOST,
+                 keepalive_timeout=DEFAULT_KEEPALIVE_TIMEOUT_IN_SECONDS):
+        if aiohttp is None:
+            raise ResponsysClientError('aiohttp must be installed to use the AiohttpTransport.')
+
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self._session = None
+
+    async def request(self, method, url, params=None, json=None, headers=None, timeout=None):
+        session = self._get_session()
+
+        async with session.request(method, url, params=self._encode_params(params), json=json,
+                                   headers=headers,
+                                   timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+            text = await response.text()
+
+        body = json_module.dumps(json) if json is not None else None
+        request = AsyncResponse.Request(method, str(response.url), body)
+
+        return AsyncResponse(response.status, text, response.headers, request)
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    def _get_session(self):
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.limit, limit_per_host=self.limit_per_host,
+                                             keepalive_timeout=self.keepalive_timeout)
+            self._session = aiohttp.ClientSession(connector=connector)
+
+        return self._session
+
+    @staticmethod
+    def _encode_params(params):
+        # mirrors requests, which drops None values and repeats keys for list values
+        if not params:
+            return None
+
+        encoded = []
+        for key, value in params.items():
+            if value is None:
+                continue
+
+            values = value if isinstance(value, (list, tuple)) else [value]
+            encoded.extend((key, str(item)) for item in values)
+
+        return encoded
+
+
+class AsyncResponsysClient(BaseResponsysClient):
+    """An asyncio counterpart of ResponsysClient with the same methods as coroutines."""
+
+    def __init__(self, username, password, login_url, transport=None, rate_limiter=None,
+                 retry_policy=None, instrumentation=None, token_store=None):
+        super(AsyncResponsysClient, self).__init__(username, password, login_url,
+                                                   rate_limiter=rate_limiter,
+                                                   retry_policy=retry_policy,
+                                                   instrumentation=instrumentation,
+                                                   token_store=token_store)
+        self._auth_lock = None
+
+        # a transport passed in by the caller may be shared, so only close the one we create
+        self._owns_transport = transport is None
+        self.transport = transport if transport is not None else AiohttpTransport()
+
+    @staticmethod
+    def _build_default_retry_policy():
+        retry_exceptions = (asyncio.TimeoutError,)
+        unsent_exceptions = ()
+
+        if aiohttp is not None:
+            retry_exceptions += (aiohttp.ClientConnectionError,)
+            unsent_exceptions += (aiohttp.ClientConnectorError,)
+
+        return RetryPolicy(retry_exceptions=retry_exceptions,
+                           unsent_exceptions=unsent_exceptions)
+
+    async def close(self):
+        if self._owns_transport:
+            await self.transport.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def get_profile_lists(self):
+        method = 'GET'
+        path = '/rest/api/v1.1/lists'
+
+        response = await self.send_request(method, path)
+
+        self._check_for_valid_response(response)
+
+        return response.json()
+
+    async def get_profile_list_extensions(self, profile_list):
+        method = 'GET'
+        path = '/rest/api/v1.1/lists/{}/listExtensions'.format(profile_list)
+
+        response = await self.send_request(method, path)
+
+        self._check_for_valid_response(response)
+
+        return response.json()
+
+    async def merge_profile_list_members(self, profile_list, profile_dicts, merge_key):
+        member_field_names, member_records = convert_to_table_structure(profile_dicts)
+
+        path = '/rest/api/v1.1/lists/{}/members'.format(profile_list)
+
+        response = await self.send_profile_list_merge_request(path, merge_key, member_field_names,
+                                                              member_records)
+
+        self._check_for_valid_response(response)
+
+        return response.json()
+
+    async def merge_profile_list_extension_members(self, profile_list, list_extension, data_dicts,
+                                                   merge_key):
+        member_field_names, member_records = convert_to_table_structure(data_dicts)
+
+        path = ('/rest/api/v1.1/lists/{}/listExtensions/{}/members'
+                .format(profile_list, list_extension))
+
+        response = await self.send_extension_table_merge_request(path, merge_key,
+                                                                 member_field_names,
+                                                                 member_records)
+
+        self._check_for_valid_response(response)
+
+        return response.json()
+
+    async def get_supplemental_table_members(self, folder, table, primary_keys, fields=('all',)):
+        pk_names, pk_values = split_dict(primary_keys)
+
+        method = 'GET'
+        path = ('/rest/api/v1.1/folders/{}/suppData/{}/members'
+                .format(folder, table))
+        params = {
+            'fs': ','.join(fields),
+            'qa': pk_names,
+            'id': pk_values,
+        }
+
+        response = await self.send_request(method, path, params=params)
+
+        return response.json()
+
+    async def merge_supplemental_table_members(self, folder, table, data_dicts):
+        member_field_names, member_records = convert_to_table_structure(data_dicts)
+
+        path = ('/rest/api/v1.1/folders/{}/suppData/{}/members'
+                .format(folder, table))
+
+        response = await self.send_supplemental_table_merge_request(path, member_field_names,
+                                                                    member_records)
+
+        self._check_for_valid_response(response)
+
+        return response.json()
+
+    async def get_profile_list_member(self, profile_list, customer_id):
+        method = 'GET'
+        path = '/rest/api/v1.1/lists/{}/members/'.format(profile_list)
+        query_by_customer_id_params = {
+            'qa': 'c',
+            'id': str(customer_id),
+            'fs': 'all'
+        }
+
+        response = await self.send_request(method, path, params=query_by_customer_id_params)
+
+        self._check_for_valid_response(response)
+
+        members = self._parse_members(response)
+
+        return members[0]
+
+    async def get_extension_table_member(self, profile_list, list_extension, user_id):
+        method = 'GET'
+        path = ('/rest/api/v1.1/lists/{}/listExtensions/{}/members'
+                .format(profile_list, list_extension))
+        query_by_customer_id_params = {
+            'qa': 'c',
+            'id': str(user_id),
+            'fs': 'all'
+        }
+
+        response = await self.send_request(method, path, params=query_by_customer_id_params)
+
+        self._check_for_valid_response(response)
+
+        members = self._parse_members(response)
+
+        return members[0]
+
+    async def delete_profile_list_member(self, profile_list, customer_id):
+        member = await self.get_profile_list_member(profile_list, customer_id)
+
+        method = 'DELETE'
+        path = '/rest/api/v1.1/lists/{}/members/{}'.format(profile_list, member['RIID_'])
+
+        response = await self.send_request(method, path)
+
+        self._check_for_valid_response(response)
+
+    async def delete_list_extension_member(self, profile_list, list_extension, customer_id):
+        member = await self.get_extension_table_member(profile_list, list_extension, customer_id)
+
+        method = 'DELETE'
+        path = ('/rest/api/v1.1/lists/{}/listExtensions/{}/members/{}'
+                .format(profile_list, list_extension, member['RIID_']))
+
+        response = await self.send_request(method, path)
+
+        self._check_for_valid_response(response)
+
+    async def send_profile_list_merge_request(self, path, merge_key, member_field_names,
+                                              member_records):
+        self._check_for_record_limit_quantity(member_records)
+
+        json = self._build_profile_list_merge_json(merge_key, member_field_names, member_records)
+
+        return await self.send_request('POST', path, json=json)
+
+    async def send_extension_table_merge_request(self, path, merge_key, member_field_names,
+                                                 member_records):
+        self._check_for_record_limit_quantity(member_records)
+
+        json = self._build_extension_table_merge_json(merge_key, member_field_names,
+                                                      member_records)
+
+        return await self.send_request('POST', path, json=json)
+
+    async def send_supplemental_table_merge_request(self, path, member_field_names,
+                                                    member_records):
+        self._check_for_record_limit_quantity(member_records)
+
+        json = self._build_supplemental_table_merge_json(member_field_names, member_records)
+
+        return await self.send_request('POST', path, json=json)
+
+    async def send_request(self, method, path, params=None, json=None):
+        auth_token, issued_url = await self._get_access_items_safely()
+
+        url = urljoin(issued_url, path)
+        headers = {'Authorization': auth_token}
+
+        response = await self._send_request(method, url, headers=headers, json=json,
+                                            params=params)
+
+        # this retries the request if authentication is revoked
+        if response.status_code == 401 or self._is_invalid_token_response(response):
+            auth_token = await self._login_if_token_unchanged(auth_token)
+            headers = {'Authorization': auth_token}
+
+            response = await self._send_request(method, url, headers=headers, json=json,
+                                                params=params)
+
+        return response
+
+    async def unsubscribe_list_member(self, profile_list, customer_id):
+        profile_dict = self._build_unsubscribe_profile_dict(customer_id)
+        response = await self.merge_profile_list_members(profile_list, [profile_dict],
+                                                         'CUSTOMER_ID_')
+        return response
+
+    async def _send_request(self, method, url, params=None, json=None, headers=None):
+        endpoint_class = self.rate_limiter.classify(method, url)
+        measurement = self._start_request_measurement(method, url, endpoint_class)
+        attempt = 0
+
+        while True:
+            attempt += 1
+            delay = self.rate_limiter.reserve(endpoint_class)
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            if measurement is not None:
+                measurement.attempts = attempt
+                measurement.throttle_wait += max(delay, 0)
+
+            try:
+                response = await self.transport.request(
+                    method, url, params=params, json=json, headers=headers,
+                    timeout=self.DEFAULT_REQUEST_TIMEOUT_IN_SECONDS)
+            except self.retry_policy.retry_exceptions + (asyncio.TimeoutError,) as error:
+                if self.retry_policy.should_retry_exception(method, url, error, attempt):
+                    await self._wait_before_retry(attempt, measurement)
+                    continue
+
+                if measurement is not None:
+                    measurement.finish(json, error=error)
+
+                if isinstance(error, asyncio.TimeoutError):
+                    raise ResponsysClientError('There was a timeout error sending a request to '
+                                               'Responsys. Method: {}, URL: {}'
+                                               .format(method, url))
+                raise
+
+            self._record_rate_limit_outcome(endpoint_class, response)
+
+            if not self.retry_policy.should_retry_response(method, url, response, attempt):
+                if measurement is not None:
+                    measurement.finish(json, response=response)
+
+                return response
+
+            if self._should_back_off_before_retry(response):
+                await self._wait_before_retry(attempt, measurement)
+
+    async def _wait_before_retry(self, attempt, measurement):
+        delay = self.retry_policy.backoff(attempt)
+        await asyncio.sleep(delay)
+
+        if measurement is not None:
+            measurement.retry_wait += delay
+
+    def _get_auth_lock(self):
+        # created lazily so the lock belongs to the loop that first uses the client
+        if self._auth_lock is None:
+            self._auth_lock = asyncio.Lock()
+
+        return self._auth_lock
+
+    async def _get_access_items(self):
+        if not self.auth_token:
+            await self._login()
+        elif self._time_to_refresh_token():
+            await self._refresh_token()
+
+    async def _get_access_items_safely(self):
+        # serializes login and refresh so concurrent tasks share a single token
+        async with self._get_auth_lock():
+            if not self.auth_token or self._time_to_refresh_token():
+                # the store's lock would block the event loop, so only its token is shared
+                self._load_access_items()
+                await self._get_access_items()
+
+            return self.auth_token, self.issued_url
+
+    async def _login_if_token_unchanged(self, stale_auth_token):
+        # another task may have already replaced the rejected token while this one waited
+        async with self._get_auth_lock():
+            self._load_access_items()
+
+            if self.auth_token == stale_auth_token:
+                await self._login(auth_kind=AUTH_RELOGIN)
+
+            return self.auth_token
+
+    async def _login(self, auth_kind=AUTH_LOGIN):
+        method, url, params, headers = self._build_login_request()
+
+        started_at = self._start_auth_measurement()
+        response = await self._send_request(method, url, params=params, headers=headers)
+        self._finish_auth_measurement(auth_kind, started_at, response)
+
+        self._check_for_valid_login_response(response)
+
+        self._update_access_items(response)
+
+    async def _refresh_token(self):
+        method, url, params, headers = self._build_refresh_token_request()
+
+        started_at = self._start_auth_measurement()
+        response = await self._send_request(method, url, params=params, headers=headers)
+        self._finish_auth_measurement(AUTH_REFRESH, started_at, response)
+
+        if response.status_code != 200:
+            await self._login()
+            return
+
+        self._update_access_items(response)
@@ -0,0 +1,312 @@
+from datetime import datetime
+from datetime import timedelta
+import sys
+
+if sys.version_info >= (3,0):
+    from urllib.parse import urljoin
+else:
+    from urlparse import urljoin
+
+import pytz
+
+from .exceptions import ResponsysClientError
+from .instrumentation import AuthEvent, RequestMeasurement
+from .ratelimit import RateLimiter
+from .records import MemberRecords
+from .retry import RetryPolicy
+from .tokens import AccessItems, MemoryTokenStore
+from .utils import chunk_iterable, convert_to_list_of_dicts
+
+
+class BaseResponsysClient(object):
+    """Holds the state and request building shared by the blocking and asyncio clients.
+
+    Nothing in here performs I/O, so subclasses only need to supply the sending side.
+    """
+
+    RESPONSYS_AUTH_PATH = '/rest/api/v1.1/auth/token'
+    RESPONSYS_RATE_LIMIT_WAITING_PERIOD_IN_SECONDS = 60
+    RESPONSYS_INVALID_TOKEN_RESPONSE_DETAIL = 'Not a valid authentication token'
+    RESPONSYS_RECORD_PROCESS_LIMIT_QUANTITY = 200
+
+    RESPONSYS_QUERY_ATTRIBUTE_FIELD_NAMES = {
+        'r': 'RIID_',
+        'c': 'CUSTOMER_ID_',
+        'e': 'EMAIL_ADDRESS_',
+        'm': 'MOBILE_NUMBER_',
+    }
+
+    AUTH_TOKEN_REFRESH_THRESHOLD = timedelta(hours=1)
+    AUTH_TOKEN_PROACTIVE_REFRESH_LEAD = timedelta(minutes=5)
+    DEFAULT_REQUEST_TIMEOUT_IN_SECONDS = 60
+
+    def __init__(self, username, password, login_url, rate_limiter=None, retry_policy=None,
+                 instrumentation=None, token_store=None):
+        self.username = username
+        self.password = password
+        self.login_url = login_url
+        # the access items are replaced as one tuple, so a request never reads half a refresh
+        self._access_items = AccessItems(None, None, None)
+        self.rate_limiter = rate_limiter if rate_limiter is not None else RateLimiter()
+        self.retry_policy = (retry_policy if retry_policy is not None
+                             else self._build_default_retry_policy())
+        self.instrumentation = instrumentation
+
+        # a store shared between clients, or processes, lets them share a single token
+        self.token_store = token_store if token_store is not None else MemoryTokenStore()
+
+    @property
+    def auth_token(self):
+        return self._access_items.auth_token
+
+    @auth_token.setter
+    def auth_token(self, auth_token):
+        self._access_items = self._access_items._replace(auth_token=auth_token)
+
+    @property
+    def issued_url(self):
+        return self._access_items.issued_url
+
+    @issued_url.setter
+    def issued_url(self, issued_url):
+        self._access_items = self._access_items._replace(issued_url=issued_url)
+
+    @property
+    def refresh_timestamp(self):
+        return self._access_items.refresh_timestamp
+
+    @refresh_timestamp.setter
+    def refresh_timestamp(self, refresh_timestamp):
+        self._access_items = self._access_items._replace(refresh_timestamp=refresh_timestamp)
+
+    @staticmethod
+    def _build_default_retry_policy():
+        return RetryPolicy()
+
+    @staticmethod
+    def _build_profile_list_merge_json(merge_key, member_field_names, member_records):
+        return {
+            "recordData": {
+                "fieldNames": member_field_names,
+                "records": member_records,
+                "mapTemplateName": None
+            },
+            "mergeRule": {
+                "htmlValue": "H",
+                "optinValue": "I",
+                "textValue": "T",
+                "insertOnNoMatch": True,
+                "updateOnMatch": "REPLACE_ALL",
+                "matchColumnName1": merge_key,
+                "matchColumnName2": None,
+                "matchOperator": "NONE",
+                "optoutValue": "O",
+                "rejectRecordIfChannelEmpty": None,
+                "defaultPermissionStatus": "OPTIN"
+            }
+        }
+
+    @staticmethod
+    def _build_extension_table_merge_json(merge_key, member_field_names, member_records):
+        return {
+                "recordData": {
+                    "fieldNames": member_field_names,
+                    "records": member_records,
+                    "mapTemplateName": None
+                },
+                "insertOnNoMatch": True,
+                "updateOnMatch": "REPLACE_ALL",
+                "matchColumnName1": merge_key
+        }
+
+    @staticmethod
+    def _build_supplemental_table_merge_json(member_field_names, member_records):
+        return {
+                "recordData": {
+                    "fieldNames": member_field_names,
+                    "records": member_records,
+                    "mapTemplateName": None
+                },
+                "insertOnNoMatch": True,
+                "updateOnMatch": "REPLACE_ALL"
+        }
+
+    @staticmethod
+    def _build_unsubscribe_profile_dict(customer_id):
+        return {
+            'CUSTOMER_ID_': str(customer_id),
+            'EMAIL_PERMISSION_STATUS_': 'O',
+        }
+
+    def _build_member_retrieval_json(self, ids, query_attribute, fields):
+        field_list = list(fields)
+
+        # the matched column is needed to map records back to the requested ids
+        id_field_name = self.RESPONSYS_QUERY_ATTRIBUTE_FIELD_NAMES[query_attribute]
+        if 'all' not in field_list and id_field_name not in field_list:
+            field_list.append(id_field_name)
+
+        return {
+            'fieldList': field_list,
+            'ids': [str(member_id) for member_id in ids],
+            'queryAttribute': query_attribute,
+        }
+
+    def _map_members_by_id(self, ids, members, query_attribute):
+        id_field_name = self.RESPONSYS_QUERY_ATTRIBUTE_FIELD_NAMES[query_attribute]
+        ids_by_key = dict((self._member_id_key(member_id, query_attribute), member_id)
+                          for member_id in ids)
+
+        members_by_id = {}
+        for member in members:
+            key = self._member_id_key(member.get(id_field_name), query_attribute)
+
+            if key in ids_by_key:
+                members_by_id[ids_by_key[key]] = member
+
+        return members_by_id
+
+    @staticmethod
+    def _member_id_key(member_id, query_attribute):
+        key = str(member_id)
+
+        # Responsys matches email addresses case-insensitively
+        return key.lower() if query_attribute == 'e' else key
+
+    def _build_login_request(self):
+        url = urljoin(self.login_url, self.RESPONSYS_AUTH_PATH)
+        params = {'user_name': self.username,
+                  'password': self.password,
+                  'auth_type': 'password'}
+        headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+
+        return 'POST', url, params, headers
+
+    def _build_refresh_token_request(self):
+        url = urljoin(self.issued_url, self.RESPONSYS_AUTH_PATH)
+        params = {'auth_type': 'token'}
+        headers = {'Authorization': self.auth_token}
+
+        return 'POST', url, params, headers
+
+    def _batch_records(self, records):
+        return chunk_iterable(records, self.RESPONSYS_RECORD_PROCESS_LIMIT_QUANTITY)
+
+    def _record_rate_limit_outcome(self, endpoint_class, response):
+        if response.status_code == 429:
+            self.rate_limiter.throttled(
+                endpoint_class, response.headers.get('Retry-After'),
+                max_backoff=self.RESPONSYS_RATE_LIMIT_WAITING_PERIOD_IN_SECONDS)
+        else:
+            self.rate_limiter.succeeded(endpoint_class)
+
+    def _start_request_measurement(self, method, url, endpoint_class):
+        # without instrumentation nothing is measured, so there is no per-request cost
+        if self.instrumentation is None:
+            return None
+
+        return RequestMeasurement(self.instrumentation, method, url, endpoint_class)
+
+    def _start_auth_measurement(self):
+        if self.instrumentation is None:
+            return None
+
+        return self.instrumentation.clock()
+
+    def _finish_auth_measurement(self, kind, started_at, response):
+        if started_at is None:
+            return
+
+        latency = self.instrumentation.clock() - started_at
+        self.instrumentation.auth_finished(AuthEvent(kind, response.status_code, latency))
+
+    def _should_back_off_before_retry(self, response):
+        # the rate limiter already pauses an endpoint class after a 429
+        return response.status_code != 429
+
+    def _check_for_record_limit_quantity(self, member_records):
+        limit = self.RESPONSYS_RECORD_PROCESS_LIMIT_QUANTITY
+        if len(member_records) > limit:
+            raise ResponsysClientError('A max of {} members may be created or updated at '
+                                       'one time.'.format(limit))
+
+    @staticmethod
+    def _check_for_valid_response(response, expected_status_code=200):
+        if response.status_code != expected_status_code:
+            request = response.request
+
+            raise ResponsysClientError('There was an issue sending a request to Responsys. '
+                                       'Request Method: {}. Request Path: {}. Request Body: {}.'
+                                       'Response Status Code: {}. Response Text: {}.'
+                                       .format(request.method, request.path_url, request.body,
+                                               response.status_code, response.text))
+
+    @staticmethod
+    def _check_for_valid_login_response(response):
+        if response.status_code != 200:
+            raise ResponsysClientError('There was an issue sending a login request '
+                                       'to Responsys. Status Code: {}. Response Text: {}'
+                                       .format(response.status_code, response.text))
+
+    def _is_invalid_token_response(self, response):
+        invalid = False
+        if response.status_code == 500:
+            try:
+                detail = response.json().get('detail')
+            except AttributeError:
+                pass
+            else:
+                if detail == self.RESPONSYS_INVALID_TOKEN_RESPONSE_DETAIL:
+                    invalid = True
+
+        return invalid
+
+    @staticmethod
+    def _parse_members(response):
+        parsed_response = response.json()
+
+        field_names = parsed_response['recordData']['fieldNames']
+        records = parsed_response['recordData']['records']
+
+        members = convert_to_list_of_dicts(field_names, records)
+
+        return members
+
+    @staticmethod
+    def _parse_member_records(response):
+        parsed_response = response.json()
+
+        record_data = parsed_response['recordData']
+
+        return MemberRecords(record_data['fieldNames'], record_data['records'])
+
+    def _time_to_refresh_token(self, lead=timedelta(0), refresh_timestamp=None):
+        token_age = self._now_utc_aware() - (refresh_timestamp or self.refresh_timestamp)
+
+        return token_age > self.AUTH_TOKEN_REFRESH_THRESHOLD - lead
+
+    @staticmethod
+    def _now_utc_aware():
+        return datetime.utcnow().replace(tzinfo=pytz.utc)
+
+    def _update_access_items(self, response):
+        parsed_response = response.json()
+
+        # this comes back in javascript format and must be converted
+        unaware_timestamp = datetime.utcfromtimestamp(parsed_response['issuedAt']/1000)
+        utc_timestamp = unaware_timestamp.replace(tzinfo=pytz.UTC)
+
+        self._access_items = AccessItems(parsed_response['authToken'],
+                                         parsed_response['endPoint'], utc_timestamp)
+
+        self.token_store.set(self._access_items)
+
+    def _load_access_items(self):
+        # adopts a token another client stored, unless this client's own token is as recent
+        access_items = self.token_store.get()
+        if access_items is None:
+            return
+
+        if (self.refresh_timestamp is None
+                or access_items.refresh_timestamp > self.refresh_timestamp):
+            self._access_items = AccessItems(*access_items)
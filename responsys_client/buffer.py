@@ -0,0 +1,184 @@
+import threading
+import time
+from collections import OrderedDict, deque
+
+from .dispatch import BatchResult
+from .exceptions import ResponsysClientError
+from .utils import group_by_field_set
+
+
+class MergeBuffer(object):
+    """Coalesces single record upserts into full merge batches sent from a background thread.
+
+    Records are keyed by key_fields and a later record for the same key replaces the pending one,
+    or is merged into it field by field with merge_fields. A batch is sent once max_records
+    distinct keys are pending, max_delay seconds after its first record, or on flush and close.
+    Batches are sent one at a time in the order they filled, so the last write always wins.
+
+    Records in a batch are grouped by their set of fields and each group is merged separately,
+    so a partial record never blanks the fields it does not carry. A batch that fails is passed
+    to on_error as a BatchResult, or kept on failures if there is no callback.
+
+    At most max_pending_batches full batches wait to be sent. Once they do, add blocks until one
+    is sent, so memory stays bounded when Responsys slows down. With add_timeout, add raises a
+    ResponsysClientError after waiting that many seconds instead.
+    """
+
+    DEFAULT_MAX_RECORDS = 200
+    DEFAULT_MAX_DELAY_IN_SECONDS = 5.0
+    DEFAULT_MAX_PENDING_BATCHES = 10
+
+    def __init__(self, send_batch, key_fields, max_records=DEFAULT_MAX_RECORDS,
+                 max_delay=DEFAULT_MAX_DELAY_IN_SECONDS, merge_fields=False, on_error=None,
+                 max_pending_batches=DEFAULT_MAX_PENDING_BATCHES, add_timeout=None):
+        if max_records < 1:
+            raise ValueError('max_records must be at least 1.')
+        if max_pending_batches < 1:
+            raise ValueError('max_pending_batches must be at least 1.')
+
+        self.send_batch = send_batch
+        self.key_fields = (tuple(key_fields) if isinstance(key_fields, (list, tuple))
+                           else (key_fields,))
+        self.max_records = max_records
+        self.max_delay = max_delay
+        self.merge_fields = merge_fields
+        self.on_error = on_error
+        self.max_pending_batches = max_pending_batches
+        self.add_timeout = add_timeout
+        self.failures = []
+        self.batch_count = 0
+
+        self._pending = OrderedDict()
+        self._deadline = None
+        self._batches = deque()
+        self._sending = False
+        self._closed = False
+        self._condition = threading.Condition()
+
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def add(self, record):
+        key = tuple(record[field] for field in self.key_fields)
+
+        with self._condition:
+            self._wait_for_room()
+
+            pending_record = self._pending.get(key)
+            if pending_record is not None and self.merge_fields:
+                pending_record.update(record)
+            else:
+                self._pending[key] = dict(record)
+
+            if self._deadline is None:
+                # wakes the sending thread so it starts waiting on the new deadline
+                self._deadline = time.time() + self.max_delay
+                self._condition.notify_all()
+
+            if len(self._pending) >= self.max_records:
+                self._queue_pending()
+
+    def add_many(self, records):
+        for record in records:
+            self.add(record)
+
+    def flush(self):
+        """Sends every pending record and blocks until all queued batches have been sent."""
+        with self._condition:
+            self._queue_pending()
+
+            while self._batches or self._sending:
+                self._condition.wait()
+
+    def close(self):
+        self.flush()
+
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+        self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        with self._condition:
+            return len(self._pending) + sum(len(batch) for batch in self._batches)
+
+    def _wait_for_room(self):
+        # callers hold the condition
+        deadline = None if self.add_timeout is None else time.time() + self.add_timeout
+
+        while True:
+            if self._closed:
+                raise ResponsysClientError('Records cannot be added to a closed MergeBuffer.')
+
+            if len(self._batches) < self.max_pending_batches:
+                return
+
+            timeout = None if deadline is None else deadline - time.time()
+            if timeout is not None and timeout <= 0:
+                raise ResponsysClientError('The MergeBuffer still had {} batches waiting to be '
+                                           'sent after {} seconds.'
+                                           .format(len(self._batches), self.add_timeout))
+
+            self._condition.wait(timeout)
+
+    def _queue_pending(self):
+        # callers hold the condition
+        if self._pending:
+            self._batches.append(list(self._pending.values()))
+            self._pending = OrderedDict()
+            self._deadline = None
+            self._condition.notify_all()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._batches:
+                    if self._closed:
+                        return
+
+                    if self._deadline is not None and time.time() >= self._deadline:
+                        self._queue_pending()
+                        break
+
+                    timeout = None if self._deadline is None else self._deadline - time.time()
+                    self._condition.wait(timeout)
+
+                batch = self._batches.popleft()
+                index = self.batch_count
+                self.batch_count += 1
+                self._sending = True
+                # wakes adds waiting for room
+                self._condition.notify_all()
+
+            try:
+                self._send(index, batch)
+            finally:
+                with self._condition:
+                    self._sending = False
+                    self._condition.notify_all()
+
+    def _send(self, index, batch):
+        for records in group_by_field_set(batch):
+            try:
+                self.send_batch(records)
+            except Exception as error:
+                self._report_failure(BatchResult(index, records, None, error))
+
+    def _report_failure(self, result):
+        if self.on_error is None:
+            self.failures.append(result)
+            return
+
+        try:
+            self.on_error(result)
+        except Exception:
+            # a failing callback must not stop the sending thread
+            pass
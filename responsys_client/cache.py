@@ -0,0 +1,79 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+_MISSING = object()
+
+
+class TTLCache(object):
+    """A thread-safe, size-bounded cache whose entries expire ttl seconds after they are set.
+
+    When the cache is full the least recently used entry is evicted. get_or_load runs at most one
+    load per key at a time; concurrent callers for the same key wait for and share its result.
+    """
+
+    def __init__(self, max_size, ttl, clock=time.time):
+        if max_size < 1:
+            raise ValueError('max_size must be at least 1.')
+
+        self.max_size = max_size
+        self.ttl = ttl
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._load_locks = {}
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+
+            if entry is None or entry[1] <= self._clock():
+                return default
+
+            # reinserting marks the entry as the most recently used
+            self._entries[key] = entry
+            return entry[0]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (value, self._clock() + self.ttl)
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def get_or_load(self, key, load):
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+
+        with self._lock:
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+
+        try:
+            with load_lock:
+                # another caller may have loaded the value while this one waited
+                value = self.get(key, _MISSING)
+
+                if value is _MISSING:
+                    value = load()
+                    self.set(key, value)
+        finally:
+            with self._lock:
+                if self._load_locks.get(key) is load_lock:
+                    del self._load_locks[key]
+
+        return value
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
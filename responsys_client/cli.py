@@ -0,0 +1,115 @@
+"""Loads CSV or JSONL files into Responsys profile lists, extension tables or supplemental tables.
+
+Credentials are read from --username, --password and --login-url, or from the RESPONSYS_USERNAME,
+RESPONSYS_PASSWORD and RESPONSYS_LOGIN_URL environment variables.
+"""
+import argparse
+import os
+import sys
+
+from .client import ResponsysClient
+from .loader import BulkLoader, CSV_FORMAT, JSONL_FORMAT
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='responsys-load', description=__doc__)
+    parser.add_argument('--username', default=os.environ.get('RESPONSYS_USERNAME'))
+    parser.add_argument('--password', default=os.environ.get('RESPONSYS_PASSWORD'))
+    parser.add_argument('--login-url', default=os.environ.get('RESPONSYS_LOGIN_URL'))
+    parser.add_argument('--format', dest='file_format', choices=[CSV_FORMAT, JSONL_FORMAT],
+                        help='the file format, detected from the extension by default')
+    parser.add_argument('--map', dest='field_map', action='append', metavar='COLUMN=FIELD',
+                        help='load COLUMN into FIELD; when given, unmapped columns are dropped')
+    parser.add_argument('--max-in-flight', type=int, default=BulkLoader.DEFAULT_MAX_IN_FLIGHT)
+    parser.add_argument('--checkpoint',
+                        help='the checkpoint journal, FILE.checkpoint by default')
+    parser.add_argument('--no-checkpoint', action='store_true',
+                        help='load the whole file without reading or writing a journal')
+    parser.add_argument('--restart', action='store_true',
+                        help='discard the checkpoint journal and load from the start')
+
+    targets = parser.add_subparsers(dest='target')
+    targets.required = True
+
+    profile_list = targets.add_parser('profile-list', help='merge into a profile list')
+    profile_list.add_argument('profile_list')
+    profile_list.add_argument('--merge-key', default='CUSTOMER_ID_')
+
+    extension = targets.add_parser('extension', help='merge into a profile extension table')
+    extension.add_argument('profile_list')
+    extension.add_argument('list_extension')
+    extension.add_argument('--merge-key', default='CUSTOMER_ID_')
+
+    supplemental = targets.add_parser('supplemental', help='merge into a supplemental table')
+    supplemental.add_argument('folder')
+    supplemental.add_argument('table')
+
+    for target in (profile_list, extension, supplemental):
+        target.add_argument('file')
+
+    return parser
+
+
+def parse_field_map(mappings):
+    if not mappings:
+        return None
+
+    field_map = {}
+    for mapping in mappings:
+        column, separator, field = mapping.partition('=')
+
+        if not separator or not column or not field:
+            raise ValueError('Expected COLUMN=FIELD, got {!r}.'.format(mapping))
+
+        field_map[column] = field
+
+    return field_map
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    if not (args.username and args.password and args.login_url):
+        parser.error('a username, password and login URL are required')
+
+    try:
+        field_map = parse_field_map(args.field_map)
+    except ValueError as error:
+        parser.error(str(error))
+
+    checkpoint_path = None
+    if not args.no_checkpoint:
+        checkpoint_path = args.checkpoint or args.file + '.checkpoint'
+
+        if args.restart and os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+
+    with ResponsysClient(args.username, args.password, args.login_url) as client:
+        loader = BulkLoader(client, max_in_flight=args.max_in_flight, field_map=field_map,
+                            file_format=args.file_format, checkpoint_path=checkpoint_path)
+
+        if args.target == 'profile-list':
+            result = loader.load_profile_list_members(args.file, args.profile_list,
+                                                      args.merge_key)
+        elif args.target == 'extension':
+            result = loader.load_profile_list_extension_members(
+                args.file, args.profile_list, args.list_extension, args.merge_key)
+        else:
+            result = loader.load_supplemental_table_members(args.file, args.folder, args.table)
+
+    if result.resumed_from:
+        print('Resumed from byte {}.'.format(result.resumed_from))
+
+    print('Loaded {} records.'.format(result.loaded))
+
+    for failed_batch in result.failed:
+        sys.stderr.write('Failed to load {} records from bytes {}-{}: {}\n'.format(
+            failed_batch.record_count, failed_batch.start_offset, failed_batch.end_offset,
+            failed_batch.error))
+
+    return 1 if result.failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
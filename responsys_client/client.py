@@ -1,57 +1,159 @@
-import time
-from datetime import datetime
-from datetime import timedelta
+import copy
+import threading
 import sys
+import time
+from collections import namedtuple
+from contextlib import contextmanager
 
 if sys.version_info >= (3,0):
     from urllib.parse import urljoin
 else:
     from urlparse import urljoin
 
-import pytz
 import requests
 
+from .base import BaseResponsysClient
+from .buffer import MergeBuffer
+from .cache import TTLCache
+from .adaptive import AdaptiveBatchDispatcher, AdaptiveController
+from .dispatch import ConcurrentBatchDispatcher
 from .exceptions import ResponsysClientError
-from .utils import convert_to_list_of_dicts, convert_to_table_structure, split_dict
+from .instrumentation import AUTH_LOGIN, AUTH_REFRESH, AUTH_RELOGIN
+from .results import (MERGE_FAILED_PREFIX, REQUEST_FAILED_ERROR_CODE, MergeResult,
+                      parse_merge_results)
+from .scheduler import PriorityScheduler
+from .transport import RequestsTransport
+from .utils import convert_to_table_structure, split_dict
 
 
-class ResponsysClient(object):
+DeleteResults = namedtuple('DeleteResults', ['deleted', 'missing', 'failed'])
 
-    RESPONSYS_AUTH_PATH = '/rest/api/v1.1/auth/token'
-    RESPONSYS_RATE_LIMIT_WAITING_PERIOD_IN_SECONDS = 60
-    RESPONSYS_INVALID_TOKEN_RESPONSE_DETAIL = 'Not a valid authentication token'
-    RESPONSYS_RECORD_PROCESS_LIMIT_QUANTITY = 200
 
-    AUTH_TOKEN_REFRESH_THRESHOLD = timedelta(hours=1)
-    DEFAULT_REQUEST_TIMEOUT_IN_SECONDS = 60
+class ResponsysClient(BaseResponsysClient):
 
-    def __init__(self, username, password, login_url):
-        self.username = username
-        self.password = password
-        self.login_url = login_url
-        self.issued_url = None
-        self.auth_token = None
-        self.refresh_timestamp = None
+    DEFAULT_MAX_IN_FLIGHT_BATCHES = 4
+    DEFAULT_RIID_CACHE_SIZE = 100000
+    DEFAULT_RIID_CACHE_TTL_IN_SECONDS = 60 * 60
 
-    def get_profile_lists(self):
-        method = 'GET'
-        path = '/rest/api/v1.1/lists'
+    def __init__(self, username, password, login_url, transport=None, rate_limiter=None,
+                 retry_policy=None, riid_cache=None, metadata_cache=None, instrumentation=None,
+                 token_store=None, scheduler=None, executor=None, payload_encoder=None):
+        super(ResponsysClient, self).__init__(username, password, login_url,
+                                              rate_limiter=rate_limiter, retry_policy=retry_policy,
+                                              instrumentation=instrumentation,
+                                              token_store=token_store)
+        self._auth_lock = threading.RLock()
+        self._token_refresh_thread = None
+        self._token_refresh_stopped = threading.Event()
 
-        response = self.send_request(method, path)
+        # opt-in admission of requests by priority; see priority()
+        self.scheduler = scheduler
+        self._priorities = threading.local()
+        self._attempt_observers = threading.local()
 
-        self._check_for_valid_response(response)
+        # a shared executor for concurrent batches; by default each run gets its own threads
+        self.executor = executor
 
-        return response.json()
+        # opt-in pre-serialization and compression of merge payloads; see PayloadEncoder
+        self.payload_encoder = payload_encoder
 
-    def get_profile_list_extensions(self, profile_list):
-        method = 'GET'
-        path = '/rest/api/v1.1/lists/{}/listExtensions'.format(profile_list)
+        # one AdaptiveController per merge path, since record width differs between tables
+        self.adaptive_controllers = {}
+        self._adaptive_controllers_lock = threading.Lock()
 
-        response = self.send_request(method, path)
+        # maps (profile list, customer id) to RIID, which extension table rows share
+        self.riid_cache = riid_cache if riid_cache is not None else TTLCache(
+            self.DEFAULT_RIID_CACHE_SIZE, self.DEFAULT_RIID_CACHE_TTL_IN_SECONDS)
 
-        self._check_for_valid_response(response)
+        # opt-in cache for list and extension metadata, which rarely changes
+        self.metadata_cache = metadata_cache
 
-        return response.json()
+        # a transport passed in by the caller may be shared, so only close the one we create
+        self._owns_transport = transport is None
+        self.transport = transport if transport is not None else RequestsTransport()
+
+    def close(self):
+        self.stop_background_token_refresh()
+
+        if self._owns_transport:
+            self.transport.close()
+
+    def start_background_token_refresh(self, check_interval=60):
+        """Logs in and refreshes the token from a background thread before it is due.
+
+        The token is refreshed once it is within AUTH_TOKEN_PROACTIVE_REFRESH_LEAD of
+        AUTH_TOKEN_REFRESH_THRESHOLD, so requests never wait on a login or refresh themselves.
+        """
+        if self._token_refresh_thread is not None:
+            return
+
+        self._token_refresh_stopped.clear()
+        self._token_refresh_thread = threading.Thread(target=self._run_token_refresh,
+                                                      args=(check_interval,))
+        self._token_refresh_thread.daemon = True
+        self._token_refresh_thread.start()
+
+    def stop_background_token_refresh(self):
+        if self._token_refresh_thread is None:
+            return
+
+        self._token_refresh_stopped.set()
+        self._token_refresh_thread.join()
+        self._token_refresh_thread = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @contextmanager
+    def priority(self, priority):
+        """Sends the requests made by this thread within the block at the given priority.
+
+        Priorities are PriorityScheduler.HIGH, NORMAL and LOW and only take effect with a
+        scheduler, which orders in-flight slots by them; LOW requests also leave the rate
+        limiter's reserved tokens alone. Requests default to NORMAL, except those sent by the
+        batched and concurrent methods, which default to LOW.
+        """
+        previous_priority = getattr(self._priorities, 'current', None)
+        self._priorities.current = priority
+
+        try:
+            yield
+        finally:
+            self._priorities.current = previous_priority
+
+    def with_bulk_priority(self, send):
+        """Wraps send to run at the calling thread's priority, or LOW if it has none.
+
+        Call this in the thread that starts bulk work, then hand the wrapper to worker threads,
+        which do not inherit the caller's priority.
+        """
+        priority = getattr(self._priorities, 'current', None) or PriorityScheduler.LOW
+
+        def send_with_priority(item):
+            with self.priority(priority):
+                return send(item)
+
+        return send_with_priority
+
+    def get_profile_lists(self):
+        return self._get_metadata(('lists',), self._fetch_profile_lists)
+
+    def get_profile_list_extensions(self, profile_list):
+        return self._get_metadata(('listExtensions', profile_list),
+                                  lambda: self._fetch_profile_list_extensions(profile_list))
+
+    def invalidate_metadata_cache(self, profile_list=None):
+        """Drops cached metadata for one profile list's extensions, or everything if None."""
+        if self.metadata_cache is None:
+            return
+
+        if profile_list is None:
+            self.metadata_cache.clear()
+        else:
+            self.metadata_cache.delete(('listExtensions', profile_list))
 
     def merge_profile_list_members(self, profile_list, profile_dicts, merge_key):
         member_field_names, member_records = convert_to_table_structure(profile_dicts)
@@ -63,7 +165,11 @@ class ResponsysClient(object):
 
         self._check_for_valid_response(response)
 
-        return response.json()
+        parsed_response = self._decode_json(response)
+        self._cache_merged_riids(profile_list, member_field_names, member_records,
+                                 parsed_response)
+
+        return parsed_response
 
     def merge_profile_list_extension_members(self, profile_list, list_extension, data_dicts,
                                              merge_key):
@@ -77,7 +183,51 @@ class ResponsysClient(object):
 
         self._check_for_valid_response(response)
 
-        return response.json()
+        parsed_response = self._decode_json(response)
+        self._cache_merged_riids(profile_list, member_field_names, member_records,
+                                 parsed_response)
+
+        return parsed_response
+
+    def merge_profile_list_members_in_batches(self, profile_list, profile_dicts, merge_key):
+        """Merges any iterable of profile dicts, yielding the response of each batch.
+
+        Records are pulled from the iterable lazily and sent in batches of at most
+        RESPONSYS_RECORD_PROCESS_LIMIT_QUANTITY, so memory use does not grow with the input.
+        """
+        def send_batch(batch):
+            return self.merge_profile_list_members(profile_list, batch, merge_key)
+
+        return self._send_batches(send_batch, profile_dicts)
+
+    def merge_profile_list_extension_members_in_batches(self, profile_list, list_extension,
+                                                        data_dicts, merge_key):
+        def send_batch(batch):
+            return self.merge_profile_list_extension_members(profile_list, list_extension, batch,
+                                                             merge_key)
+
+        return self._send_batches(send_batch, data_dicts)
+
+    def merge_profile_list_members_concurrently(self, profile_list, profile_dicts, merge_key,
+                                                max_in_flight=DEFAULT_MAX_IN_FLIGHT_BATCHES):
+        """Merges any iterable of profile dicts with up to max_in_flight batches sent at once.
+
+        Yields a BatchResult for every batch, in input order. A batch that fails carries its error
+        on the result rather than stopping the remaining batches.
+        """
+        def send_batch(batch):
+            return self.merge_profile_list_members(profile_list, batch, merge_key)
+
+        return self._dispatch_batches(send_batch, profile_dicts, max_in_flight)
+
+    def merge_profile_list_extension_members_concurrently(
+            self, profile_list, list_extension, data_dicts, merge_key,
+            max_in_flight=DEFAULT_MAX_IN_FLIGHT_BATCHES):
+        def send_batch(batch):
+            return self.merge_profile_list_extension_members(profile_list, list_extension, batch,
+                                                             merge_key)
+
+        return self._dispatch_batches(send_batch, data_dicts, max_in_flight)
 
     def get_supplemental_table_members(self, folder, table, primary_keys, fields=('all',)):
         pk_names, pk_values = split_dict(primary_keys)
@@ -95,6 +245,51 @@ class ResponsysClient(object):
 
         return response.json()
 
+    def get_supplemental_table_members_by_keys(self, folder, table, key_fields, primary_keys,
+                                               fields=('all',),
+                                               max_in_flight=DEFAULT_MAX_IN_FLIGHT_BATCHES):
+        """Looks up many supplemental table rows, returning a dict of primary key to row dict.
+
+        primary_keys are tuples of values in key_fields order, or plain values for a single key
+        field, and are used as the keys of the result. The API retrieves one row per request, so
+        lookups are sent with up to max_in_flight in flight. Keys without a row are left out.
+        """
+        key_fields = list(key_fields) if isinstance(key_fields, (list, tuple)) else [key_fields]
+        path = ('/rest/api/v1.1/folders/{}/suppData/{}/members'
+                .format(folder, table))
+
+        def send_lookup(primary_key):
+            values = primary_key if isinstance(primary_key, tuple) else (primary_key,)
+            params = {
+                'fs': ','.join(fields),
+                'qa': key_fields,
+                'id': [str(value) for value in values],
+            }
+
+            response = self.send_request('GET', path, params=params)
+
+            if response.status_code == 404:
+                return None
+
+            self._check_for_valid_response(response)
+
+            members = self._parse_members(response)
+
+            return members[0] if members else None
+
+        rows_by_key = {}
+        dispatcher = ConcurrentBatchDispatcher(max_in_flight=max_in_flight,
+                                               executor=self.executor)
+
+        for result in dispatcher.dispatch(self.with_bulk_priority(send_lookup), primary_keys):
+            if result.error is not None:
+                raise result.error
+
+            if result.response is not None:
+                rows_by_key[result.records] = result.response
+
+        return rows_by_key
+
     def merge_supplemental_table_members(self, folder, table, data_dicts):
         member_field_names, member_records = convert_to_table_structure(data_dicts)
 
@@ -106,7 +301,124 @@ class ResponsysClient(object):
 
         self._check_for_valid_response(response)
 
-        return response.json()
+        return self._decode_json(response)
+
+    def merge_supplemental_table_members_in_batches(self, folder, table, data_dicts):
+        def send_batch(batch):
+            return self.merge_supplemental_table_members(folder, table, batch)
+
+        return self._send_batches(send_batch, data_dicts)
+
+    def merge_supplemental_table_members_concurrently(
+            self, folder, table, data_dicts, max_in_flight=DEFAULT_MAX_IN_FLIGHT_BATCHES):
+        def send_batch(batch):
+            return self.merge_supplemental_table_members(folder, table, batch)
+
+        return self._dispatch_batches(send_batch, data_dicts, max_in_flight)
+
+    def merge_profile_list_members_adaptively(self, profile_list, profile_dicts, merge_key,
+                                              controller=None):
+        """Merges any iterable of profile dicts in batches sized and paced by an AdaptiveController.
+
+        Batch size and the number of batches in flight start small and grow while merges stay fast,
+        and back off on slow merges, 429s and 5xx, including attempts that were retried. By default
+        the profile list's controller in adaptive_controllers is used, so what it learns carries
+        over to the next call. Yields a BatchResult for every batch, in input order, like
+        merge_profile_list_members_concurrently.
+        """
+        path = '/rest/api/v1.1/lists/{}/members'.format(profile_list)
+
+        def send_batch(batch):
+            return self.merge_profile_list_members(profile_list, batch, merge_key)
+
+        return self._dispatch_adaptively(path, send_batch, profile_dicts, controller)
+
+    def merge_profile_list_extension_members_adaptively(self, profile_list, list_extension,
+                                                        data_dicts, merge_key, controller=None):
+        path = ('/rest/api/v1.1/lists/{}/listExtensions/{}/members'
+                .format(profile_list, list_extension))
+
+        def send_batch(batch):
+            return self.merge_profile_list_extension_members(profile_list, list_extension, batch,
+                                                             merge_key)
+
+        return self._dispatch_adaptively(path, send_batch, data_dicts, controller)
+
+    def merge_supplemental_table_members_adaptively(self, folder, table, data_dicts,
+                                                    controller=None):
+        path = ('/rest/api/v1.1/folders/{}/suppData/{}/members'
+                .format(folder, table))
+
+        def send_batch(batch):
+            return self.merge_supplemental_table_members(folder, table, batch)
+
+        return self._dispatch_adaptively(path, send_batch, data_dicts, controller)
+
+    def get_adaptive_controller(self, path):
+        """Returns the AdaptiveController for a merge path, creating it on first use."""
+        with self._adaptive_controllers_lock:
+            controller = self.adaptive_controllers.get(path)
+
+            if controller is None:
+                controller = self.adaptive_controllers[path] = AdaptiveController(
+                    max_batch_size=self.RESPONSYS_RECORD_PROCESS_LIMIT_QUANTITY)
+
+            return controller
+
+    def merge_profile_list_members_with_results(self, profile_list, profile_dicts, merge_key,
+                                                max_record_retries=0):
+        """Merges profile dicts and returns a MergeResult per record, in input order.
+
+        Each result holds the record's RIID, or the error code and message Responsys rejected it
+        with. Records that failed with a retryable error code are merged again on their own, up to
+        max_record_retries times, so the rest of the batch is never re-sent. If a retry request
+        fails, only its records fail, with the REQUEST_FAILED error code and the error as message.
+        """
+        def merge(records):
+            return self.merge_profile_list_members(profile_list, records, merge_key)
+
+        return self._merge_with_results(merge, profile_dicts, max_record_retries)
+
+    def merge_profile_list_extension_members_with_results(self, profile_list, list_extension,
+                                                          data_dicts, merge_key,
+                                                          max_record_retries=0):
+        def merge(records):
+            return self.merge_profile_list_extension_members(profile_list, list_extension,
+                                                             records, merge_key)
+
+        return self._merge_with_results(merge, data_dicts, max_record_retries)
+
+    def merge_supplemental_table_members_with_results(self, folder, table, data_dicts,
+                                                      max_record_retries=0):
+        def merge(records):
+            return self.merge_supplemental_table_members(folder, table, records)
+
+        return self._merge_with_results(merge, data_dicts, max_record_retries)
+
+    def buffer_profile_list_members(self, profile_list, merge_key, **options):
+        """Returns a MergeBuffer that coalesces profile upserts into batched merges.
+
+        Records are deduplicated by merge_key. Options are passed on to MergeBuffer, e.g.
+        max_delay, merge_fields and on_error. Close the buffer to send what is still pending.
+        """
+        def send_batch(records):
+            return self.merge_profile_list_members(profile_list, records, merge_key)
+
+        return MergeBuffer(self.with_bulk_priority(send_batch), merge_key, **options)
+
+    def buffer_profile_list_extension_members(self, profile_list, list_extension, merge_key,
+                                              **options):
+        def send_batch(records):
+            return self.merge_profile_list_extension_members(profile_list, list_extension,
+                                                             records, merge_key)
+
+        return MergeBuffer(self.with_bulk_priority(send_batch), merge_key, **options)
+
+    def buffer_supplemental_table_members(self, folder, table, key_fields, **options):
+        def send_batch(records):
+            return self.merge_supplemental_table_members(folder, table, records)
+
+        return MergeBuffer(self.with_bulk_priority(send_batch), key_fields, **options)
 
     def get_profile_list_member(self, profile_list, customer_id):
         method = 'GET'
@@ -122,6 +434,7 @@ class ResponsysClient(object):
         self._check_for_valid_response(response)
 
         members = self._parse_members(response)
+        self._cache_member_riid(profile_list, members[0])
 
         return members[0]
 
@@ -140,169 +453,556 @@ class ResponsysClient(object):
         self._check_for_valid_response(response)
 
         members = self._parse_members(response)
+        self._cache_member_riid(profile_list, members[0])
 
         return members[0]
 
+    def get_profile_list_members(self, profile_list, ids, query_attribute='c', fields=('all',),
+                                 max_in_flight=1, as_rows=False):
+        """Retrieves many profile list members at once, returning a dict of id to member.
+
+        Ids are matched against the column named by query_attribute ('r', 'c', 'e' or 'm') and
+        requested RESPONSYS_RECORD_PROCESS_LIMIT_QUANTITY at a time, with up to max_in_flight
+        requests outstanding. Ids without a matching member are left out of the result. With
+        as_rows, members are compact MemberRow objects rather than dicts.
+        """
+        path = '/rest/api/v1.1/lists/{}/members?action=get'.format(profile_list)
+
+        return self._get_members_by_ids(profile_list, path, ids, query_attribute, fields,
+                                        max_in_flight, as_rows)
+
+    def get_extension_table_members(self, profile_list, list_extension, ids, query_attribute='c',
+                                    fields=('all',), max_in_flight=1, as_rows=False):
+        path = ('/rest/api/v1.1/lists/{}/listExtensions/{}/members?action=get'
+                .format(profile_list, list_extension))
+
+        return self._get_members_by_ids(profile_list, path, ids, query_attribute, fields,
+                                        max_in_flight, as_rows)
+
+    def iter_profile_list_members(self, profile_list, ids, query_attribute='c', fields=('all',),
+                                  max_in_flight=1):
+        """Retrieves many profile list members, yielding a MemberRow per member found.
+
+        Ids are requested in batches like get_profile_list_members, but no dict is built: each
+        response is kept as MemberRecords and a row is only created once iteration reaches it.
+        Rows are yielded in response order as batches arrive.
+        """
+        path = '/rest/api/v1.1/lists/{}/members?action=get'.format(profile_list)
+
+        return self._iter_member_rows(profile_list, path, ids, query_attribute, fields,
+                                      max_in_flight)
+
+    def iter_extension_table_members(self, profile_list, list_extension, ids,
+                                     query_attribute='c', fields=('all',), max_in_flight=1):
+        path = ('/rest/api/v1.1/lists/{}/listExtensions/{}/members?action=get'
+                .format(profile_list, list_extension))
+
+        return self._iter_member_rows(profile_list, path, ids, query_attribute, fields,
+                                      max_in_flight)
+
     def delete_profile_list_member(self, profile_list, customer_id):
-        member = self.get_profile_list_member(profile_list, customer_id)
+        lookup_path = '/rest/api/v1.1/lists/{}/members/'.format(profile_list)
 
-        method = 'DELETE'
-        path = '/rest/api/v1.1/lists/{}/members/{}'.format(profile_list, member['RIID_'])
+        def send_delete(riid):
+            path = '/rest/api/v1.1/lists/{}/members/{}'.format(profile_list, riid)
+            return self.send_request('DELETE', path)
 
-        response = self.send_request(method, path)
+        self._delete_member_by_riid(profile_list, customer_id, lookup_path, send_delete)
 
-        self._check_for_valid_response(response)
+        self.riid_cache.delete((profile_list, str(customer_id)))
 
     def delete_list_extension_member(self, profile_list, list_extension, customer_id):
-        member = self.get_extension_table_member(profile_list, list_extension, customer_id)
+        lookup_path = ('/rest/api/v1.1/lists/{}/listExtensions/{}/members'
+                       .format(profile_list, list_extension))
 
-        method = 'DELETE'
-        path = ('/rest/api/v1.1/lists/{}/listExtensions/{}/members/{}'
-                .format(profile_list, list_extension, member['RIID_']))
+        def send_delete(riid):
+            path = ('/rest/api/v1.1/lists/{}/listExtensions/{}/members/{}'
+                    .format(profile_list, list_extension, riid))
+            return self.send_request('DELETE', path)
 
-        response = self.send_request(method, path)
+        self._delete_member_by_riid(profile_list, customer_id, lookup_path, send_delete)
 
-        self._check_for_valid_response(response)
+    def delete_profile_list_members(self, profile_list, customer_ids,
+                                    max_in_flight=DEFAULT_MAX_IN_FLIGHT_BATCHES):
+        """Deletes many profile list members, returning DeleteResults of customer ids.
+
+        RIIDs missing from riid_cache are looked up in batches that only fetch the RIID_ field,
+        then the deletes are sent with up to max_in_flight in flight. Customer ids without a
+        member are reported as missing, and failed deletes map to their error.
+        """
+        def get_riids(customer_ids_to_resolve):
+            return self.get_profile_list_members(profile_list, customer_ids_to_resolve,
+                                                 fields=('RIID_',), max_in_flight=max_in_flight)
+
+        def build_path(riid):
+            return '/rest/api/v1.1/lists/{}/members/{}'.format(profile_list, riid)
+
+        results = self._delete_members_by_riid(profile_list, customer_ids, get_riids, build_path,
+                                               max_in_flight)
+
+        for customer_id in results.deleted:
+            self.riid_cache.delete((profile_list, str(customer_id)))
+
+        return results
+
+    def delete_list_extension_members(self, profile_list, list_extension, customer_ids,
+                                      max_in_flight=DEFAULT_MAX_IN_FLIGHT_BATCHES):
+        def get_riids(customer_ids_to_resolve):
+            return self.get_extension_table_members(profile_list, list_extension,
+                                                    customer_ids_to_resolve, fields=('RIID_',),
+                                                    max_in_flight=max_in_flight)
+
+        def build_path(riid):
+            return ('/rest/api/v1.1/lists/{}/listExtensions/{}/members/{}'
+                    .format(profile_list, list_extension, riid))
+
+        return self._delete_members_by_riid(profile_list, customer_ids, get_riids, build_path,
+                                            max_in_flight)
 
     def send_profile_list_merge_request(self, path, merge_key, member_field_names, member_records):
         self._check_for_record_limit_quantity(member_records)
+        json = self._build_profile_list_merge_json(merge_key, member_field_names, member_records)
 
-        json = {
-            "recordData": {
-                "fieldNames": member_field_names,
-                "records": member_records,
-                "mapTemplateName": None
-            },
-            "mergeRule": {
-                "htmlValue": "H",
-                "optinValue": "I",
-                "textValue": "T",
-                "insertOnNoMatch": True,
-                "updateOnMatch": "REPLACE_ALL",
-                "matchColumnName1": merge_key,
-                "matchColumnName2": None,
-                "matchOperator": "NONE",
-                "optoutValue": "O",
-                "rejectRecordIfChannelEmpty": None,
-                "defaultPermissionStatus": "OPTIN"
-            }
-        }
-
-        return self.send_request('POST', path, json=json)
+        return self._send_merge_request(path, json)
 
     def send_extension_table_merge_request(self, path, merge_key, member_field_names,
                                            member_records):
         self._check_for_record_limit_quantity(member_records)
+        json = self._build_extension_table_merge_json(merge_key, member_field_names,
+                                                      member_records)
 
-        json = {
-                "recordData": {
-                    "fieldNames": member_field_names,
-                    "records": member_records,
-                    "mapTemplateName": None
-                },
-                "insertOnNoMatch": True,
-                "updateOnMatch": "REPLACE_ALL",
-                "matchColumnName1": merge_key
-        }
-
-        return self.send_request('POST', path, json=json)
+        return self._send_merge_request(path, json)
 
     def send_supplemental_table_merge_request(self, path, member_field_names, member_records):
         self._check_for_record_limit_quantity(member_records)
+        json = self._build_supplemental_table_merge_json(member_field_names, member_records)
 
-        json = {
-                "recordData": {
-                    "fieldNames": member_field_names,
-                    "records": member_records,
-                    "mapTemplateName": None
-                },
-                "insertOnNoMatch": True,
-                "updateOnMatch": "REPLACE_ALL"
-        }
+        return self._send_merge_request(path, json)
 
-        return self.send_request('POST', path, json=json)
+    def send_request(self, method, path, params=None, json=None, body=None):
+        """Sends an authenticated request; body is an EncodedBody sent in place of json."""
+        if self.scheduler is None:
+            return self._send_authenticated_request(method, path, params=params, json=json,
+                                                    body=body)
 
-    def send_request(self, method, path, params=None, json=None):
-        self._get_access_items()
+        priority = getattr(self._priorities, 'current', None) or PriorityScheduler.NORMAL
 
-        url = urljoin(self.issued_url, path)
-        headers = {'Authorization': self.auth_token}
+        with self.scheduler.slot(priority):
+            return self._send_authenticated_request(method, path, params=params, json=json,
+                                                    body=body)
 
-        response = self._send_request(method, url, headers=headers, json=json, params=params)
+    def _send_merge_request(self, path, json):
+        if self.payload_encoder is None:
+            return self.send_request('POST', path, json=json)
+
+        return self.send_request('POST', path, body=self.payload_encoder.encode_merge(json))
+
+    def _send_authenticated_request(self, method, path, params=None, json=None, body=None):
+        auth_token, issued_url = self._get_access_items_safely()
+
+        url = urljoin(issued_url, path)
+        headers = self._build_request_headers(auth_token, body)
+
+        response = self._send_request(method, url, headers=headers, json=json, params=params,
+                                      body=body)
 
         # this retries the request if authentication is revoked
         if response.status_code == 401 or self._is_invalid_token_response(response):
-            self._login()
-            headers = {'Authorization': self.auth_token}
+            auth_token = self._login_if_token_unchanged(auth_token)
+            headers = self._build_request_headers(auth_token, body)
 
             response = self._send_request(method, url, headers=headers, json=json, params=params,
-                                          retry=True)
+                                          body=body)
 
         return response
 
     def unsubscribe_list_member(self, profile_list, customer_id):
-        profile_dict = {
-            'CUSTOMER_ID_': str(customer_id),
-            'EMAIL_PERMISSION_STATUS_': 'O',
-        }
+        profile_dict = self._build_unsubscribe_profile_dict(customer_id)
         response = self.merge_profile_list_members(profile_list, [profile_dict], 'CUSTOMER_ID_')
         return response
 
-    def _send_request(self, method, url, params=None, json=None, headers=None, retry=False):
+    def _send_request(self, method, url, params=None, json=None, headers=None, body=None):
+        endpoint_class = self.rate_limiter.classify(method, url)
+        data = body.data if body is not None else None
+        measurement = self._start_request_measurement(method, url, endpoint_class)
+        # like the scheduler's slots, part of the rate budget is kept from LOW priority requests
+        priority = (getattr(self._priorities, 'current', None)
+                    if self.scheduler is not None else None)
+        attempt = 0
+
+        while True:
+            attempt += 1
+            throttle_wait = self.rate_limiter.wait(endpoint_class, priority)
+
+            if measurement is not None:
+                measurement.attempts = attempt
+                measurement.throttle_wait += throttle_wait
+
+            attempt_started_at = time.time()
+
+            try:
+                response = self._send_transport_request(method, url, params, json, data, headers)
+            except requests.exceptions.RequestException as error:
+                self._observe_attempt(endpoint_class, attempt_started_at)
+
+                if self.retry_policy.should_retry_exception(method, url, error, attempt):
+                    retry_wait = self.retry_policy.wait_before_retry(attempt)
+
+                    if measurement is not None:
+                        measurement.retry_wait += retry_wait
+                    continue
+
+                if measurement is not None:
+                    measurement.finish(json or body, error=error)
+
+                if isinstance(error, requests.exceptions.Timeout):
+                    raise ResponsysClientError('There was a timeout error sending a request to '
+                                               'Responsys. Method: {}, URL: {}'
+                                               .format(method, url))
+                raise
+
+            self._observe_attempt(endpoint_class, attempt_started_at, response)
+            self._record_rate_limit_outcome(endpoint_class, response)
+
+            if not self.retry_policy.should_retry_response(method, url, response, attempt):
+                if measurement is not None:
+                    measurement.finish(json or body, response=response)
+
+                return response
+
+            if self._should_back_off_before_retry(response):
+                retry_wait = self.retry_policy.wait_before_retry(attempt)
+
+                if measurement is not None:
+                    measurement.retry_wait += retry_wait
+
+    def _send_transport_request(self, method, url, params, json, data, headers):
+        # data is only passed when there is an encoded body, for transports that do not take it
+        options = {'data': data} if data is not None else {}
+
+        return self.transport.request(method, url, params=params, json=json, headers=headers,
+                                      timeout=self.DEFAULT_REQUEST_TIMEOUT_IN_SECONDS, **options)
+
+    @staticmethod
+    def _build_request_headers(auth_token, body):
+        headers = {'Authorization': auth_token}
+
+        if body is not None:
+            headers.update(body.headers)
+
+        return headers
+
+    def _decode_json(self, response):
+        if self.payload_encoder is None:
+            return response.json()
+
+        return self.payload_encoder.decode(response)
+
+    def _send_batches(self, send_batch, records):
+        # the priority is taken when the method is called, while nothing is sent until iteration
+        send_with_priority = self.with_bulk_priority(send_batch)
+
+        return (send_with_priority(batch) for batch in self._batch_records(records))
+
+    def _dispatch_batches(self, send_batch, records, max_in_flight):
+        dispatcher = ConcurrentBatchDispatcher(max_in_flight=max_in_flight,
+                                               executor=self.executor)
+
+        return dispatcher.dispatch(self.with_bulk_priority(send_batch),
+                                   self._batch_records(records))
+
+    def _dispatch_adaptively(self, path, send_batch, records, controller):
+        dispatcher = AdaptiveBatchDispatcher(controller or self.get_adaptive_controller(path),
+                                             executor=self.executor)
+        send_with_priority = self.with_bulk_priority(send_batch)
+
+        def send_observed_batch(batch, record_attempt):
+            with self._observing_attempts(record_attempt):
+                return send_with_priority(batch)
+
+        return dispatcher.dispatch(send_observed_batch, records)
+
+    @contextmanager
+    def _observing_attempts(self, observer):
+        # lets _send_request report every attempt, including ones the retry policy absorbs
+        previous_observer = getattr(self._attempt_observers, 'current', None)
+        self._attempt_observers.current = observer
+
         try:
-            response = requests.request(method, url, params=params, json=json, headers=headers,
-                                        timeout=self.DEFAULT_REQUEST_TIMEOUT_IN_SECONDS)
-        except requests.exceptions.Timeout:
-            raise ResponsysClientError('There was a timeout error sending a request to Responsys.'
-                                       'Method: {}, URL: {}'.format(method, url))
-       
-        if not retry and response.status_code == 429:
-            time.sleep(self.RESPONSYS_RATE_LIMIT_WAITING_PERIOD_IN_SECONDS)
+            yield
+        finally:
+            self._attempt_observers.current = previous_observer
 
-            response = self._send_request(method, url, headers=headers, retry=True)
+    def _observe_attempt(self, endpoint_class, started_at, response=None):
+        observer = getattr(self._attempt_observers, 'current', None)
 
-        return response
+        # a login or token refresh inside the block says nothing about the merges being tuned
+        if observer is None or endpoint_class == self.rate_limiter.AUTH:
+            return
+
+        if response is None:
+            observer(time.time() - started_at, 0, None)
+            return
+
+        body = getattr(getattr(response, 'request', None), 'body', None) or b''
+        observer(time.time() - started_at, len(body), response.status_code)
+
+    def _merge_with_results(self, merge, records, max_record_retries):
+        records = list(records)
+        results = [None] * len(records)
+        pending_positions = list(range(len(records)))
+        attempt = 0
+
+        while pending_positions:
+            attempt += 1
+            pending_records = [records[position] for position in pending_positions]
+
+            if attempt == 1:
+                merge_results = parse_merge_results(pending_records, merge(pending_records))
+            else:
+                merge_results = self._retry_merge(merge, pending_records)
+
+            retry_positions = []
+            for position, result in zip(pending_positions, merge_results):
+                results[position] = result
+
+                if result.retryable and attempt <= max_record_retries:
+                    retry_positions.append(position)
+
+            if retry_positions:
+                self.retry_policy.wait_before_retry(attempt)
+
+            pending_positions = retry_positions
 
-    def _check_for_record_limit_quantity(self, member_records):
-        limit = self.RESPONSYS_RECORD_PROCESS_LIMIT_QUANTITY
-        if len(member_records) > limit:
-            raise ResponsysClientError('A max of {} members may be created or updated at '
-                                       'one time.'.format(limit))
+        return results
 
     @staticmethod
-    def _check_for_valid_response(response, expected_status_code=200):
-        if response.status_code != expected_status_code:
-            request = response.request
-
-            raise ResponsysClientError('There was an issue sending a request to Responsys. '
-                                       'Request Method: {}. Request Path: {}. Request Body: {}.'
-                                       'Response Status Code: {}. Response Text: {}.'
-                                       .format(request.method, request.path_url, request.body,
-                                               response.status_code, response.text))
-
-    def _is_invalid_token_response(self, response):
-        invalid = False
-        if response.status_code == 500:
-            try:
-                detail = response.json().get('detail')
-            except AttributeError:
-                pass
+    def _retry_merge(merge, records):
+        # a failed retry only fails the re-sent records; the rest of the batch already merged
+        try:
+            return parse_merge_results(records, merge(records))
+        except Exception as error:
+            return [MergeResult(record, None, REQUEST_FAILED_ERROR_CODE, str(error))
+                    for record in records]
+
+    def _fetch_profile_lists(self):
+        method = 'GET'
+        path = '/rest/api/v1.1/lists'
+
+        response = self.send_request(method, path)
+
+        self._check_for_valid_response(response)
+
+        return response.json()
+
+    def _fetch_profile_list_extensions(self, profile_list):
+        method = 'GET'
+        path = '/rest/api/v1.1/lists/{}/listExtensions'.format(profile_list)
+
+        response = self.send_request(method, path)
+
+        self._check_for_valid_response(response)
+
+        return response.json()
+
+    def _get_metadata(self, cache_key, fetch):
+        if self.metadata_cache is None:
+            return fetch()
+
+        # callers get their own copy so they cannot mutate the cached value
+        return copy.deepcopy(self.metadata_cache.get_or_load(cache_key, fetch))
+
+    def _get_members_by_ids(self, profile_list, path, ids, query_attribute, fields,
+                            max_in_flight, as_rows=False):
+        def send_batch(batch):
+            response = self._send_member_retrieval(path, batch, query_attribute, fields)
+
+            if as_rows:
+                return self._parse_member_records(response)
+
+            return self._parse_members(response)
+
+        members_by_id = {}
+        for result in self._dispatch_batches(send_batch, ids, max_in_flight):
+            if result.error is not None:
+                raise result.error
+
+            members_by_id.update(self._map_members_by_id(result.records, result.response,
+                                                         query_attribute))
+
+        if query_attribute == 'c':
+            for member in members_by_id.values():
+                self._cache_member_riid(profile_list, member)
+
+        return members_by_id
+
+    def _iter_member_rows(self, profile_list, path, ids, query_attribute, fields, max_in_flight):
+        def send_batch(batch):
+            response = self._send_member_retrieval(path, batch, query_attribute, fields)
+
+            return self._parse_member_records(response)
+
+        for result in self._dispatch_batches(send_batch, ids, max_in_flight):
+            if result.error is not None:
+                raise result.error
+
+            for row in result.response:
+                if query_attribute == 'c':
+                    self._cache_member_riid(profile_list, row)
+
+                yield row
+
+    def _send_member_retrieval(self, path, ids, query_attribute, fields):
+        json = self._build_member_retrieval_json(ids, query_attribute, fields)
+
+        response = self.send_request('POST', path, json=json)
+
+        self._check_for_valid_response(response)
+
+        return response
+
+    def _get_member_riid(self, profile_list, lookup_path, customer_id):
+        params = {
+            'qa': 'c',
+            'id': str(customer_id),
+            'fs': 'RIID_'
+        }
+
+        response = self.send_request('GET', lookup_path, params=params)
+
+        self._check_for_valid_response(response)
+
+        riid = self._parse_members(response)[0]['RIID_']
+        self.riid_cache.set((profile_list, str(customer_id)), riid)
+
+        return riid
+
+    def _delete_member_by_riid(self, profile_list, customer_id, lookup_path, send_delete):
+        cache_key = (profile_list, str(customer_id))
+
+        riid = self.riid_cache.get(cache_key)
+        if riid is not None:
+            response = send_delete(riid)
+
+            if response.status_code != 404:
+                self._check_for_valid_response(response)
+                return
+
+            # the cached RIID no longer exists, so look the member up again
+            self.riid_cache.delete(cache_key)
+
+        riid = self._get_member_riid(profile_list, lookup_path, customer_id)
+
+        response = send_delete(riid)
+
+        self._check_for_valid_response(response)
+
+    def _delete_members_by_riid(self, profile_list, customer_ids, get_riids, build_path,
+                                max_in_flight):
+        cached_riids_by_id = []
+        unresolved_ids = []
+
+        for customer_id in customer_ids:
+            riid = self.riid_cache.get((profile_list, str(customer_id)))
+
+            if riid is None:
+                unresolved_ids.append(customer_id)
             else:
-                if detail == self.RESPONSYS_INVALID_TOKEN_RESPONSE_DETAIL:
-                    invalid = True
+                cached_riids_by_id.append((customer_id, riid))
+
+        riids_by_id, missing = self._resolve_riids(unresolved_ids, get_riids)
+        deleted = []
+        failed = {}
 
-        return invalid
+        stale_ids = self._send_deletes(cached_riids_by_id, build_path, max_in_flight, deleted,
+                                       failed)
+        missing.extend(self._send_deletes(riids_by_id, build_path, max_in_flight, deleted,
+                                          failed))
+
+        if stale_ids:
+            # a cached RIID 404s once its member was deleted and re-created, so look it up again
+            for customer_id in stale_ids:
+                self.riid_cache.delete((profile_list, str(customer_id)))
+
+            riids_by_id, stale_missing = self._resolve_riids(stale_ids, get_riids)
+            missing.extend(stale_missing)
+            missing.extend(self._send_deletes(riids_by_id, build_path, max_in_flight, deleted,
+                                              failed))
+
+        return DeleteResults(deleted, missing, failed)
 
     @staticmethod
-    def _parse_members(response):
-        parsed_response = response.json()
+    def _resolve_riids(customer_ids, get_riids):
+        riids_by_id = []
+        missing = []
+
+        if customer_ids:
+            members_by_id = get_riids(customer_ids)
 
-        field_names = parsed_response['recordData']['fieldNames']
-        records = parsed_response['recordData']['records']
+            for customer_id in customer_ids:
+                member = members_by_id.get(customer_id)
 
-        members = convert_to_list_of_dicts(field_names, records)
+                if member is None:
+                    missing.append(customer_id)
+                else:
+                    riids_by_id.append((customer_id, member['RIID_']))
 
-        return members
+        return riids_by_id, missing
+
+    def _send_deletes(self, riids_by_id, build_path, max_in_flight, deleted, failed):
+        """Deletes members by RIID, returning the customer ids whose RIID was not found."""
+        def send_delete(customer_id_and_riid):
+            response = self.send_request('DELETE', build_path(customer_id_and_riid[1]))
+
+            if response.status_code == 404:
+                return False
+
+            self._check_for_valid_response(response)
+
+            return True
+
+        not_found = []
+        dispatcher = ConcurrentBatchDispatcher(max_in_flight=max_in_flight,
+                                               executor=self.executor)
+
+        for result in dispatcher.dispatch(self.with_bulk_priority(send_delete), riids_by_id):
+            customer_id = result.records[0]
+
+            if result.error is not None:
+                failed[customer_id] = result.error
+            elif result.response:
+                deleted.append(customer_id)
+            else:
+                not_found.append(customer_id)
+
+        return not_found
+
+    def _cache_member_riid(self, profile_list, member):
+        riid = member.get('RIID_')
+        customer_id = member.get('CUSTOMER_ID_')
+
+        if riid and customer_id is not None:
+            self.riid_cache.set((profile_list, str(customer_id)), riid)
+
+    def _cache_merged_riids(self, profile_list, member_field_names, member_records,
+                            parsed_response):
+        # merge responses list one RIID, or a failure message, per input record in order
+        if not isinstance(parsed_response, dict) or 'CUSTOMER_ID_' not in member_field_names:
+            return
+
+        record_data = parsed_response.get('recordData') or {}
+        field_names = record_data.get('fieldNames') or []
+        if 'RIID_' not in field_names:
+            return
+
+        riid_index = field_names.index('RIID_')
+        customer_id_index = member_field_names.index('CUSTOMER_ID_')
+        for member_record, record in zip(member_records, record_data.get('records') or []):
+            riid = record[riid_index]
+            customer_id = member_record[customer_id_index]
+
+            if riid and customer_id is not None and not str(riid).startswith(MERGE_FAILED_PREFIX):
+                self.riid_cache.set((profile_list, str(customer_id)), riid)
 
     def _get_access_items(self):
         if not self.auth_token:
@@ -310,53 +1010,77 @@ class ResponsysClient(object):
         elif self._time_to_refresh_token():
             self._refresh_token()
 
-    def _time_to_refresh_token(self):
-        return (self._now_utc_aware() - self.refresh_timestamp) > self.AUTH_TOKEN_REFRESH_THRESHOLD
+    def _get_access_items_safely(self):
+        access_items = self._access_items
 
-    @staticmethod
-    def _now_utc_aware():
-        return datetime.utcnow().replace(tzinfo=pytz.utc)
-
-    def _login(self):
-        method = 'POST'
-        path = self.RESPONSYS_AUTH_PATH
-        url = urljoin(self.login_url, path)
-        params = {'user_name': self.username,
-                  'password': self.password,
-                  'auth_type': 'password'}
-        headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+        # a token that is not due is read without the lock, so a background refresh never blocks
+        if access_items.auth_token and not self._time_to_refresh_token(
+                refresh_timestamp=access_items.refresh_timestamp):
+            return access_items.auth_token, access_items.issued_url
 
+        # serializes login and refresh so concurrent workers share a single token
+        with self._auth_lock:
+            if not self.auth_token or self._time_to_refresh_token():
+                with self.token_store.lock():
+                    # another client or process sharing the store may have logged in already
+                    self._load_access_items()
+                    self._get_access_items()
+
+            return self.auth_token, self.issued_url
+
+    def _login_if_token_unchanged(self, stale_auth_token):
+        # another thread may have already replaced the rejected token while this one waited
+        with self._auth_lock, self.token_store.lock():
+            self._load_access_items()
+
+            if self.auth_token == stale_auth_token:
+                self._login(auth_kind=AUTH_RELOGIN)
+
+            return self.auth_token
+
+    def _refresh_access_items_proactively(self):
+        with self._auth_lock, self.token_store.lock():
+            self._load_access_items()
+
+            if not self.auth_token:
+                self._login()
+                return
+
+        if self._time_to_refresh_token(lead=self.AUTH_TOKEN_PROACTIVE_REFRESH_LEAD):
+            # no lock is held during the call; requests keep the current token until the new
+            # access items replace it
+            self._refresh_token()
+
+    def _run_token_refresh(self, check_interval):
+        while not self._token_refresh_stopped.is_set():
+            try:
+                self._refresh_access_items_proactively()
+            except Exception:
+                # a failed refresh is retried on the next check, or inline by the next request
+                pass
+
+            self._token_refresh_stopped.wait(check_interval)
+
+    def _login(self, auth_kind=AUTH_LOGIN):
+        method, url, params, headers = self._build_login_request()
+
+        started_at = self._start_auth_measurement()
         response = self._send_request(method, url, params=params, headers=headers)
+        self._finish_auth_measurement(auth_kind, started_at, response)
 
-        if response.status_code != 200:
-            raise ResponsysClientError('There was an issue sending a login request '
-                                       'to Responsys. Status Code: {}. Response Text: {}'
-                                       .format(response.status_code, response.text))
+        self._check_for_valid_login_response(response)
 
         self._update_access_items(response)
 
     def _refresh_token(self):
-        method = 'POST'
-        path = self.RESPONSYS_AUTH_PATH
-        params = {'auth_type': 'token'}
-        url = urljoin(self.issued_url, path)
-        headers = {'Authorization': self.auth_token}
+        method, url, params, headers = self._build_refresh_token_request()
 
+        started_at = self._start_auth_measurement()
         response = self._send_request(method, url, params=params, headers=headers)
+        self._finish_auth_measurement(AUTH_REFRESH, started_at, response)
 
         if response.status_code != 200:
             self._login()
             return
 
         self._update_access_items(response)
-
-    def _update_access_items(self, response):
-        parsed_response = response.json()
-
-        # this comes back in javascript format and must be converted
-        unaware_timestamp = datetime.utcfromtimestamp(parsed_response['issuedAt']/1000)
-        utc_timestamp = unaware_timestamp.replace(tzinfo=pytz.UTC)
-
-        self.refresh_timestamp = utc_timestamp
-        self.auth_token = parsed_response['authToken']
-        self.issued_url = parsed_response['endPoint']
@@ -0,0 +1,56 @@
+from collections import deque, namedtuple
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+
+BatchResult = namedtuple('BatchResult', ['index', 'records', 'response', 'error'])
+
+
+class ConcurrentBatchDispatcher(object):
+    """Sends batches on a thread pool while keeping a bounded number of requests in flight.
+
+    Results are yielded as BatchResult tuples in the same order the batches were read. An error
+    raised while sending a batch is stored on its result instead of stopping the run.
+    """
+
+    DEFAULT_MAX_IN_FLIGHT = 4
+
+    def __init__(self, max_in_flight=DEFAULT_MAX_IN_FLIGHT, executor=None):
+        if max_in_flight < 1:
+            raise ValueError('max_in_flight must be at least 1.')
+
+        self.max_in_flight = max_in_flight
+        self.executor = executor
+
+    def dispatch(self, send_batch, batches):
+        pending = deque()
+
+        with self._executor() as executor:
+            for index, batch in enumerate(batches):
+                pending.append((index, batch, executor.submit(send_batch, batch)))
+
+                if len(pending) >= self.max_in_flight:
+                    yield self._collect(*pending.popleft())
+
+            while pending:
+                yield self._collect(*pending.popleft())
+
+    @contextmanager
+    def _executor(self):
+        executor = self.executor or ThreadPoolExecutor(max_workers=self.max_in_flight)
+
+        try:
+            yield executor
+        finally:
+            # only shut down an executor we created; a shared one belongs to the caller
+            if self.executor is None:
+                executor.shutdown(wait=True)
+
+    @staticmethod
+    def _collect(index, batch, future):
+        try:
+            response = future.result()
+        except Exception as error:
+            return BatchResult(index, batch, None, error)
+
+        return BatchResult(index, batch, response, None)
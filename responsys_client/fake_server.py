@@ -0,0 +1,446 @@
+"""An in-process fake of the Responsys REST API for benchmarks and integration tests.
+
+FakeResponsysServer serves the authentication, profile list, list extension and supplemental
+table routes used by ResponsysClient from memory. Latency, token expiry and 429 throttling are
+configurable, and the server counts requests and accepted connections so connection reuse can be
+measured.
+"""
+import gzip
+import io
+import json
+import re
+import sys
+import threading
+import time
+import uuid
+
+if sys.version_info >= (3,0):
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qs, urlsplit
+else:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import parse_qs, urlsplit
+
+
+API_PREFIX = '/rest/api/v1.1'
+
+QUERY_ATTRIBUTE_FIELD_NAMES = {
+    'r': 'RIID_',
+    'c': 'CUSTOMER_ID_',
+    'e': 'EMAIL_ADDRESS_',
+    'm': 'MOBILE_NUMBER_',
+}
+
+INVALID_TOKEN_DETAIL = 'Not a valid authentication token'
+
+
+def build_record_data(members, field_list):
+    if 'all' in field_list:
+        field_names = sorted(set(key for member in members for key in member))
+    else:
+        field_names = list(field_list)
+
+    records = [[member.get(name) for name in field_names] for member in members]
+
+    return {'recordData': {'fieldNames': field_names, 'records': records,
+                           'mapTemplateName': None}}
+
+
+class FakeTable(object):
+
+    def __init__(self):
+        self.members = {}
+        self._index = {}
+
+    def find(self, field_name, value):
+        riid = self._index.get((field_name, str(value)))
+        member = self.members.get(riid)
+
+        # index entries are not removed on update or delete, so confirm they still match
+        if member is None or str(member.get(field_name)) != str(value):
+            return None, None
+
+        return riid, member
+
+    def delete(self, riid):
+        return self.members.pop(riid, None)
+
+    def merge(self, match_field_names, field_names, records, allocate_riid):
+        riids = []
+
+        for record in records:
+            values = dict(zip(field_names, record))
+            riid = None
+
+            for match_field_name in match_field_names:
+                riid, _ = self.find(match_field_name, values.get(match_field_name))
+                if riid is not None:
+                    break
+
+            if riid is None:
+                riid = values.get('RIID_') or allocate_riid(values)
+                if riid is None:
+                    riids.append('MERGEFAILED: Record not found in the profile list')
+                    continue
+
+                self.members[riid] = {'RIID_': riid}
+
+            member = self.members[riid]
+            member.update(values)
+            for field_name, value in member.items():
+                self._index[(field_name, str(value))] = riid
+
+            riids.append(riid)
+
+        return riids
+
+    def retrieve(self, query_attribute, ids, field_list):
+        field_name = QUERY_ATTRIBUTE_FIELD_NAMES.get(query_attribute, query_attribute)
+        members = []
+
+        for member_id in ids:
+            _, member = self.find(field_name, member_id)
+            if member is not None:
+                members.append(member)
+
+        return build_record_data(members, field_list)
+
+
+class FakeResponsysHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    # buffer each response so headers and body go out together rather than as two small writes
+    wbufsize = 64 * 1024
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.server.fake.record_connection()
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_DELETE(self):
+        self._handle('DELETE')
+
+    def log_message(self, format, *args):
+        pass
+
+    def _handle(self, method):
+        url = urlsplit(self.path)
+        params = dict((key, values[-1]) for key, values in parse_qs(url.query).items())
+        list_params = parse_qs(url.query)
+
+        length = int(self.headers.get('Content-Length') or 0)
+        raw_body = self.rfile.read(length) if length else b''
+        if raw_body and self.headers.get('Content-Encoding') == 'gzip':
+            raw_body = gzip.GzipFile(fileobj=io.BytesIO(raw_body)).read()
+        body = json.loads(raw_body.decode('utf-8')) if raw_body else None
+
+        status, payload, headers = self.server.fake.handle(
+            method, url.path, params, list_params, body, self.headers.get('Authorization'))
+
+        encoded = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(encoded)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(encoded)
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class FakeResponsysServer(object):
+    """Serves a fake Responsys API on localhost from a background thread.
+
+    latency delays every response by that many seconds. token_ttl expires auth tokens after that
+    many seconds, after which requests get a 401. rate_limit_per_second limits each endpoint class
+    (auth, merge, retrieve, delete) and answers requests over the limit with a 429 carrying
+    retry_after as its Retry-After header.
+    """
+
+    ROUTES = [
+        ('auth', re.compile(r'^/auth/token$')),
+        ('lists', re.compile(r'^/lists$')),
+        ('list_extensions', re.compile(r'^/lists/(?P<profile_list>[^/]+)/listExtensions$')),
+        ('list_members', re.compile(r'^/lists/(?P<profile_list>[^/]+)/members/?$')),
+        ('list_member', re.compile(r'^/lists/(?P<profile_list>[^/]+)/members/(?P<riid>[^/]+)$')),
+        ('extension_members', re.compile(
+            r'^/lists/(?P<profile_list>[^/]+)/listExtensions/(?P<extension>[^/]+)/members/?$')),
+        ('extension_member', re.compile(
+            r'^/lists/(?P<profile_list>[^/]+)/listExtensions/(?P<extension>[^/]+)/members/'
+            r'(?P<riid>[^/]+)$')),
+        ('supplemental_members', re.compile(
+            r'^/folders/(?P<folder>[^/]+)/suppData/(?P<table>[^/]+)/members/?$')),
+    ]
+
+    def __init__(self, username='user', password='password', latency=0, token_ttl=None,
+                 rate_limit_per_second=None, retry_after=1, host='127.0.0.1', port=0,
+                 clock=time.time):
+        self.username = username
+        self.password = password
+        self.latency = latency
+        self.token_ttl = token_ttl
+        self.rate_limit_per_second = rate_limit_per_second
+        self.retry_after = retry_after
+        self._clock = clock
+
+        self.request_count = 0
+        self.connection_count = 0
+        self.throttled_count = 0
+        self.tokens = {}
+        self.tables = {}
+        self._riid_sequence = 0
+        self._windows = {}
+        self._lock = threading.RLock()
+
+        self._server = _ThreadingHTTPServer((host, port), FakeResponsysHandler)
+        self._server.fake = self
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return 'http://{}:{}'.format(host, port)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        kwargs={'poll_interval': 0.05})
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def expire_tokens(self):
+        with self._lock:
+            self.tokens.clear()
+
+    def record_connection(self):
+        with self._lock:
+            self.connection_count += 1
+
+    def handle(self, method, path, params, list_params, body, authorization):
+        if self.latency:
+            time.sleep(self.latency)
+
+        with self._lock:
+            self.request_count += 1
+
+            if not path.startswith(API_PREFIX):
+                return self._error(404, 'Not found')
+
+            route, match = self._route(path[len(API_PREFIX):])
+            if route is None:
+                return self._error(404, 'Not found')
+
+            endpoint_class = self._classify(route, method, params)
+            if self._is_throttled(endpoint_class):
+                self.throttled_count += 1
+                return (429, {'title': 'Too many requests'},
+                        {'Retry-After': str(self.retry_after)})
+
+            if route == 'auth':
+                return self._handle_auth(params, authorization)
+
+            error = self._check_token(authorization)
+            if error is not None:
+                return error
+
+            handler = getattr(self, '_handle_{}'.format(route))
+            return handler(method, params, list_params, body, **match.groupdict())
+
+    def route_for(self, path):
+        """Returns the name of the route serving a URL path, or None if nothing matches."""
+        path = urlsplit(path).path
+        if not path.startswith(API_PREFIX):
+            return None
+
+        return self._route(path[len(API_PREFIX):])[0]
+
+    def _route(self, path):
+        for route, pattern in self.ROUTES:
+            match = pattern.match(path)
+            if match is not None:
+                return route, match
+
+        return None, None
+
+    @staticmethod
+    def _classify(route, method, params):
+        if route == 'auth':
+            return 'auth'
+        if method == 'POST' and params.get('action') != 'get':
+            return 'merge'
+        if method == 'DELETE':
+            return 'delete'
+
+        return 'retrieve'
+
+    def _is_throttled(self, endpoint_class):
+        if not self.rate_limit_per_second:
+            return False
+
+        window = int(self._clock())
+        window_start, count = self._windows.get(endpoint_class, (window, 0))
+        if window_start != window:
+            count = 0
+
+        self._windows[endpoint_class] = (window, count + 1)
+
+        return count >= self.rate_limit_per_second
+
+    def _check_token(self, authorization):
+        issued_at = self.tokens.get(authorization)
+
+        if issued_at is None:
+            return self._error(500, INVALID_TOKEN_DETAIL, 'UNEXPECTED_EXCEPTION')
+        if self.token_ttl is not None and self._clock() - issued_at > self.token_ttl:
+            return self._error(401, 'Token expired', 'TOKEN_EXPIRED')
+
+        return None
+
+    def _issue_token(self):
+        token = uuid.uuid4().hex
+        issued_at = self._clock()
+        self.tokens[token] = issued_at
+
+        return 200, {'authToken': token, 'endPoint': self.url,
+                     'issuedAt': int(issued_at * 1000)}, {}
+
+    def _handle_auth(self, params, authorization):
+        if params.get('auth_type') == 'token':
+            if self._check_token(authorization) is not None:
+                return self._error(401, 'Token expired', 'TOKEN_EXPIRED')
+
+            del self.tokens[authorization]
+            return self._issue_token()
+
+        if (params.get('user_name'), params.get('password')) != (self.username, self.password):
+            return self._error(401, 'Login failed', 'INVALID_USER_NAME_PASSWORD')
+
+        return self._issue_token()
+
+    def _handle_lists(self, method, params, list_params, body):
+        names = sorted(key[1] for key in self.tables if key[0] == 'list')
+        return 200, [{'name': name} for name in names], {}
+
+    def _handle_list_extensions(self, method, params, list_params, body, profile_list):
+        names = sorted(key[2] for key in self.tables
+                       if key[0] == 'extension' and key[1] == profile_list)
+        return 200, [{'profileExtension': {'objectName': name}} for name in names], {}
+
+    def _handle_list_members(self, method, params, list_params, body, profile_list):
+        table = self._table(('list', profile_list))
+
+        if method == 'GET':
+            return self._retrieve_by_query(table, params)
+        if params.get('action') == 'get':
+            return self._retrieve_by_body(table, body)
+
+        match_field_name = body['mergeRule']['matchColumnName1']
+        return self._merge(table, [match_field_name], body, self._allocate_riid)
+
+    def _handle_list_member(self, method, params, list_params, body, profile_list, riid):
+        return self._delete(self._table(('list', profile_list)), riid)
+
+    def _handle_extension_members(self, method, params, list_params, body, profile_list,
+                                  extension):
+        table = self._table(('extension', profile_list, extension))
+
+        if method == 'GET':
+            return self._retrieve_by_query(table, params)
+        if params.get('action') == 'get':
+            return self._retrieve_by_body(table, body)
+
+        profiles = self._table(('list', profile_list))
+
+        def find_profile_riid(values):
+            # extension rows share the RIID of the profile they extend
+            riid, _ = profiles.find(body['matchColumnName1'],
+                                        values.get(body['matchColumnName1']))
+            return riid
+
+        return self._merge(table, ['RIID_'], body, find_profile_riid)
+
+    def _handle_extension_member(self, method, params, list_params, body, profile_list,
+                                 extension, riid):
+        return self._delete(self._table(('extension', profile_list, extension)), riid)
+
+    def _handle_supplemental_members(self, method, params, list_params, body, folder, table):
+        supplemental_table = self._table(('supplemental', folder, table))
+
+        if method == 'GET':
+            names = list_params.get('qa', [])
+            values = list_params.get('id', [])
+            field_list = params.get('fs', 'all').split(',')
+
+            members = [member for member in supplemental_table.members.values()
+                       if all(str(member.get(name)) == value
+                              for name, value in zip(names, values))]
+            return 200, build_record_data(members, field_list), {}
+
+        # supplemental rows are keyed by their first field
+        key_field_name = body['recordData']['fieldNames'][0]
+        return self._merge(supplemental_table, [key_field_name], body, self._allocate_riid)
+
+    def _retrieve_by_query(self, table, params):
+        response = table.retrieve(params.get('qa', 'c'), [params.get('id')],
+                                  params.get('fs', 'all').split(','))
+
+        if not response['recordData']['records']:
+            return self._error(404, 'Record not found', 'RECORD_NOT_FOUND')
+
+        return 200, response, {}
+
+    def _retrieve_by_body(self, table, body):
+        return 200, table.retrieve(body['queryAttribute'], body['ids'], body['fieldList']), {}
+
+    def _merge(self, table, match_field_names, body, allocate_riid):
+        record_data = body['recordData']
+        riids = table.merge(match_field_names, record_data['fieldNames'], record_data['records'],
+                            allocate_riid)
+
+        return 200, {'recordData': {'fieldNames': ['RIID_'],
+                                    'records': [[riid] for riid in riids],
+                                    'mapTemplateName': None}}, {}
+
+    def _delete(self, table, riid):
+        if table.delete(riid) is None:
+            return self._error(404, 'Record not found', 'RECORD_NOT_FOUND')
+
+        return 200, {}, {}
+
+    def _allocate_riid(self, values):
+        self._riid_sequence += 1
+        return str(self._riid_sequence)
+
+    def _table(self, key):
+        if key not in self.tables:
+            self.tables[key] = FakeTable()
+
+        return self.tables[key]
+
+    @staticmethod
+    def _error(status, detail, error_code='ERROR'):
+        return status, {'type': '', 'title': detail, 'errorCode': error_code, 'detail': detail,
+                        'errorDetails': []}, {}
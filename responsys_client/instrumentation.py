@@ -0,0 +1,273 @@
+import threading
+import time
+from bisect import bisect_left
+from collections import namedtuple
+
+if hasattr(time, 'perf_counter'):
+    default_clock = time.perf_counter
+else:
+    default_clock = time.time
+
+
+RequestEvent = namedtuple('RequestEvent', [
+    'method', 'path_template', 'endpoint_class', 'status_code', 'latency', 'request_bytes',
+    'response_bytes', 'record_count', 'retries', 'throttle_wait', 'retry_wait', 'error',
+])
+
+AuthEvent = namedtuple('AuthEvent', ['kind', 'status_code', 'latency'])
+
+AUTH_LOGIN = 'login'
+AUTH_REFRESH = 'refresh'
+# a login forced by Responsys rejecting a token the client still considered valid
+AUTH_RELOGIN = 'relogin'
+
+# path segments following one of these are identifiers and are replaced by a placeholder
+PATH_PARAMETER_NAMES = {
+    'lists': '{list}',
+    'listExtensions': '{extension}',
+    'folders': '{folder}',
+    'suppData': '{table}',
+    'members': '{riid}',
+}
+
+
+def build_path_template(url):
+    """Reduces a request URL to a low cardinality template, e.g. /lists/{list}/members.
+
+    The query string is dropped apart from an action parameter, which distinguishes retrievals
+    from merges on the same path.
+    """
+    path, _, query = url.partition('?')
+    if '://' in path:
+        path = '/' + path.split('://', 1)[1].partition('/')[2]
+
+    segments = path.split('/')
+    for index in range(1, len(segments)):
+        placeholder = PATH_PARAMETER_NAMES.get(segments[index - 1])
+
+        if placeholder is not None and segments[index]:
+            segments[index] = placeholder
+
+    template = '/'.join(segments)
+
+    for parameter in query.split('&'):
+        if parameter.startswith('action='):
+            return '{}?{}'.format(template, parameter)
+
+    return template
+
+
+class Instrumentation(object):
+    """Receives an event for every request and authentication a client makes.
+
+    Subclass it to export metrics, e.g. to StatsD or Prometheus; every hook does nothing by
+    default. A client without instrumentation skips all measurement.
+    """
+
+    def __init__(self, clock=default_clock):
+        self.clock = clock
+
+    def request_started(self, method, path_template):
+        pass
+
+    def request_finished(self, event):
+        pass
+
+    def auth_finished(self, event):
+        pass
+
+
+class RequestMeasurement(object):
+    """Accumulates the timings of one logical request across its retries."""
+
+    def __init__(self, instrumentation, method, url, endpoint_class):
+        self.instrumentation = instrumentation
+        self.method = method
+        self.path_template = build_path_template(url)
+        self.endpoint_class = endpoint_class
+        self.attempts = 0
+        self.throttle_wait = 0.0
+        self.retry_wait = 0.0
+
+        instrumentation.request_started(method, self.path_template)
+        self.started_at = instrumentation.clock()
+
+    def finish(self, json=None, response=None, error=None):
+        latency = self.instrumentation.clock() - self.started_at
+
+        if response is not None:
+            status_code = response.status_code
+            request_bytes = _count_bytes(getattr(response.request, 'body', None))
+            response_bytes = _count_bytes(getattr(response, 'content', None)
+                                          or getattr(response, 'text', None))
+        else:
+            status_code = request_bytes = response_bytes = None
+
+        event = RequestEvent(self.method, self.path_template, self.endpoint_class, status_code,
+                             latency, request_bytes, response_bytes, _count_records(json),
+                             max(self.attempts - 1, 0), self.throttle_wait, self.retry_wait,
+                             error)
+
+        self.instrumentation.request_finished(event)
+
+
+class Histogram(object):
+    """Counts observations into fixed buckets, keeping the count, sum, min and max exactly."""
+
+    DEFAULT_BOUNDS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(self, bounds=DEFAULT_BOUNDS):
+        self.bounds = tuple(sorted(bounds))
+        self.bucket_counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        self.bucket_counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def percentile(self, fraction):
+        """Returns the upper bound of the bucket holding the given fraction of observations."""
+        if not self.count:
+            return None
+
+        rank = fraction * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.bucket_counts):
+            seen += bucket_count
+
+            if seen >= rank and bucket_count:
+                if index == len(self.bounds):
+                    return self.max
+                return min(self.bounds[index], self.max)
+
+        return self.max
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'min': self.min,
+            'max': self.max,
+            'p50': self.percentile(0.5),
+            'p99': self.percentile(0.99),
+        }
+
+
+class RequestStats(object):
+
+    def __init__(self, bounds=Histogram.DEFAULT_BOUNDS):
+        self.latency = Histogram(bounds)
+        self.throttle_wait = Histogram(bounds)
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.records = 0
+        self.retries = 0
+        self.errors = 0
+
+    def add(self, event):
+        self.latency.observe(event.latency)
+        self.throttle_wait.observe(event.throttle_wait)
+        self.request_bytes += event.request_bytes or 0
+        self.response_bytes += event.response_bytes or 0
+        self.records += event.record_count
+        self.retries += event.retries
+        self.errors += event.error is not None
+
+    def to_dict(self):
+        return {
+            'latency': self.latency.to_dict(),
+            'throttle_wait': self.throttle_wait.to_dict(),
+            'request_bytes': self.request_bytes,
+            'response_bytes': self.response_bytes,
+            'records': self.records,
+            'retries': self.retries,
+            'errors': self.errors,
+        }
+
+
+class MetricsAggregator(Instrumentation):
+    """Keeps in-memory histograms of request and authentication events.
+
+    Requests are grouped by (method, path template, status code); a request that raised has a
+    status code of None. snapshot returns a plain dict copy that serializes to JSON, with request
+    groups keyed by strings such as 'GET /rest/api/v1.1/lists 200', or '... error' for None.
+    """
+
+    def __init__(self, bounds=Histogram.DEFAULT_BOUNDS, clock=default_clock):
+        super(MetricsAggregator, self).__init__(clock=clock)
+        self.bounds = bounds
+        self._lock = threading.Lock()
+        self.reset()
+
+    def request_finished(self, event):
+        key = (event.method, event.path_template, event.status_code)
+
+        with self._lock:
+            stats = self.requests.get(key)
+            if stats is None:
+                stats = self.requests[key] = RequestStats(self.bounds)
+
+            stats.add(event)
+
+    def auth_finished(self, event):
+        with self._lock:
+            histogram = self.auth.get(event.kind)
+            if histogram is None:
+                histogram = self.auth[event.kind] = Histogram(self.bounds)
+
+            histogram.observe(event.latency)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'requests': dict((self._format_request_key(key), stats.to_dict())
+                                 for key, stats in self.requests.items()),
+                'auth': dict((kind, histogram.to_dict())
+                             for kind, histogram in self.auth.items()),
+            }
+
+    def reset(self):
+        with self._lock:
+            self.requests = {}
+            self.auth = {}
+
+    @staticmethod
+    def _format_request_key(key):
+        method, path_template, status_code = key
+
+        return '{} {} {}'.format(method, path_template,
+                                 'error' if status_code is None else status_code)
+
+
+def _count_bytes(payload):
+    if not payload:
+        return 0
+    if isinstance(payload, bytes):
+        return len(payload)
+
+    return len(payload.encode('utf-8'))
+
+
+def _count_records(json):
+    # an EncodedBody carries its count, since its records are already serialized
+    record_count = getattr(json, 'record_count', None)
+    if record_count is not None:
+        return record_count
+
+    if not isinstance(json, dict):
+        return 0
+
+    record_data = json.get('recordData')
+    if record_data:
+        return len(record_data.get('records') or ())
+
+    return len(json.get('ids') or ())
@@ -0,0 +1,302 @@
+import csv
+import io
+import json
+import os
+import sys
+from collections import namedtuple
+
+from .dispatch import ConcurrentBatchDispatcher
+from .exceptions import ResponsysClientError
+
+
+LoadResult = namedtuple('LoadResult', ['loaded', 'failed', 'resumed_from'])
+FailedBatch = namedtuple('FailedBatch', ['start_offset', 'end_offset', 'record_count', 'error'])
+
+CSV_FORMAT = 'csv'
+JSONL_FORMAT = 'jsonl'
+
+UTF8_BYTE_ORDER_MARK = b'\xef\xbb\xbf'
+
+
+def detect_file_format(path):
+    extension = os.path.splitext(path)[1].lower()
+
+    if extension in ('.jsonl', '.ndjson', '.json'):
+        return JSONL_FORMAT
+    if extension in ('.csv', '.txt'):
+        return CSV_FORMAT
+
+    raise ResponsysClientError('Cannot tell the format of {}; pass csv or jsonl explicitly.'
+                               .format(path))
+
+
+def read_records(path, file_format=None, start_offset=0, encoding='utf-8'):
+    """Streams the records of a CSV or JSONL file as (record, end byte offset) pairs.
+
+    The offset is where the next record starts, so reading can resume from it later. A CSV file's
+    header row is always read from the start of the file.
+    """
+    file_format = file_format or detect_file_format(path)
+
+    with io.open(path, 'rb') as data_file:
+        if file_format == CSV_FORMAT:
+            for record, end_offset in _read_csv_records(data_file, start_offset, encoding):
+                yield record, end_offset
+        elif file_format == JSONL_FORMAT:
+            for record, end_offset in _read_jsonl_records(data_file, start_offset, encoding):
+                yield record, end_offset
+        else:
+            raise ResponsysClientError('Unsupported file format: {}.'.format(file_format))
+
+
+class CheckpointJournal(object):
+    """An append-only journal of the byte ranges of a file whose records were loaded.
+
+    Each line records one range. completed_ranges lists the ranges that loaded, so a rerun skips
+    them and only sends the records that failed or were never sent. The resume offset is the end
+    of the run of completed ranges from the start of the file, where a rerun starts reading.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def completed_ranges(self):
+        """Returns the (start, end) byte ranges that loaded, merged, sorted and disjoint."""
+        if not os.path.exists(self.path):
+            return []
+
+        ranges = []
+        with io.open(self.path, 'r', encoding='utf-8') as journal_file:
+            for line in journal_file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # a line cut short by an interrupted write
+                    continue
+
+                if entry.get('status') == 'ok' and entry['end'] > entry['start']:
+                    ranges.append((entry['start'], entry['end']))
+
+        merged_ranges = []
+        for start, end in sorted(ranges):
+            if merged_ranges and start <= merged_ranges[-1][1]:
+                merged_ranges[-1] = (merged_ranges[-1][0], max(merged_ranges[-1][1], end))
+            else:
+                merged_ranges.append((start, end))
+
+        return merged_ranges
+
+    def resume_offset(self):
+        completed_ranges = self.completed_ranges()
+
+        if completed_ranges and completed_ranges[0][0] == 0:
+            return completed_ranges[0][1]
+
+        return 0
+
+    def record(self, start_offset, end_offset, record_count, error=None):
+        entry = {
+            'start': start_offset,
+            'end': end_offset,
+            'records': record_count,
+            'status': 'ok' if error is None else 'failed',
+        }
+        if error is not None:
+            entry['error'] = str(error)
+
+        with io.open(self.path, 'ab') as journal_file:
+            journal_file.write((json.dumps(entry, sort_keys=True) + '\n').encode('utf-8'))
+            journal_file.flush()
+            os.fsync(journal_file.fileno())
+
+    def reset(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class BulkLoader(object):
+    """Streams a CSV or JSONL file into Responsys through the merge methods with results.
+
+    Rows are read lazily, renamed through field_map (columns it does not name are dropped) and
+    sent in batches of RESPONSYS_RECORD_PROCESS_LIMIT_QUANTITY with up to max_in_flight in flight.
+    Records Responsys rejects count as failed. With a checkpoint_path, the records that loaded
+    are journaled, so rerunning an interrupted or partly failed load only sends the rest. Memory
+    use depends on the batch size and max_in_flight, not on the file size.
+    """
+
+    DEFAULT_MAX_IN_FLIGHT = 4
+
+    def __init__(self, client, max_in_flight=DEFAULT_MAX_IN_FLIGHT, field_map=None,
+                 file_format=None, checkpoint_path=None, encoding='utf-8'):
+        self.client = client
+        self.max_in_flight = max_in_flight
+        self.field_map = field_map
+        self.file_format = file_format
+        self.journal = CheckpointJournal(checkpoint_path) if checkpoint_path else None
+        self.encoding = encoding
+
+    def load_profile_list_members(self, path, profile_list, merge_key):
+        def send_batch(records):
+            return self.client.merge_profile_list_members_with_results(profile_list, records,
+                                                                       merge_key)
+
+        return self.load(path, send_batch)
+
+    def load_profile_list_extension_members(self, path, profile_list, list_extension, merge_key):
+        def send_batch(records):
+            return self.client.merge_profile_list_extension_members_with_results(
+                profile_list, list_extension, records, merge_key)
+
+        return self.load(path, send_batch)
+
+    def load_supplemental_table_members(self, path, folder, table):
+        def send_batch(records):
+            return self.client.merge_supplemental_table_members_with_results(folder, table,
+                                                                             records)
+
+        return self.load(path, send_batch)
+
+    def load(self, path, send_batch):
+        """Loads the file through send_batch, which must return a MergeResult per record."""
+        start_offset = 0
+        completed_ranges = []
+        if self.journal is not None:
+            completed_ranges = self.journal.completed_ranges()
+            start_offset = self.journal.resume_offset()
+
+        def send_ranged_batch(ranged_records):
+            return send_batch([record for _, _, record in ranged_records])
+
+        loaded = 0
+        failed = []
+        dispatcher = ConcurrentBatchDispatcher(max_in_flight=self.max_in_flight,
+                                               executor=self.client.executor)
+        batches = self._read_batches(path, start_offset, completed_ranges)
+
+        for result in dispatcher.dispatch(self.client.with_bulk_priority(send_ranged_batch),
+                                          batches):
+            if result.error is not None:
+                failed.append(self._record_failure(result.records, result.error))
+                continue
+
+            loaded_run = []
+            for ranged_record, merge_result in zip(result.records, result.response):
+                if merge_result.succeeded:
+                    loaded_run.append(ranged_record)
+                    continue
+
+                loaded += self._record_loaded(loaded_run)
+                loaded_run = []
+                failed.append(self._record_failure([ranged_record], ResponsysClientError(
+                    'Responsys rejected the record with {}: {}'.format(merge_result.error_code,
+                                                                      merge_result.message))))
+
+            loaded += self._record_loaded(loaded_run)
+
+        return LoadResult(loaded, failed, start_offset)
+
+    def _record_loaded(self, ranged_records):
+        if ranged_records and self.journal is not None:
+            self.journal.record(ranged_records[0][0], ranged_records[-1][1], len(ranged_records))
+
+        return len(ranged_records)
+
+    def _record_failure(self, ranged_records, error):
+        start_offset, end_offset = ranged_records[0][0], ranged_records[-1][1]
+
+        if self.journal is not None:
+            self.journal.record(start_offset, end_offset, len(ranged_records), error)
+
+        return FailedBatch(start_offset, end_offset, len(ranged_records), error)
+
+    def _read_batches(self, path, start_offset, completed_ranges):
+        # batches hold (start offset, end offset, record) for each record not already loaded
+        limit = self.client.RESPONSYS_RECORD_PROCESS_LIMIT_QUANTITY
+        completed = iter(completed_ranges)
+        completed_range = next(completed, None)
+        record_start = start_offset
+        batch = []
+
+        for record, record_end in read_records(path, self.file_format, start_offset,
+                                               self.encoding):
+            while completed_range is not None and completed_range[1] <= record_start:
+                completed_range = next(completed, None)
+
+            if completed_range is None or not (completed_range[0] <= record_start
+                                               and record_end <= completed_range[1]):
+                batch.append((record_start, record_end, self._map_fields(record)))
+
+            record_start = record_end
+
+            if len(batch) >= limit:
+                yield batch
+                batch = []
+
+        if batch:
+            yield batch
+
+    def _map_fields(self, record):
+        if self.field_map is None:
+            return record
+
+        return dict((field, record[column]) for column, field in self.field_map.items()
+                    if column in record)
+
+
+def _strip_byte_order_mark(line, offset):
+    # only the first line of a file can start with a byte order mark, which editors often add
+    if offset == 0 and line.startswith(UTF8_BYTE_ORDER_MARK):
+        return line[len(UTF8_BYTE_ORDER_MARK):], len(UTF8_BYTE_ORDER_MARK)
+
+    return line, offset
+
+
+class _OffsetTrackingLines(object):
+    # hands decoded lines to csv.reader while remembering where the last one ended
+
+    def __init__(self, data_file, offset, encoding):
+        self.data_file = data_file
+        self.offset = offset
+        self.encoding = encoding
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        line = self.data_file.readline()
+        if not line:
+            raise StopIteration
+
+        line, self.offset = _strip_byte_order_mark(line, self.offset)
+        self.offset += len(line)
+
+        return line.decode(self.encoding) if sys.version_info >= (3, 0) else line
+
+    next = __next__
+
+
+def _read_csv_records(data_file, start_offset, encoding):
+    header_lines = _OffsetTrackingLines(data_file, 0, encoding)
+    header_row = next(csv.reader(header_lines), None)
+    if header_row is None:
+        return
+
+    offset = max(start_offset, header_lines.offset)
+    data_file.seek(offset)
+
+    lines = _OffsetTrackingLines(data_file, offset, encoding)
+    for row in csv.reader(lines):
+        if row:
+            yield dict(zip(header_row, row)), lines.offset
+
+
+def _read_jsonl_records(data_file, start_offset, encoding):
+    data_file.seek(start_offset)
+    offset = start_offset
+
+    for line in data_file:
+        line, offset = _strip_byte_order_mark(line, offset)
+        offset += len(line)
+
+        if line.strip():
+            yield json.loads(line.decode(encoding)), offset
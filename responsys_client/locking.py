@@ -0,0 +1,60 @@
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from .exceptions import ResponsysClientError
+
+
+class InterProcessLock(object):
+    """A reentrant lock shared by the threads of this process and by other processes on the host.
+
+    Threads serialize on an RLock and the owning thread then holds an exclusive flock on path, so
+    every process opening the same path waits its turn. Requires a POSIX platform.
+    """
+
+    def __init__(self, path):
+        if fcntl is None:
+            raise ResponsysClientError('InterProcessLock requires fcntl, which is not available '
+                                       'on this platform.')
+
+        self.path = path
+        self._thread_lock = threading.RLock()
+        self._depth = 0
+        self._lock_file = None
+
+    def acquire(self):
+        self._thread_lock.acquire()
+
+        if self._depth == 0:
+            try:
+                self._lock_file = open(self.path, 'a')
+                fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX)
+            except Exception:
+                if self._lock_file is not None:
+                    self._lock_file.close()
+                    self._lock_file = None
+
+                self._thread_lock.release()
+                raise
+
+        self._depth += 1
+
+    def release(self):
+        self._depth -= 1
+
+        if self._depth == 0:
+            fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_UN)
+            self._lock_file.close()
+            self._lock_file = None
+
+        self._thread_lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
@@ -0,0 +1,187 @@
+import threading
+from collections import deque, namedtuple
+from contextlib import contextmanager
+
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from .client import ResponsysClient
+from .exceptions import ResponsysClientError
+from .ratelimit import RateLimiter
+from .scheduler import FairScheduler, PriorityScheduler
+from .transport import RequestsTransport
+
+
+AccountSettings = namedtuple('AccountSettings', ['username', 'password', 'login_url',
+                                                 'max_in_flight', 'budgets', 'weight'])
+
+
+class AccountScheduler(object):
+    """Admits one account's requests by priority under its own cap, then into the shared slots.
+
+    The account's slot is always taken before the pool's, so the two never wait on each other.
+    """
+
+    def __init__(self, account, pool_scheduler, max_in_flight):
+        self.account = account
+        self.pool_scheduler = pool_scheduler
+        self.account_scheduler = PriorityScheduler(max_in_flight,
+                                                   reserved_slots=max_in_flight // 4)
+
+    @contextmanager
+    def slot(self, priority=PriorityScheduler.NORMAL):
+        with self.account_scheduler.slot(priority), self.pool_scheduler.slot(self.account):
+            yield
+
+
+class AccountExecutor(object):
+    """Feeds one account's tasks into the shared executor, at most max_in_flight at a time.
+
+    Tasks over the cap wait in the account's own queue rather than in the shared executor, so a
+    busy account never holds shared workers that are only waiting for its cap to free up.
+    """
+
+    def __init__(self, executor, max_in_flight):
+        self.executor = executor
+        self.max_in_flight = max_in_flight
+        self.running = 0
+        self._queue = deque()
+        self._lock = threading.Lock()
+
+    def submit(self, function, *args, **kwargs):
+        future = Future()
+
+        with self._lock:
+            self._queue.append((future, function, args, kwargs))
+
+        self._submit_queued()
+
+        return future
+
+    def shutdown(self, wait=True):
+        # the shared executor belongs to the pool, which shuts it down
+        pass
+
+    def _submit_queued(self):
+        while True:
+            with self._lock:
+                if self.running >= self.max_in_flight or not self._queue:
+                    return
+
+                task = self._queue.popleft()
+                self.running += 1
+
+            self.executor.submit(self._run, *task)
+
+    def _run(self, future, function, args, kwargs):
+        try:
+            if future.set_running_or_notify_cancel():
+                try:
+                    result = function(*args, **kwargs)
+                except BaseException as error:
+                    future.set_exception(error)
+                else:
+                    future.set_result(result)
+        finally:
+            with self._lock:
+                self.running -= 1
+
+            self._submit_queued()
+
+
+class ResponsysClientPool(object):
+    """Serves many Responsys accounts from one connection pool and one worker executor.
+
+    Accounts are registered by name and their clients are created on first use. Every client sends
+    through the shared transport and runs concurrent batches on the shared executor. Each account
+    keeps its own token and rate budgets, is capped at its own max_in_flight, and competes for the
+    pool's max_in_flight slots by fair queuing, so a busy account cannot starve the others. The
+    cap is also applied before batches reach the shared executor, so an account's backlog waits in
+    its own queue instead of filling the shared workers.
+    """
+
+    DEFAULT_MAX_IN_FLIGHT = 32
+    DEFAULT_MAX_IN_FLIGHT_PER_ACCOUNT = 8
+
+    def __init__(self, max_in_flight=DEFAULT_MAX_IN_FLIGHT,
+                 max_in_flight_per_account=DEFAULT_MAX_IN_FLIGHT_PER_ACCOUNT, transport=None,
+                 max_workers=None, **client_options):
+        self.max_in_flight = max_in_flight
+        self.max_in_flight_per_account = max_in_flight_per_account
+        self.client_options = client_options
+        self.scheduler = FairScheduler(max_in_flight)
+
+        # only close a transport we create; one passed in may be shared further
+        self._owns_transport = transport is None
+        self.transport = transport if transport is not None else RequestsTransport(
+            pool_connections=max_in_flight, pool_maxsize=max_in_flight)
+
+        # batches waiting for a shared slot hold a worker, so there are spare workers for other
+        # accounts' batches to reach the slots
+        self.executor = ThreadPoolExecutor(max_workers=max_workers or 2 * max_in_flight)
+
+        self._accounts = {}
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def register(self, account, username, password, login_url, max_in_flight=None, budgets=None,
+                 weight=FairScheduler.DEFAULT_WEIGHT):
+        """Adds an account; budgets override its RateLimiter budgets per endpoint class."""
+        with self._lock:
+            if account in self._accounts:
+                raise ResponsysClientError('Account {} is already registered.'.format(account))
+
+            self._accounts[account] = AccountSettings(
+                username, password, login_url,
+                max_in_flight or self.max_in_flight_per_account, budgets, weight)
+
+    def get(self, account):
+        with self._lock:
+            client = self._clients.get(account)
+
+            if client is None:
+                client = self._clients[account] = self._build_client(account)
+
+            return client
+
+    def __getitem__(self, account):
+        return self.get(account)
+
+    @property
+    def accounts(self):
+        with self._lock:
+            return sorted(self._accounts)
+
+    def close(self):
+        with self._lock:
+            clients = list(self._clients.values())
+            self._clients = {}
+
+        for client in clients:
+            client.close()
+
+        self.executor.shutdown(wait=True)
+
+        if self._owns_transport:
+            self.transport.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _build_client(self, account):
+        # callers hold the lock
+        settings = self._accounts.get(account)
+        if settings is None:
+            raise ResponsysClientError('Account {} is not registered.'.format(account))
+
+        self.scheduler.weights[account] = settings.weight
+        scheduler = AccountScheduler(account, self.scheduler, settings.max_in_flight)
+
+        return ResponsysClient(settings.username, settings.password, settings.login_url,
+                               transport=self.transport,
+                               rate_limiter=RateLimiter(budgets=settings.budgets),
+                               scheduler=scheduler,
+                               executor=AccountExecutor(self.executor, settings.max_in_flight),
+                               **self.client_options)
@@ -0,0 +1,323 @@
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from email.utils import mktime_tz, parsedate_tz
+
+from .scheduler import PriorityScheduler
+
+
+class TokenBucket(object):
+    """Paces requests to a steady rate while allowing short bursts up to its capacity.
+
+    Callers reserve a token and are told how long to wait before sending, so the bucket never
+    sleeps while holding its lock. After a throttled response the rate is cut multiplicatively
+    and then recovers additively with each success.
+    """
+
+    MINIMUM_RATE_FRACTION = 0.1
+    DECREASE_FACTOR = 0.5
+    INCREASE_FRACTION = 0.05
+
+    def __init__(self, requests_per_minute, burst, clock=time.time):
+        self.max_rate = requests_per_minute / 60.0
+        self.rate = self.max_rate
+        self.capacity = float(burst)
+        self.tokens = float(burst)
+        self.blocked_until = 0.0
+        self.consecutive_throttles = 0
+        self._clock = clock
+        self._updated_at = clock()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        with self._lock:
+            now = self._refill()
+
+            # tokens may go negative, which queues later callers behind earlier reservations
+            self.tokens -= 1
+            delay = -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+            return max(delay, self.blocked_until - now)
+
+    def acquire_above(self, reserved):
+        """Takes a token only if more than reserved tokens are left, returning 0.0 if it did.
+
+        Otherwise nothing is taken and the time until a token may be free is returned. Unlike
+        reserve, a caller that must wait holds no place in the queue, so the reserved tokens stay
+        available to callers that reserve.
+        """
+        with self._lock:
+            now = self._refill()
+
+            delay = max((reserved + 1 - self.tokens) / self.rate, self.blocked_until - now)
+            if delay > 0:
+                return delay
+
+            self.tokens -= 1
+
+            return 0.0
+
+    def throttle(self, wait_seconds=None, initial_backoff=1.0, max_backoff=None):
+        """Records a throttled response and returns how long the bucket is now paused for.
+
+        Without wait_seconds, the pause starts at initial_backoff and doubles with every
+        consecutive throttle. The count is read and bumped under the bucket's lock, so concurrent
+        throttles back off from the same count.
+        """
+        with self._lock:
+            now = self._refill()
+
+            if wait_seconds is None:
+                wait_seconds = initial_backoff * (2 ** self.consecutive_throttles)
+
+            if max_backoff is not None:
+                wait_seconds = min(wait_seconds, max_backoff)
+
+            self.consecutive_throttles += 1
+            self.rate = max(self.rate * self.DECREASE_FACTOR,
+                            self.max_rate * self.MINIMUM_RATE_FRACTION)
+            self.blocked_until = max(self.blocked_until, now + wait_seconds)
+
+            return wait_seconds
+
+    def succeed(self):
+        with self._lock:
+            self._refill()
+
+            self.consecutive_throttles = 0
+            self.rate = min(self.rate + self.max_rate * self.INCREASE_FRACTION, self.max_rate)
+
+    def _refill(self):
+        now = self._clock()
+        elapsed = max(now - self._updated_at, 0.0)
+
+        self.tokens = min(self.tokens + elapsed * self.rate, self.capacity)
+        self._updated_at = now
+
+        return now
+
+
+class RateLimiter(object):
+    """Keeps one token bucket per endpoint class, shared by every thread using a client.
+
+    Responsys throttles authentication, merges, retrievals and deletes separately, so each class
+    gets its own budget of (requests per minute, burst). Budgets may be overridden per class.
+    Up to reserved_tokens of each burst are never given to LOW priority requests, so an
+    interactive call does not queue behind bulk traffic that has used up the rest.
+    """
+
+    AUTH = 'auth'
+    MERGE = 'merge'
+    RETRIEVE = 'retrieve'
+    DELETE = 'delete'
+    OTHER = 'other'
+
+    DEFAULT_BUDGETS = {
+        AUTH: (60, 5),
+        MERGE: (250, 10),
+        RETRIEVE: (1000, 20),
+        DELETE: (250, 10),
+        OTHER: (500, 10),
+    }
+
+    INITIAL_BACKOFF_IN_SECONDS = 1.0
+    DEFAULT_RESERVED_TOKENS = 2
+
+    def __init__(self, budgets=None, clock=time.time, sleep=time.sleep,
+                 reserved_tokens=DEFAULT_RESERVED_TOKENS):
+        merged_budgets = dict(self.DEFAULT_BUDGETS)
+        merged_budgets.update(budgets or {})
+
+        self.buckets = dict((endpoint_class, self._build_bucket(endpoint_class, rate, burst, clock))
+                            for endpoint_class, (rate, burst) in merged_budgets.items())
+        # the reserve is capped below the burst, so LOW requests can always use one token of it
+        self.reserved_tokens = dict((endpoint_class, min(reserved_tokens, max(burst - 1, 0)))
+                                    for endpoint_class, (rate, burst) in merged_budgets.items())
+        self._clock = clock
+        self._sleep = sleep
+
+    def _build_bucket(self, endpoint_class, requests_per_minute, burst, clock):
+        return TokenBucket(requests_per_minute, burst, clock=clock)
+
+    def classify(self, method, url):
+        if url.rstrip('/').endswith('/auth/token'):
+            return self.AUTH
+        if method == 'POST' and 'action=get' in url:
+            return self.RETRIEVE
+        if method == 'POST':
+            return self.MERGE
+        if method == 'GET':
+            return self.RETRIEVE
+        if method == 'DELETE':
+            return self.DELETE
+
+        return self.OTHER
+
+    def reserve(self, endpoint_class):
+        return self.buckets[endpoint_class].reserve()
+
+    def wait(self, endpoint_class, priority=None):
+        reserved = self.reserved_tokens[endpoint_class]
+
+        if priority != PriorityScheduler.LOW or not reserved:
+            delay = self.reserve(endpoint_class)
+
+            if delay > 0:
+                self._sleep(delay)
+
+            return delay
+
+        waited = 0.0
+        while True:
+            delay = self.buckets[endpoint_class].acquire_above(reserved)
+
+            if not delay:
+                return waited
+
+            self._sleep(delay)
+            waited += delay
+
+    def throttled(self, endpoint_class, retry_after=None, max_backoff=None):
+        """Records a 429 and returns how long the endpoint class is now paused for.
+
+        A Retry-After value from the response wins; otherwise the pause doubles with every
+        consecutive throttle, capped at max_backoff.
+        """
+        return self.buckets[endpoint_class].throttle(self.parse_retry_after(retry_after),
+                                                     self.INITIAL_BACKOFF_IN_SECONDS,
+                                                     max_backoff)
+
+    def succeeded(self, endpoint_class):
+        self.buckets[endpoint_class].succeed()
+
+    def parse_retry_after(self, retry_after):
+        if not retry_after:
+            return None
+
+        try:
+            return max(float(retry_after), 0.0)
+        except ValueError:
+            pass
+
+        parsed_date = parsedate_tz(retry_after)
+        if parsed_date is None:
+            return None
+
+        return max(mktime_tz(parsed_date) - self._clock(), 0.0)
+
+
+class SQLiteBucketStore(object):
+    """Keeps token bucket state in a SQLite file that every process on a host can open.
+
+    Each bucket operation runs in an immediate transaction, so processes update a bucket one at a
+    time. Connections are opened per process, which keeps the store safe to use after a fork.
+    """
+
+    BUSY_TIMEOUT_IN_SECONDS = 30
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = None
+        self._connection_pid = None
+
+    @contextmanager
+    def transaction(self, bucket):
+        with self._lock:
+            connection = self._get_connection()
+            connection.execute('BEGIN IMMEDIATE')
+
+            try:
+                self._load(connection, bucket)
+                yield
+                self._save(connection, bucket)
+            except Exception:
+                connection.execute('ROLLBACK')
+                raise
+
+            connection.execute('COMMIT')
+
+    def _get_connection(self):
+        if self._connection is None or self._connection_pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=self.BUSY_TIMEOUT_IN_SECONDS,
+                                         isolation_level=None, check_same_thread=False)
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS token_buckets ('
+                'endpoint_class TEXT PRIMARY KEY, tokens REAL, rate REAL, updated_at REAL, '
+                'blocked_until REAL, consecutive_throttles INTEGER)')
+
+            self._connection = connection
+            self._connection_pid = os.getpid()
+
+        return self._connection
+
+    @staticmethod
+    def _load(connection, bucket):
+        row = connection.execute(
+            'SELECT tokens, rate, updated_at, blocked_until, consecutive_throttles '
+            'FROM token_buckets WHERE endpoint_class = ?', (bucket.endpoint_class,)).fetchone()
+
+        if row is not None:
+            (bucket.tokens, rate, bucket._updated_at, bucket.blocked_until,
+             bucket.consecutive_throttles) = row
+
+            # another process may have been configured with a smaller budget
+            bucket.rate = min(rate, bucket.max_rate)
+
+    @staticmethod
+    def _save(connection, bucket):
+        connection.execute(
+            'INSERT OR REPLACE INTO token_buckets (endpoint_class, tokens, rate, updated_at, '
+            'blocked_until, consecutive_throttles) VALUES (?, ?, ?, ?, ?, ?)',
+            (bucket.endpoint_class, bucket.tokens, bucket.rate, bucket._updated_at,
+             bucket.blocked_until, bucket.consecutive_throttles))
+
+
+class SharedTokenBucket(TokenBucket):
+    """A TokenBucket whose state lives in a SQLiteBucketStore shared by several processes."""
+
+    def __init__(self, store, endpoint_class, requests_per_minute, burst, clock=time.time):
+        super(SharedTokenBucket, self).__init__(requests_per_minute, burst, clock=clock)
+        self.store = store
+        self.endpoint_class = endpoint_class
+
+    def reserve(self):
+        with self.store.transaction(self):
+            return super(SharedTokenBucket, self).reserve()
+
+    def throttle(self, wait_seconds=None, initial_backoff=1.0, max_backoff=None):
+        # the backoff must come from the host-wide count, which is loaded in the transaction
+        with self.store.transaction(self):
+            return super(SharedTokenBucket, self).throttle(wait_seconds, initial_backoff,
+                                                           max_backoff)
+
+    def acquire_above(self, reserved):
+        with self.store.transaction(self):
+            return super(SharedTokenBucket, self).acquire_above(reserved)
+
+    def succeed(self):
+        with self.store.transaction(self):
+            super(SharedTokenBucket, self).succeed()
+
+
+class SharedRateLimiter(RateLimiter):
+    """A RateLimiter whose budgets are shared by every client and process on a host.
+
+    All participants draw from the same buckets in the SQLite file at path, so each budget is the
+    host's total, divided between processes by their demand. A 429 seen by one participant pauses
+    its endpoint class for all of them. The clock must be wall clock time, which every process
+    shares.
+    """
+
+    def __init__(self, path, budgets=None, clock=time.time, sleep=time.sleep,
+                 reserved_tokens=RateLimiter.DEFAULT_RESERVED_TOKENS):
+        self.store = SQLiteBucketStore(path)
+
+        super(SharedRateLimiter, self).__init__(budgets=budgets, clock=clock, sleep=sleep,
+                                                reserved_tokens=reserved_tokens)
+
+    def _build_bucket(self, endpoint_class, requests_per_minute, burst, clock):
+        return SharedTokenBucket(self.store, endpoint_class, requests_per_minute, burst,
+                                 clock=clock)
@@ -0,0 +1,84 @@
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
+
+class MemberRow(Mapping):
+    """A read-only view of one retrieved record backed by its original list of values.
+
+    Values can be read by field name (row['RIID_'] or row.RIID_), by position (row[0]) or through
+    the usual mapping methods. The field name to position index is shared by every row of a
+    response, so a row costs one small object on top of the decoded values.
+    """
+
+    __slots__ = ('_field_indexes', '_values')
+
+    def __init__(self, field_indexes, values):
+        self._field_indexes = field_indexes
+        self._values = values
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, slice)):
+            return self._values[key]
+
+        return self._values[self._field_indexes[key]]
+
+    def __getattr__(self, name):
+        # private and dunder lookups, e.g. from copy or pickle, must not recurse into the slots
+        if name.startswith('_'):
+            raise AttributeError(name)
+
+        try:
+            return self._values[self._field_indexes[name]]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __iter__(self):
+        return iter(self._field_indexes)
+
+    def __len__(self):
+        return len(self._field_indexes)
+
+    def __contains__(self, key):
+        return key in self._field_indexes
+
+    def __repr__(self):
+        return 'MemberRow({!r})'.format(dict(self.items()))
+
+
+class MemberRecords(object):
+    """The records of a retrieval response, keeping the field names once for all rows.
+
+    Iterating yields MemberRow objects lazily, one per record, instead of building a dict for
+    every record up front.
+    """
+
+    def __init__(self, field_names, records):
+        self.field_names = field_names
+        self.records = records
+        self._field_indexes = _build_field_indexes(field_names)
+
+    def __iter__(self):
+        field_indexes = self._field_indexes
+
+        for record in self.records:
+            yield MemberRow(field_indexes, record)
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getitem__(self, index):
+        return MemberRow(self._field_indexes, self.records[index])
+
+    def to_dicts(self):
+        return [dict(zip(self.field_names, record)) for record in self.records]
+
+
+def _build_field_indexes(field_names):
+    # the first occurrence wins if a field name is repeated
+    field_indexes = {}
+    for index, field_name in enumerate(field_names):
+        field_indexes.setdefault(field_name, index)
+
+    return field_indexes
@@ -0,0 +1,80 @@
+import re
+from collections import namedtuple
+
+
+MERGE_FAILED_PREFIX = 'MERGEFAILED'
+
+# failures caused by contention or a transient fault on the Responsys side rather than the record
+RETRYABLE_MERGE_ERROR_CODES = frozenset([
+    'DEADLOCK',
+    'LOCK_TIMEOUT',
+    'RECORD_LOCKED',
+    'SERVICE_UNAVAILABLE',
+    'TIMEOUT',
+    'UNEXPECTED_EXCEPTION',
+])
+
+# the error code of a record whose retry request itself failed, with the error as its message
+REQUEST_FAILED_ERROR_CODE = 'REQUEST_FAILED'
+
+_ERROR_CODE_PATTERN = re.compile(
+    r'^(?:Record\s+\d+\s*=\s*)?([A-Z][A-Z0-9_]+)(?:\s*[:\-]\s*|\s*$)(.*)$', re.DOTALL)
+
+
+class MergeResult(namedtuple('MergeResult', ['record', 'riid', 'error_code', 'message'])):
+    """The outcome of merging one input record: its RIID, or an error code and message."""
+
+    __slots__ = ()
+
+    @property
+    def succeeded(self):
+        return self.error_code is None
+
+    @property
+    def retryable(self):
+        return self.error_code in RETRYABLE_MERGE_ERROR_CODES
+
+
+def parse_merge_results(records, parsed_response):
+    """Matches each input record to its outcome in a merge response.
+
+    Responsys lists one value per input record, in order: the RIID on success or a MERGEFAILED
+    message. Records a response does not mention are taken to have succeeded without a RIID.
+    """
+    record_data = parsed_response.get('recordData') if isinstance(parsed_response, dict) else None
+    field_names = (record_data or {}).get('fieldNames') or []
+    outcomes = (record_data or {}).get('records') or []
+    riid_index = field_names.index('RIID_') if 'RIID_' in field_names else None
+
+    results = []
+    for position, record in enumerate(records):
+        outcome = outcomes[position] if position < len(outcomes) else None
+        results.append(_parse_merge_outcome(record, outcome, riid_index))
+
+    return results
+
+
+def parse_merge_failure(value):
+    """Splits a MERGEFAILED message into an error code and the remaining message."""
+    message = value[len(MERGE_FAILED_PREFIX):].lstrip(' :')
+    match = _ERROR_CODE_PATTERN.match(message)
+
+    if match is None:
+        return MERGE_FAILED_PREFIX, message
+
+    return match.group(1), match.group(2) or message
+
+
+def _parse_merge_outcome(record, outcome, riid_index):
+    if not outcome:
+        return MergeResult(record, None, None, None)
+
+    for value in outcome:
+        # json decodes to unicode on Python 2, so check for the method rather than str
+        if hasattr(value, 'startswith') and value.startswith(MERGE_FAILED_PREFIX):
+            error_code, message = parse_merge_failure(value)
+            return MergeResult(record, None, error_code, message)
+
+    riid = outcome[riid_index] if riid_index is not None else None
+
+    return MergeResult(record, riid, None, None)
@@ -0,0 +1,79 @@
+import random
+import time
+
+import requests
+
+
+class RetryPolicy(object):
+    """Decides whether a failed attempt is retried and how long to back off before the next one.
+
+    Backoff grows exponentially from backoff_base up to backoff_max and uses full jitter, so
+    workers that failed together do not retry together. Requests that are not idempotent are only
+    retried when the server cannot have acted on them: a 429, or a failure to connect.
+    """
+
+    DEFAULT_MAX_ATTEMPTS = 3
+    DEFAULT_BACKOFF_BASE_IN_SECONDS = 0.5
+    DEFAULT_BACKOFF_MAX_IN_SECONDS = 30
+    DEFAULT_RETRY_STATUSES = frozenset([429, 502, 503, 504])
+    DEFAULT_RETRY_EXCEPTIONS = (requests.exceptions.Timeout, requests.exceptions.ConnectionError)
+    DEFAULT_UNSENT_EXCEPTIONS = (requests.exceptions.ConnectTimeout,)
+
+    IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'])
+    # merges are upserts and token requests have no side effects, so both are safe to repeat
+    IDEMPOTENT_POST_PATH_SUFFIXES = ('/members', '/auth/token')
+    NON_IDEMPOTENT_RETRY_STATUSES = frozenset([429])
+
+    def __init__(self, max_attempts=DEFAULT_MAX_ATTEMPTS,
+                 backoff_base=DEFAULT_BACKOFF_BASE_IN_SECONDS,
+                 backoff_max=DEFAULT_BACKOFF_MAX_IN_SECONDS,
+                 retry_statuses=DEFAULT_RETRY_STATUSES,
+                 retry_exceptions=DEFAULT_RETRY_EXCEPTIONS,
+                 unsent_exceptions=DEFAULT_UNSENT_EXCEPTIONS,
+                 sleep=time.sleep, random_fraction=random.random):
+        if max_attempts < 1:
+            raise ValueError('max_attempts must be at least 1.')
+
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.retry_statuses = frozenset(retry_statuses)
+        self.retry_exceptions = tuple(retry_exceptions)
+        self.unsent_exceptions = tuple(unsent_exceptions)
+        self._sleep = sleep
+        self._random_fraction = random_fraction
+
+    def is_idempotent(self, method, url):
+        if method in self.IDEMPOTENT_METHODS:
+            return True
+        if method == 'POST':
+            path = url.split('?', 1)[0].rstrip('/')
+            return path.endswith(self.IDEMPOTENT_POST_PATH_SUFFIXES)
+
+        return False
+
+    def should_retry_response(self, method, url, response, attempt):
+        if attempt >= self.max_attempts or response.status_code not in self.retry_statuses:
+            return False
+
+        return (self.is_idempotent(method, url)
+                or response.status_code in self.NON_IDEMPOTENT_RETRY_STATUSES)
+
+    def should_retry_exception(self, method, url, error, attempt):
+        if attempt >= self.max_attempts or not isinstance(error, self.retry_exceptions):
+            return False
+
+        return self.is_idempotent(method, url) or isinstance(error, self.unsent_exceptions)
+
+    def backoff(self, attempt):
+        ceiling = min(self.backoff_max, self.backoff_base * (2 ** (attempt - 1)))
+
+        return ceiling * self._random_fraction()
+
+    def wait_before_retry(self, attempt):
+        delay = self.backoff(attempt)
+
+        if delay > 0:
+            self._sleep(delay)
+
+        return delay
@@ -0,0 +1,144 @@
+import threading
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+
+class FairScheduler(object):
+    """Admits requests into a fixed number of in-flight slots by weighted fair queuing.
+
+    Requests wait in one queue per key, e.g. a priority class or an account, and each free slot
+    goes to the waiting key that has received the least service relative to its weight. Requests
+    with the same key are admitted in arrival order.
+    """
+
+    DEFAULT_WEIGHT = 1
+
+    def __init__(self, max_in_flight, weights=None):
+        if max_in_flight < 1:
+            raise ValueError('max_in_flight must be at least 1.')
+
+        self.max_in_flight = max_in_flight
+        self.weights = dict(weights or {})
+        self.in_flight = 0
+
+        self._condition = threading.Condition()
+        # ties between keys go to the one queued first
+        self._waiting = OrderedDict()
+        self._virtual_times = {}
+        self._virtual_clock = 0.0
+
+    @contextmanager
+    def slot(self, key):
+        self.acquire(key)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def acquire(self, key):
+        ticket = object()
+
+        with self._condition:
+            queue = self._get_queue(key)
+
+            if not queue:
+                # a key that was idle starts level with the others instead of catching up
+                self._virtual_times[key] = max(self._virtual_times[key], self._virtual_clock)
+            queue.append(ticket)
+
+            while self._next_key() != key or queue[0] is not ticket:
+                self._condition.wait()
+
+            queue.popleft()
+            self.in_flight += 1
+            self._virtual_clock = self._virtual_times[key]
+            self._virtual_times[key] += 1.0 / self.weights.get(key, self.DEFAULT_WEIGHT)
+
+            self._condition.notify_all()
+
+    def release(self):
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    def waiting(self, key):
+        with self._condition:
+            return len(self._waiting.get(key, ()))
+
+    def _get_queue(self, key):
+        # callers hold the condition
+        queue = self._waiting.get(key)
+
+        if queue is None:
+            queue = self._waiting[key] = deque()
+            self._virtual_times[key] = self._virtual_clock
+
+        return queue
+
+    def _next_key(self):
+        # callers hold the condition
+        next_key = None
+
+        for key, queue in self._waiting.items():
+            if not queue or self.in_flight >= self._slot_limit(key):
+                continue
+
+            if next_key is None or self._virtual_times[key] < self._virtual_times[next_key]:
+                next_key = key
+
+        return next_key
+
+    def _slot_limit(self, key):
+        return self.max_in_flight
+
+
+class PriorityScheduler(FairScheduler):
+    """Admits requests into a fixed number of in-flight slots by priority class.
+
+    Waiting requests are granted slots by weighted fair queuing between the classes, so bulk work
+    keeps making progress without holding back interactive calls. reserved_slots of the slots are
+    never given to LOW priority requests, which keeps room for latency-sensitive calls while bulk
+    traffic saturates the rest. Requests within a class are admitted in arrival order.
+    """
+
+    HIGH = 'high'
+    NORMAL = 'normal'
+    LOW = 'low'
+
+    # ties between classes go to the earlier one in this order
+    PRIORITIES = (HIGH, NORMAL, LOW)
+
+    DEFAULT_MAX_IN_FLIGHT = 8
+    DEFAULT_RESERVED_SLOTS = 2
+    DEFAULT_WEIGHTS = {
+        HIGH: 8,
+        NORMAL: 4,
+        LOW: 1,
+    }
+
+    def __init__(self, max_in_flight=DEFAULT_MAX_IN_FLIGHT, reserved_slots=DEFAULT_RESERVED_SLOTS,
+                 weights=None):
+        if not 0 <= reserved_slots < max_in_flight:
+            raise ValueError('reserved_slots must be at least 0 and less than max_in_flight.')
+
+        merged_weights = dict(self.DEFAULT_WEIGHTS)
+        merged_weights.update(weights or {})
+
+        super(PriorityScheduler, self).__init__(max_in_flight, weights=merged_weights)
+        self.reserved_slots = reserved_slots
+
+        with self._condition:
+            for priority in self.PRIORITIES:
+                self._get_queue(priority)
+
+    def slot(self, priority=NORMAL):
+        return super(PriorityScheduler, self).slot(priority)
+
+    def acquire(self, priority=NORMAL):
+        super(PriorityScheduler, self).acquire(priority)
+
+    def _slot_limit(self, priority):
+        if priority == self.LOW:
+            return self.max_in_flight - self.reserved_slots
+
+        return self.max_in_flight
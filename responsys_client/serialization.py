@@ -0,0 +1,97 @@
+import gzip
+import io
+import json as json_module
+from collections import namedtuple
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+from .exceptions import ResponsysClientError
+
+
+# a request body serialized ahead of the transport; record_count is kept for instrumentation
+EncodedBody = namedtuple('EncodedBody', ['data', 'headers', 'record_count'])
+
+
+class JSONCodec(object):
+    """Encodes and decodes JSON with the standard library, always to and from UTF-8 bytes."""
+
+    name = 'json'
+
+    def dumps(self, obj):
+        return json_module.dumps(obj, separators=(',', ':')).encode('utf-8')
+
+    def loads(self, data):
+        if isinstance(data, bytes):
+            data = data.decode('utf-8')
+
+        return json_module.loads(data)
+
+
+class OrjsonCodec(JSONCodec):
+    """Encodes and decodes JSON with orjson, which is several times faster than the stdlib."""
+
+    name = 'orjson'
+
+    def __init__(self):
+        if orjson is None:
+            raise ResponsysClientError('orjson must be installed to use the OrjsonCodec.')
+
+    def dumps(self, obj):
+        return orjson.dumps(obj)
+
+    def loads(self, data):
+        return orjson.loads(data)
+
+
+def get_default_codec():
+    """Returns the fastest codec available: orjson when installed, otherwise the stdlib."""
+    if orjson is not None:
+        return OrjsonCodec()
+
+    return JSONCodec()
+
+
+class PayloadEncoder(object):
+    """Serializes merge payloads ahead of the transport, optionally gzip-compressing them.
+
+    codec defaults to get_default_codec(). Bodies of at least compress_threshold bytes are sent
+    with Content-Encoding: gzip; compression is off unless a threshold is given.
+    """
+
+    # the fastest level; higher levels cost several times the CPU for little extra saving
+    DEFAULT_COMPRESS_LEVEL = 1
+
+    def __init__(self, codec=None, compress_threshold=None,
+                 compress_level=DEFAULT_COMPRESS_LEVEL):
+        self.codec = codec if codec is not None else get_default_codec()
+        self.compress_threshold = compress_threshold
+        self.compress_level = compress_level
+
+    def encode_merge(self, payload):
+        return self.encode(self.codec.dumps(payload),
+                           record_count=len(payload['recordData']['records']))
+
+    def encode(self, data, record_count=0):
+        headers = {'Content-Type': 'application/json'}
+
+        if self.compress_threshold is not None and len(data) >= self.compress_threshold:
+            data = self._compress(data)
+            headers['Content-Encoding'] = 'gzip'
+
+        return EncodedBody(data, headers, record_count)
+
+    def decode(self, response):
+        return self.codec.loads(response.content)
+
+    def _compress(self, data):
+        buffer = io.BytesIO()
+
+        # a fixed mtime keeps the output identical for identical payloads
+        with gzip.GzipFile(fileobj=buffer, mode='wb', compresslevel=self.compress_level,
+                           mtime=0) as gzip_file:
+            gzip_file.write(data)
+
+        return buffer.getvalue()
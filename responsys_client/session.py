@@ -0,0 +1,175 @@
+from collections import namedtuple
+
+from .dispatch import ConcurrentBatchDispatcher
+from .exceptions import ResponsysClientError
+from .scheduler import PriorityScheduler
+from .utils import chunk_iterable, group_by_field_set
+
+
+PROFILE_LIST = 'profile_list'
+LIST_EXTENSION = 'list_extension'
+SUPPLEMENTAL_TABLE = 'supplemental_table'
+
+# target is (profile_list,), (profile_list, list_extension) or (folder, table) by kind
+SessionOperation = namedtuple('SessionOperation', ['kind', 'target', 'merge_key', 'record'])
+
+# result is the operation's MergeResult, or None when error says why it was not merged
+OperationResult = namedtuple('OperationResult', ['operation', 'result', 'error'])
+
+
+class MergeSession(object):
+    """Collects merges across a profile list, its extension tables and supplemental tables.
+
+    Nothing is sent until commit, or until the session is left without an exception. Operations
+    are then grouped into full batches per table. Profile list merges are sent first, since
+    extension rows need their profile to exist. Extension and supplemental table merges are sent
+    together afterwards, and an extension row whose profile failed to merge is not sent. A row
+    is tied to its profile by any column the profile list's merges in the session match on. commit
+    returns an OperationResult per operation, in the order the operations were added.
+    """
+
+    DEFAULT_MAX_IN_FLIGHT = 4
+
+    def __init__(self, client, max_in_flight=DEFAULT_MAX_IN_FLIGHT, max_record_retries=0,
+                 priority=PriorityScheduler.NORMAL):
+        self.client = client
+        self.max_in_flight = max_in_flight
+        self.max_record_retries = max_record_retries
+        self.priority = priority
+        self.operations = []
+        self.results = None
+
+    def merge_profile_list_member(self, profile_list, profile_dict, merge_key):
+        return self._add(PROFILE_LIST, (profile_list,), merge_key, profile_dict)
+
+    def merge_profile_list_extension_member(self, profile_list, list_extension, data_dict,
+                                            merge_key):
+        return self._add(LIST_EXTENSION, (profile_list, list_extension), merge_key, data_dict)
+
+    def merge_supplemental_table_member(self, folder, table, data_dict):
+        return self._add(SUPPLEMENTAL_TABLE, (folder, table), None, data_dict)
+
+    def commit(self):
+        operations, self.operations = self.operations, []
+        results = [None] * len(operations)
+
+        profile_positions = [position for position, operation in enumerate(operations)
+                             if operation.kind == PROFILE_LIST]
+        self._send(operations, profile_positions, results)
+
+        match_fields = self._match_fields(operations)
+        failed_profiles = set()
+        for position in profile_positions:
+            if not self._succeeded(results[position]):
+                operation = operations[position]
+                failed_profiles.update(self._profile_keys(operation, match_fields))
+
+        dependent_positions = []
+        for position, operation in enumerate(operations):
+            if operation.kind == PROFILE_LIST:
+                continue
+
+            if operation.kind == LIST_EXTENSION and not failed_profiles.isdisjoint(
+                    self._profile_keys(operation, match_fields)):
+                results[position] = OperationResult(operation, None, ResponsysClientError(
+                    'The profile for this row failed to merge into {}.'
+                    .format(operation.target[0])))
+                continue
+
+            dependent_positions.append(position)
+
+        self._send(operations, dependent_positions, results)
+
+        self.results = results
+
+        return results
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # a session left by an exception is discarded rather than half applied
+        if exc_type is None:
+            self.commit()
+        else:
+            self.operations = []
+
+    def __len__(self):
+        return len(self.operations)
+
+    def _add(self, kind, target, merge_key, record):
+        operation = SessionOperation(kind, target, merge_key, dict(record))
+        self.operations.append(operation)
+
+        return operation
+
+    def _send(self, operations, positions, results):
+        def get_table(position):
+            operation = operations[position]
+            return operation.kind, operation.target, operation.merge_key
+
+        position_groups = group_by_field_set(
+            positions, get_record=lambda position: operations[position].record,
+            get_group=get_table)
+
+        batches = (batch_positions
+                   for group_positions in position_groups
+                   for batch_positions in chunk_iterable(
+                       group_positions, self.client.RESPONSYS_RECORD_PROCESS_LIMIT_QUANTITY))
+
+        def send_batch(batch_positions):
+            with self.client.priority(self.priority):
+                return self._merge(operations, batch_positions)
+
+        dispatcher = ConcurrentBatchDispatcher(max_in_flight=self.max_in_flight,
+                                               executor=self.client.executor)
+
+        for batch_result in dispatcher.dispatch(send_batch, batches):
+            for offset, position in enumerate(batch_result.records):
+                if batch_result.error is not None:
+                    results[position] = OperationResult(operations[position], None,
+                                                        batch_result.error)
+                else:
+                    results[position] = OperationResult(operations[position],
+                                                        batch_result.response[offset], None)
+
+    def _merge(self, operations, batch_positions):
+        first = operations[batch_positions[0]]
+        records = [operations[position].record for position in batch_positions]
+
+        if first.kind == PROFILE_LIST:
+            return self.client.merge_profile_list_members_with_results(
+                first.target[0], records, first.merge_key,
+                max_record_retries=self.max_record_retries)
+
+        if first.kind == LIST_EXTENSION:
+            return self.client.merge_profile_list_extension_members_with_results(
+                first.target[0], first.target[1], records, first.merge_key,
+                max_record_retries=self.max_record_retries)
+
+        return self.client.merge_supplemental_table_members_with_results(
+            first.target[0], first.target[1], records,
+            max_record_retries=self.max_record_retries)
+
+    @staticmethod
+    def _succeeded(operation_result):
+        return operation_result.error is None and operation_result.result.succeeded
+
+    @staticmethod
+    def _match_fields(operations):
+        # profiles and their extension rows may match on different columns, e.g. EMAIL_ADDRESS_
+        # and CUSTOMER_ID_, so a row is tied to its profile by any column either matches on
+        match_fields = {}
+        for operation in operations:
+            if operation.kind in (PROFILE_LIST, LIST_EXTENSION):
+                match_fields.setdefault(operation.target[0], set()).add(operation.merge_key)
+
+        return match_fields
+
+    @staticmethod
+    def _profile_keys(operation, match_fields):
+        profile_list = operation.target[0]
+
+        return set((profile_list, field, operation.record[field])
+                   for field in match_fields[profile_list]
+                   if operation.record.get(field) is not None)
@@ -0,0 +1,182 @@
+import hashlib
+import json
+import sqlite3
+import threading
+from collections import namedtuple
+
+from .dispatch import ConcurrentBatchDispatcher
+from .utils import chunk_iterable
+
+
+SyncResult = namedtuple('SyncResult', ['sent', 'skipped', 'failed'])
+
+
+class ContentHashIndex(object):
+    """A SQLite index of the content hash last merged for each (table, record key).
+
+    path may be a file, which keeps the index between runs, or ':memory:'.
+    """
+
+    LOOKUP_CHUNK_SIZE = 500
+
+    def __init__(self, path=':memory:'):
+        self.path = path
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+
+        with self._lock, self._connection:
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS record_hashes ('
+                'table_name TEXT NOT NULL, record_key TEXT NOT NULL, '
+                'content_hash TEXT NOT NULL, PRIMARY KEY (table_name, record_key))')
+
+    def get_hashes(self, table_name, record_keys):
+        hashes = {}
+
+        with self._lock:
+            for keys in chunk_iterable(record_keys, self.LOOKUP_CHUNK_SIZE):
+                query = ('SELECT record_key, content_hash FROM record_hashes '
+                         'WHERE table_name = ? AND record_key IN ({})'
+                         .format(','.join('?' * len(keys))))
+
+                hashes.update(self._connection.execute(query, [table_name] + keys))
+
+        return hashes
+
+    def set_hashes(self, table_name, hashes_by_key):
+        with self._lock, self._connection:
+            self._connection.executemany(
+                'INSERT OR REPLACE INTO record_hashes (table_name, record_key, content_hash) '
+                'VALUES (?, ?, ?)',
+                [(table_name, key, content_hash) for key, content_hash in hashes_by_key.items()])
+
+    def delete(self, table_name, record_keys):
+        with self._lock, self._connection:
+            self._connection.executemany(
+                'DELETE FROM record_hashes WHERE table_name = ? AND record_key = ?',
+                [(table_name, key) for key in record_keys])
+
+    def clear(self, table_name=None):
+        with self._lock, self._connection:
+            if table_name is None:
+                self._connection.execute('DELETE FROM record_hashes')
+            else:
+                self._connection.execute('DELETE FROM record_hashes WHERE table_name = ?',
+                                         (table_name,))
+
+    def close(self):
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class ChangeDetectingSync(object):
+    """Merges only the records whose content changed since they were last merged successfully.
+
+    Each record is hashed and compared against a ContentHashIndex keyed by table and merge key.
+    Unchanged records are skipped, and a record's hash is stored only once its merge succeeds,
+    so failed records are sent again on the next run. Failed batches are returned as BatchResults
+    with their error; records Responsys rejected individually are returned as BatchResults
+    without an error whose response lists their MergeResults.
+    """
+
+    def __init__(self, client, index=None):
+        self.client = client
+        self.index = index if index is not None else ContentHashIndex()
+
+    def sync_profile_list_members(self, profile_list, profile_dicts, merge_key, max_in_flight=1):
+        def send_batch(records):
+            return self.client.merge_profile_list_members_with_results(profile_list, records,
+                                                                       merge_key)
+
+        return self._sync('lists/{}'.format(profile_list), profile_dicts, (merge_key,),
+                          send_batch, max_in_flight)
+
+    def sync_profile_list_extension_members(self, profile_list, list_extension, data_dicts,
+                                            merge_key, max_in_flight=1):
+        def send_batch(records):
+            return self.client.merge_profile_list_extension_members_with_results(
+                profile_list, list_extension, records, merge_key)
+
+        table_name = 'lists/{}/listExtensions/{}'.format(profile_list, list_extension)
+
+        return self._sync(table_name, data_dicts, (merge_key,), send_batch, max_in_flight)
+
+    def sync_supplemental_table_members(self, folder, table, data_dicts, key_fields,
+                                        max_in_flight=1):
+        def send_batch(records):
+            return self.client.merge_supplemental_table_members_with_results(folder, table,
+                                                                             records)
+
+        if not isinstance(key_fields, (list, tuple)):
+            key_fields = (key_fields,)
+
+        table_name = 'folders/{}/suppData/{}'.format(folder, table)
+
+        return self._sync(table_name, data_dicts, tuple(key_fields), send_batch, max_in_flight)
+
+    def _sync(self, table_name, records, key_fields, send_batch, max_in_flight):
+        # a list so the generator below can count into it
+        skipped = [0]
+
+        def changed_records():
+            for chunk in chunk_iterable(records, self.index.LOOKUP_CHUNK_SIZE):
+                keyed = [(build_record_key(record, key_fields), build_content_hash(record), record)
+                         for record in chunk]
+                indexed_hashes = self.index.get_hashes(table_name, [key for key, _, _ in keyed])
+
+                for key, content_hash, record in keyed:
+                    if indexed_hashes.get(key) == content_hash:
+                        skipped[0] += 1
+                    else:
+                        yield key, content_hash, record
+
+        def send_keyed_batch(keyed_batch):
+            return send_batch([record for _, _, record in keyed_batch])
+
+        sent = 0
+        failed = []
+        dispatcher = ConcurrentBatchDispatcher(max_in_flight=max_in_flight,
+                                               executor=self.client.executor)
+
+        for result in dispatcher.dispatch(self.client.with_bulk_priority(send_keyed_batch),
+                                          self.client._batch_records(changed_records())):
+            if result.error is not None:
+                records = [record for _, _, record in result.records]
+                failed.append(result._replace(records=records))
+                continue
+
+            hashes = {}
+            rejected = []
+            for (key, content_hash, _), merge_result in zip(result.records, result.response):
+                if merge_result.succeeded:
+                    hashes[key] = content_hash
+                else:
+                    rejected.append(merge_result)
+
+            self.index.set_hashes(table_name, hashes)
+            sent += len(hashes)
+
+            if rejected:
+                failed.append(result._replace(records=[merge_result.record
+                                                       for merge_result in rejected],
+                                              response=rejected))
+
+        return SyncResult(sent, skipped[0], failed)
+
+
+def build_record_key(record, key_fields):
+    if len(key_fields) == 1:
+        return str(record[key_fields[0]])
+
+    return json.dumps([record[field] for field in key_fields], default=str)
+
+
+def build_content_hash(record):
+    content = json.dumps(record, sort_keys=True, separators=(',', ':'), default=str)
+
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
@@ -1,18 +1,54 @@
+import gzip
+import io
 import json
+import os
+import shutil
+import tempfile
+import threading
+import time
 from datetime import datetime
 from datetime import timedelta
-from unittest import TestCase
+from unittest import TestCase, skipIf
 
 import pytz
 import requests
 from mock import patch
 
+from .adaptive import AdaptiveController, AdaptiveSettings
+from .base import BaseResponsysClient
+from .buffer import MergeBuffer
+from .cache import TTLCache
+from .cli import main
 from .client import ResponsysClient
 from .exceptions import ResponsysClientError
+from .fake_server import FakeResponsysServer
+from .instrumentation import Histogram, Instrumentation, MetricsAggregator, build_path_template
+from .loader import BulkLoader, read_records
+from .locking import InterProcessLock
+from .pool import ResponsysClientPool
+from .ratelimit import RateLimiter, SharedRateLimiter
+from .records import MemberRecords, MemberRow
+from .retry import RetryPolicy
+from .scheduler import PriorityScheduler
+from .serialization import JSONCodec, OrjsonCodec, PayloadEncoder, get_default_codec
+from .session import LIST_EXTENSION, MergeSession
+from .sync import ChangeDetectingSync, ContentHashIndex
+from .tokens import FileTokenStore, MemoryTokenStore
+from .transport import RequestsTransport
+from .utils import convert_to_table_structure
+
+try:
+    from .async_client import AiohttpTransport, AsyncResponsysClient, aiohttp
+except SyntaxError:
+    AiohttpTransport = AsyncResponsysClient = aiohttp = None
 
 
 class MockResponseBase(object):
+    headers = {}
+
     class MockRequest(object):
+        method = 'GET'
+        path_url = '/'
         body = ''
 
     def json(self):
@@ -45,6 +81,11 @@ class MockResponseRateLimit429(MockResponseBase):
     text = 'you got rate limited'
 
 
+class MockResponseServiceUnavailable503(MockResponseBase):
+    status_code = 503
+    text = 'service unavailable'
+
+
 class MockResponseInvalidToken500(MockResponseBase):
     status_code = 500
     text = ('{"type":"","title":"Unexpected exception","errorCode":"UNEXPECTED_EXCEPTION",'
@@ -63,13 +104,26 @@ class MockResponseGeneric500(MockResponseBase):
         return json.loads(self.text)
 
 
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
 class ResponsysClientTests(TestCase):
 
     def setUp(self):
         super(ResponsysClientTests, self).setUp()
 
         self.client = ResponsysClient(username='test_user', password='test_pw',
-                                      login_url='https://testloginurl.net')
+                                      login_url='https://testloginurl.net',
+                                      retry_policy=RetryPolicy(sleep=lambda seconds: None))
 
     @staticmethod
     def get_mock_auth_success_response_200(auth_token, issued_endpoint, timestamp_js):
@@ -83,11 +137,27 @@ class ResponsysClientTests(TestCase):
 
         return MockResponse()
 
+    @staticmethod
+    def get_mock_members_response_200(field_names, records):
+        class MockResponse(MockResponseBase):
+            status_code = 200
+
+            def json(self):
+                return {u'recordData': {u'fieldNames': field_names, u'records': records}}
+
+        return MockResponse()
+
     def blank_api_state(self, api):
         self.assertIsNone(api.auth_token)
         self.assertIsNone(api.issued_url)
         self.assertIsNone(api.refresh_timestamp)
 
+    @staticmethod
+    def set_authenticated_api_state(api):
+        api.auth_token = 'cpowdij34023'
+        api.refresh_timestamp = datetime.utcnow().replace(tzinfo=pytz.utc)
+        api.issued_url = 'https://api2-018.responsys.net'
+
     def test_login_success(self):
         auth_token = u'E1sB4M4PSXHCDuXwnzJeGoiHo2RSs'
         issued_endpoint = u'https://api2-018.responsys.net'
@@ -97,7 +167,7 @@ class ResponsysClientTests(TestCase):
         api = self.client
         self.blank_api_state(api)
 
-        with patch.object(requests, 'request') as mock_request:
+        with patch.object(requests.Session, 'request') as mock_request:
             mock_request.return_value = self.get_mock_auth_success_response_200(auth_token,
                                                                                 issued_endpoint,
                                                                                 timestamp_js)
@@ -112,7 +182,7 @@ class ResponsysClientTests(TestCase):
         api = self.client
         self.blank_api_state(api)
 
-        with patch.object(requests, 'request') as mock_request:
+        with patch.object(requests.Session, 'request') as mock_request:
             mock_request.return_value = MockResponse400()
 
             with self.assertRaises(ResponsysClientError):
@@ -126,7 +196,7 @@ class ResponsysClientTests(TestCase):
 
         api.RESPONSYS_RATE_LIMIT_WAITING_PERIOD_IN_SECONDS = 0
 
-        with patch.object(requests, 'request') as mock_request:
+        with patch.object(requests.Session, 'request') as mock_request:
             mock_request.return_value = MockResponseRateLimit429()
             with self.assertRaises(ResponsysClientError):
                 result = api._login()
@@ -142,7 +212,7 @@ class ResponsysClientTests(TestCase):
         api = self.client
         self.blank_api_state(api)
 
-        with patch.object(requests, 'request') as mock_request:
+        with patch.object(requests.Session, 'request') as mock_request:
             mock_request.return_value = self.get_mock_auth_success_response_200(auth_token,
                                                                                 issued_endpoint,
                                                                                 timestamp_js)
@@ -167,7 +237,7 @@ class ResponsysClientTests(TestCase):
                                                              timestamp_js)
         response_sequence = [response_1, response_2]
 
-        with patch.object(requests, 'request') as mock_request:
+        with patch.object(requests.Session, 'request') as mock_request:
             mock_request.side_effect = response_sequence
 
             result = api._refresh_token()
@@ -192,7 +262,7 @@ class ResponsysClientTests(TestCase):
                                                              timestamp_js)
         response_sequence = [response_1, response_2]
 
-        with patch.object(requests, 'request') as mock_request:
+        with patch.object(requests.Session, 'request') as mock_request:
             mock_request.side_effect = response_sequence
 
             result = api._refresh_token()
@@ -207,7 +277,7 @@ class ResponsysClientTests(TestCase):
         api = self.client
         self.blank_api_state(api)
 
-        with patch.object(requests, 'request') as mock_request:
+        with patch.object(requests.Session, 'request') as mock_request:
             mock_request.return_value = MockResponseInvalidToken500()
 
             with self.assertRaises(ResponsysClientError):
@@ -242,7 +312,7 @@ class ResponsysClientTests(TestCase):
         api = self.client
         self.blank_api_state(api)
 
-        with patch.object(requests, 'request') as mock_request:
+        with patch.object(requests.Session, 'request') as mock_request:
             mock_request.return_value = self.get_mock_auth_success_response_200(auth_token,
                                                                                 issued_endpoint,
                                                                                 timestamp_js)
@@ -256,7 +326,7 @@ class ResponsysClientTests(TestCase):
         api = self.client
         self.blank_api_state(api)
 
-        with patch.object(requests, 'request') as mock_request:
+        with patch.object(requests.Session, 'request') as mock_request:
             mock_request.side_effect = requests.exceptions.Timeout()
 
             with self.assertRaises(ResponsysClientError):
@@ -268,7 +338,7 @@ class ResponsysClientTests(TestCase):
         api = self.client
         self.blank_api_state(api)
 
-        with patch.object(requests, 'request') as mock_request:
+        with patch.object(requests.Session, 'request') as mock_request:
             mock_request.side_effect = Exception()
 
             with self.assertRaises(Exception):
@@ -282,7 +352,7 @@ class ResponsysClientTests(TestCase):
 
         response = MockResponseGeneric500()
 
-        with patch.object(requests, 'request') as mock_request:
+        with patch.object(requests.Session, 'request') as mock_request:
             mock_request.return_value = response
 
             with self.assertRaises(ResponsysClientError):
@@ -307,7 +377,7 @@ class ResponsysClientTests(TestCase):
 
         response_sequence = [response_1, response_2, response_3]
 
-        with patch.object(requests, 'request') as mock_request:
+        with patch.object(requests.Session, 'request') as mock_request:
             mock_request.side_effect = response_sequence
 
             result = api.get_profile_lists()
@@ -318,3 +388,2066 @@ class ResponsysClientTests(TestCase):
         api = self.client
         response = MockResponseInvalidToken500()
         self.assertTrue(api._is_invalid_token_response(response))
+
+    def test_requests_reuse_transport_session(self):
+        api = self.client
+        self.set_authenticated_api_state(api)
+
+        with patch.object(requests.Session, 'request') as mock_request:
+            mock_request.return_value = MockResponse200()
+
+            api.get_profile_lists()
+            api.get_profile_lists()
+
+            self.assertEqual(2, mock_request.call_count)
+
+        adapter = api.transport.session.get_adapter(api.issued_url)
+        self.assertEqual(RequestsTransport.DEFAULT_POOL_MAXSIZE, adapter._pool_maxsize)
+
+    def test_context_manager_closes_owned_transport(self):
+        with patch.object(RequestsTransport, 'close') as mock_close:
+            with ResponsysClient(username='test_user', password='test_pw',
+                                 login_url='https://testloginurl.net') as api:
+                self.assertIsInstance(api, ResponsysClient)
+
+            self.assertEqual(1, mock_close.call_count)
+
+    def test_close_leaves_shared_transport_open(self):
+        transport = RequestsTransport(pool_maxsize=4)
+
+        with patch.object(RequestsTransport, 'close') as mock_close:
+            with ResponsysClient(username='test_user', password='test_pw',
+                                 login_url='https://testloginurl.net',
+                                 transport=transport) as api:
+                self.assertIs(transport, api.transport)
+
+            self.assertEqual(0, mock_close.call_count)
+
+        transport.close()
+
+    def test_merge_profile_list_members_in_batches_is_lazy(self):
+        api = self.client
+        self.set_authenticated_api_state(api)
+        consumed = []
+
+        def generate_profiles():
+            for customer_id in range(450):
+                consumed.append(customer_id)
+                yield {'CUSTOMER_ID_': str(customer_id)}
+
+        with patch.object(requests.Session, 'request') as mock_request:
+            mock_request.return_value = MockResponse200()
+
+            results = api.merge_profile_list_members_in_batches('test_list', generate_profiles(),
+                                                                'CUSTOMER_ID_')
+            self.assertEqual([], consumed)
+
+            next(results)
+            self.assertEqual(200, len(consumed))
+
+            remaining = list(results)
+            self.assertEqual(2, len(remaining))
+            self.assertEqual(3, mock_request.call_count)
+
+            batch_sizes = [len(call[1]['json']['recordData']['records'])
+                           for call in mock_request.call_args_list]
+            self.assertEqual([200, 200, 50], batch_sizes)
+
+    def test_merge_supplemental_table_members_in_batches_empty(self):
+        api = self.client
+
+        with patch.object(requests.Session, 'request') as mock_request:
+            results = list(api.merge_supplemental_table_members_in_batches('folder', 'table', []))
+
+            self.assertEqual([], results)
+            self.assertEqual(0, mock_request.call_count)
+
+    def test_merge_profile_list_members_concurrently_collects_errors_in_order(self):
+        api = self.client
+        self.set_authenticated_api_state(api)
+        profile_dicts = [{'CUSTOMER_ID_': str(customer_id)} for customer_id in range(1000)]
+
+        def respond(method, url, json=None, **kwargs):
+            if json['recordData']['records'][0] == ['400']:
+                return MockResponseGeneric500()
+            return MockResponse200()
+
+        with patch.object(requests.Session, 'request') as mock_request:
+            mock_request.side_effect = respond
+
+            results = list(api.merge_profile_list_members_concurrently(
+                'test_list', profile_dicts, 'CUSTOMER_ID_', max_in_flight=3))
+
+            self.assertEqual(5, mock_request.call_count)
+
+        self.assertEqual([0, 1, 2, 3, 4], [result.index for result in results])
+        self.assertEqual({'CUSTOMER_ID_': '200'}, results[1].records[0])
+        self.assertIsInstance(results[2].error, ResponsysClientError)
+        self.assertIsNone(results[2].response)
+        self.assertEqual([None] * 4, [result.error for result in results if result.index != 2])
+
+    def test_login_if_token_unchanged_skips_login_after_concurrent_refresh(self):
+        api = self.client
+        self.set_authenticated_api_state(api)
+
+        with patch.object(requests.Session, 'request') as mock_request:
+            auth_token = api._login_if_token_unchanged('already_replaced_token')
+
+            self.assertEqual(0, mock_request.call_count)
+
+        self.assertEqual(api.auth_token, auth_token)
+
+
+    def test_rate_limited_request_honors_retry_after(self):
+        sleeps = []
+        api = ResponsysClient(username='test_user', password='test_pw',
+                              login_url='https://testloginurl.net',
+                              rate_limiter=RateLimiter(sleep=sleeps.append))
+        self.set_authenticated_api_state(api)
+
+        rate_limited_response = MockResponseRateLimit429()
+        rate_limited_response.headers = {'Retry-After': '7'}
+
+        with patch.object(requests.Session, 'request') as mock_request:
+            mock_request.side_effect = [rate_limited_response, MockResponse200()]
+
+            response = api.send_request('GET', '/rest/api/v1.1/lists')
+
+            self.assertEqual(2, mock_request.call_count)
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(1, len(sleeps))
+        self.assertAlmostEqual(7, sleeps[0], places=1)
+
+
+    def test_rate_limited_merge_is_retried_with_its_body(self):
+        api = self.client
+        self.set_authenticated_api_state(api)
+        api.RESPONSYS_RATE_LIMIT_WAITING_PERIOD_IN_SECONDS = 0
+
+        with patch.object(requests.Session, 'request') as mock_request:
+            mock_request.side_effect = [MockResponseRateLimit429(), MockResponse200()]
+
+            api.unsubscribe_list_member('test_list', 1234)
+
+            self.assertEqual(2, mock_request.call_count)
+            first_call, second_call = mock_request.call_args_list
+
+        self.assertEqual(first_call[1]['json'], second_call[1]['json'])
+        self.assertEqual([['1234', 'O']], second_call[1]['json']['recordData']['records'])
+
+    def test_transient_failures_are_retried_up_to_max_attempts(self):
+        api = self.client
+        self.set_authenticated_api_state(api)
+
+        with patch.object(requests.Session, 'request') as mock_request:
+            mock_request.side_effect = [requests.exceptions.ConnectionError(),
+                                        MockResponseServiceUnavailable503(),
+                                        MockResponse200()]
+
+            response = api.send_request('GET', '/rest/api/v1.1/lists')
+
+            self.assertEqual(3, mock_request.call_count)
+
+        self.assertEqual(200, response.status_code)
+
+        with patch.object(requests.Session, 'request') as mock_request:
+            mock_request.return_value = MockResponseServiceUnavailable503()
+
+            response = api.send_request('GET', '/rest/api/v1.1/lists')
+
+            self.assertEqual(RetryPolicy.DEFAULT_MAX_ATTEMPTS, mock_request.call_count)
+
+        self.assertEqual(503, response.status_code)
+
+
+    def test_get_profile_list_members_batches_ids_and_skips_missing(self):
+        api = self.client
+        self.set_authenticated_api_state(api)
+        customer_ids = list(range(450))
+
+        def respond(method, url, json=None, **kwargs):
+            # only even customer ids exist
+            records = [[str(int(customer_id) * 10), customer_id] for customer_id in json['ids']
+                       if int(customer_id) % 2 == 0]
+            return self.get_mock_members_response_200(['RIID_', 'CUSTOMER_ID_'], records)
+
+        with patch.object(requests.Session, 'request') as mock_request:
+            mock_request.side_effect = respond
+
+            members = api.get_profile_list_members('test_list', customer_ids,
+                                                   fields=('RIID_',), max_in_flight=2)
+
+            self.assertEqual(3, mock_request.call_count)
+            first_call = mock_request.call_args_list[0]
+
+        self.assertEqual('POST', first_call[0][0])
+        self.assertTrue(first_call[0][1].endswith('/lists/test_list/members?action=get'))
+        self.assertEqual(['RIID_', 'CUSTOMER_ID_'], first_call[1]['json']['fieldList'])
+        self.assertEqual('c', first_call[1]['json']['queryAttribute'])
+        self.assertEqual(200, len(first_call[1]['json']['ids']))
+
+        self.assertEqual(225, len(members))
+        self.assertEqual({'RIID_': '4480', 'CUSTOMER_ID_': '448'}, members[448])
+        self.assertNotIn(449, members)
+
+    def test_get_extension_table_members_raises_on_failed_chunk(self):
+        api = self.client
+        self.set_authenticated_api_state(api)
+
+        with patch.object(requests.Session, 'request') as mock_request:
+            mock_request.return_value = MockResponseGeneric500()
+
+            with self.assertRaises(ResponsysClientError):
+                api.get_extension_table_members('test_list', 'test_pet', ['a@b.com'],
+                                                query_attribute='e')
+
+    def test_delete_profile_list_member_uses_riid_from_merge_response(self):
+        api = self.client
+        self.set_authenticated_api_state(api)
+        merge_response = self.get_mock_members_response_200(['RIID_'], [['9001']])
+
+        with patch.object(requests.Session, 'request') as mock_request:
+            mock_request.side_effect = [merge_response, MockResponse200()]
+
+            api.merge_profile_list_members('test_list', [{'CUSTOMER_ID_': 42}], 'CUSTOMER_ID_')
+            api.delete_profile_list_member('test_list', 42)
+
+            self.assertEqual(2, mock_request.call_count)
+            delete_call = mock_request.call_args_list[1]
+
+        self.assertEqual('DELETE', delete_call[0][0])
+        self.assertTrue(delete_call[0][1].endswith('/lists/test_list/members/9001'))
+        self.assertIsNone(api.riid_cache.get(('test_list', '42')))
+
+    def test_delete_list_extension_member_looks_up_stale_riid(self):
+        api = self.client
+        self.set_authenticated_api_state(api)
+        api.riid_cache.set(('test_list', '42'), '1')
+        not_found_response = MockResponse400()
+        not_found_response.status_code = 404
+        lookup_response = self.get_mock_members_response_200(['RIID_'], [['2']])
+
+        with patch.object(requests.Session, 'request') as mock_request:
+            mock_request.side_effect = [not_found_response, lookup_response, MockResponse200()]
+
+            api.delete_list_extension_member('test_list', 'test_pet', 42)
+
+            lookup_call = mock_request.call_args_list[1]
+            delete_call = mock_request.call_args_list[2]
+
+        self.assertEqual({'qa': 'c', 'id': '42', 'fs': 'RIID_'}, lookup_call[1]['params'])
+        self.assertTrue(delete_call[0][1].endswith('/listExtensions/test_pet/members/2'))
+        self.assertEqual('2', api.riid_cache.get(('test_list', '42')))
+
+    def test_delete_profile_list_members_resolves_uncached_riids_in_one_batch(self):
+        api = self.client
+        self.set_authenticated_api_state(api)
+        api.riid_cache.set(('test_list', '1'), '100')
+        lookup_response = self.get_mock_members_response_200(['RIID_', 'CUSTOMER_ID_'],
+                                                             [['200', '2'], ['300', '3']])
+
+        def respond(method, url, json=None, **kwargs):
+            if method == 'POST':
+                self.assertEqual(['RIID_', 'CUSTOMER_ID_'], json['fieldList'])
+                self.assertEqual(['2', '3', '4'], json['ids'])
+                return lookup_response
+            if url.endswith('/300'):
+                return MockResponseGeneric500()
+            return MockResponse200()
+
+        with patch.object(requests.Session, 'request') as mock_request:
+            mock_request.side_effect = respond
+
+            results = api.delete_profile_list_members('test_list', [1, 2, 3, 4])
+
+            self.assertEqual(4, mock_request.call_count)
+
+        self.assertEqual([1, 2], results.deleted)
+        self.assertEqual([4], results.missing)
+        self.assertEqual([3], list(results.failed))
+        self.assertIsInstance(results.failed[3], ResponsysClientError)
+        self.assertIsNone(api.riid_cache.get(('test_list', '1')))
+        self.assertEqual('300', api.riid_cache.get(('test_list', '3')))
+
+
+    def test_delete_profile_list_members_looks_up_stale_cached_riids(self):
+        api = self.client
+        self.set_authenticated_api_state(api)
+        api.riid_cache.set(('test_list', '1'), '100')
+        api.riid_cache.set(('test_list', '2'), '200')
+        not_found_response = MockResponse400()
+        not_found_response.status_code = 404
+        lookup_response = self.get_mock_members_response_200(['RIID_', 'CUSTOMER_ID_'],
+                                                             [['101', '1']])
+        deleted_paths = []
+
+        def respond(method, url, json=None, **kwargs):
+            if method == 'POST':
+                self.assertEqual(['1', '2'], json['ids'])
+                return lookup_response
+            deleted_paths.append(url.rsplit('/', 1)[1])
+            if url.endswith('/101'):
+                return MockResponse200()
+            return not_found_response
+
+        with patch.object(requests.Session, 'request') as mock_request:
+            mock_request.side_effect = respond
+
+            results = api.delete_profile_list_members('test_list', [1, 2])
+
+        self.assertEqual(['100', '200'], sorted(deleted_paths[:2]))
+        self.assertEqual(['101'], deleted_paths[2:])
+        self.assertEqual([1], results.deleted)
+        self.assertEqual([2], results.missing)
+        self.assertEqual({}, results.failed)
+        self.assertIsNone(api.riid_cache.get(('test_list', '1')))
+        self.assertIsNone(api.riid_cache.get(('test_list', '2')))
+
+    def test_get_profile_lists_uses_opt_in_metadata_cache(self):
+        api = ResponsysClient(username='test_user', password='test_pw',
+                              login_url='https://testloginurl.net',
+                              metadata_cache=TTLCache(max_size=10, ttl=60))
+        self.set_authenticated_api_state(api)
+        lists_response = MockResponse200()
+        lists_response.json = lambda: [{'name': 'test_list'}]
+
+        with patch.object(requests.Session, 'request') as mock_request:
+            mock_request.return_value = lists_response
+
+            first_result = api.get_profile_lists()
+            first_result.append({'name': 'mutated'})
+            second_result = api.get_profile_lists()
+
+            self.assertEqual(1, mock_request.call_count)
+
+            api.invalidate_metadata_cache()
+            api.get_profile_lists()
+
+            self.assertEqual(2, mock_request.call_count)
+
+        self.assertEqual([{'name': 'test_list'}], second_result)
+
+    def test_get_profile_list_members_as_rows(self):
+        api = self.client
+        self.set_authenticated_api_state(api)
+        response = self.get_mock_members_response_200(['RIID_', 'CUSTOMER_ID_'],
+                                                      [['10', '1'], ['20', '2']])
+
+        with patch.object(requests.Session, 'request') as mock_request:
+            mock_request.return_value = response
+
+            members = api.get_profile_list_members('test_list', [1, 2], as_rows=True)
+
+        self.assertIsInstance(members[2], MemberRow)
+        self.assertEqual('20', members[2].RIID_)
+        self.assertEqual({'RIID_': '20', 'CUSTOMER_ID_': '2'}, members[2])
+        self.assertEqual('10', api.riid_cache.get(('test_list', '1')))
+
+    def test_iter_profile_list_members_creates_rows_as_they_are_reached(self):
+        api = self.client
+        self.set_authenticated_api_state(api)
+        response = self.get_mock_members_response_200(['RIID_', 'CUSTOMER_ID_'],
+                                                      [['10', '1'], ['20', '2'], ['30', '3']])
+        created_rows = []
+        original_init = MemberRow.__init__
+
+        def record_init(row, field_indexes, values):
+            created_rows.append(values)
+            original_init(row, field_indexes, values)
+
+        with patch.object(requests.Session, 'request') as mock_request, \
+                patch.object(MemberRow, '__init__', record_init), \
+                patch('responsys_client.base.convert_to_list_of_dicts') as convert:
+            mock_request.return_value = response
+
+            rows = api.iter_profile_list_members('test_list', [1, 2, 3])
+            first_row = next(rows)
+
+            self.assertEqual([['10', '1']], created_rows)
+            self.assertEqual(['20', '30'], [row.RIID_ for row in rows])
+            self.assertEqual(0, convert.call_count)
+
+        self.assertIsInstance(first_row, MemberRow)
+        self.assertEqual(3, len(created_rows))
+        self.assertEqual('30', api.riid_cache.get(('test_list', '3')))
+
+    def test_merge_with_results_retries_only_retryable_failures(self):
+        api = self.client
+        self.set_authenticated_api_state(api)
+        profile_dicts = [{'CUSTOMER_ID_': str(customer_id)} for customer_id in range(4)]
+        first_response = self.get_mock_members_response_200(
+            ['RIID_'], [['101'], ['MERGEFAILED: Record 1 = LOCK_TIMEOUT: row locked'],
+                        ['MERGEFAILED: Record 2 = INVALID_EMAIL_ADDRESS: bad address'],
+                        ['104']])
+        retry_response = self.get_mock_members_response_200(['RIID_'], [['102']])
+
+        with patch.object(requests.Session, 'request') as mock_request:
+            mock_request.side_effect = [first_response, retry_response]
+
+            results = api.merge_profile_list_members_with_results(
+                'test_list', profile_dicts, 'CUSTOMER_ID_', max_record_retries=2)
+
+            self.assertEqual(2, mock_request.call_count)
+            self.assertEqual([['1']],
+                             mock_request.call_args[1]['json']['recordData']['records'])
+
+        self.assertEqual(['101', '102', None, '104'], [result.riid for result in results])
+        self.assertEqual(('INVALID_EMAIL_ADDRESS', 'bad address'),
+                         (results[2].error_code, results[2].message))
+        self.assertEqual({'CUSTOMER_ID_': '2'}, results[2].record)
+        self.assertEqual([True, True, False, True], [result.succeeded for result in results])
+
+    def test_merge_with_results_keeps_merged_records_when_a_retry_request_fails(self):
+        api = self.client
+        self.set_authenticated_api_state(api)
+        profile_dicts = [{'CUSTOMER_ID_': str(customer_id)} for customer_id in range(3)]
+        first_response = self.get_mock_members_response_200(
+            ['RIID_'], [['101'], ['102'], ['MERGEFAILED: Record 2 = LOCK_TIMEOUT: row locked']])
+
+        with patch.object(requests.Session, 'request') as mock_request:
+            mock_request.side_effect = [first_response] + [
+                MockResponseServiceUnavailable503() for _ in range(3)]
+
+            results = api.merge_profile_list_members_with_results(
+                'test_list', profile_dicts, 'CUSTOMER_ID_', max_record_retries=1)
+
+        self.assertEqual(['101', '102', None], [result.riid for result in results])
+        self.assertEqual([True, True, False], [result.succeeded for result in results])
+        self.assertEqual('REQUEST_FAILED', results[2].error_code)
+        self.assertEqual({'CUSTOMER_ID_': '2'}, results[2].record)
+
+    def test_get_supplemental_table_members_by_keys(self):
+        api = self.client
+        self.set_authenticated_api_state(api)
+        rows = {('1', 'a'): [['1', 'a', '9.99']], ('2', 'b'): []}
+
+        def respond(method, url, params=None, **kwargs):
+            records = rows[tuple(params['id'])]
+            return self.get_mock_members_response_200(['STORE_ID', 'SKU', 'PRICE'], records)
+
+        with patch.object(requests.Session, 'request') as mock_request:
+            mock_request.side_effect = respond
+
+            rows_by_key = api.get_supplemental_table_members_by_keys(
+                'folder', 'prices', ('STORE_ID', 'SKU'), [('1', 'a'), ('2', 'b')],
+                max_in_flight=2)
+
+            self.assertEqual(2, mock_request.call_count)
+            self.assertEqual(['STORE_ID', 'SKU'], mock_request.call_args[1]['params']['qa'])
+
+        self.assertEqual({('1', 'a'): {'STORE_ID': '1', 'SKU': 'a', 'PRICE': '9.99'}},
+                         rows_by_key)
+
+    def test_get_supplemental_table_members_by_keys_raises_errors(self):
+        api = self.client
+        self.set_authenticated_api_state(api)
+
+        not_found_response = MockResponse400()
+        not_found_response.status_code = 404
+
+        with patch.object(requests.Session, 'request') as mock_request:
+            mock_request.side_effect = [not_found_response, MockResponse400()]
+
+            with self.assertRaises(ResponsysClientError):
+                api.get_supplemental_table_members_by_keys('folder', 'prices', 'SKU', ['a', 'b'],
+                                                           max_in_flight=1)
+
+
+
+class TTLCacheTests(TestCase):
+
+    def setUp(self):
+        super(TTLCacheTests, self).setUp()
+
+        self.clock = FakeClock()
+        self.cache = TTLCache(max_size=2, ttl=10, clock=self.clock)
+
+    def test_entries_expire_after_ttl(self):
+        self.cache.set('a', 1)
+
+        self.clock.sleep(9)
+        self.assertEqual(1, self.cache.get('a'))
+
+        self.clock.sleep(1)
+        self.assertIsNone(self.cache.get('a'))
+
+    def test_least_recently_used_entry_is_evicted(self):
+        self.cache.set('a', 1)
+        self.cache.set('b', 2)
+        self.cache.get('a')
+        self.cache.set('c', 3)
+
+        self.assertEqual(2, len(self.cache))
+        self.assertEqual(1, self.cache.get('a'))
+        self.assertIsNone(self.cache.get('b'))
+
+    def test_get_or_load_runs_one_load_for_concurrent_callers(self):
+        cache = TTLCache(max_size=2, ttl=10)
+        loads = []
+        release_load = threading.Event()
+
+        def load():
+            loads.append(1)
+            release_load.wait(1)
+            return 'value'
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(cache.get_or_load('a', load)))
+                   for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        release_load.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(1, len(loads))
+        self.assertEqual(['value'] * 5, results)
+
+class RetryPolicyTests(TestCase):
+
+    def setUp(self):
+        super(RetryPolicyTests, self).setUp()
+
+        self.policy = RetryPolicy(max_attempts=4, backoff_base=1, backoff_max=5,
+                                  random_fraction=lambda: 1.0)
+        self.base_url = 'https://api2-018.responsys.net/rest/api/v1.1'
+
+    def test_is_idempotent(self):
+        policy = self.policy
+
+        self.assertTrue(policy.is_idempotent('GET', self.base_url + '/lists'))
+        self.assertTrue(policy.is_idempotent('DELETE', self.base_url + '/lists/a/members/1'))
+        self.assertTrue(policy.is_idempotent('POST', self.base_url + '/lists/a/members'))
+        self.assertTrue(policy.is_idempotent('POST', self.base_url + '/auth/token?a=b'))
+        self.assertFalse(policy.is_idempotent('POST', self.base_url + '/campaigns/a/email'))
+
+    def test_non_idempotent_requests_only_retry_when_unsent(self):
+        policy = self.policy
+        url = self.base_url + '/campaigns/a/email'
+
+        self.assertTrue(policy.should_retry_response('POST', url, MockResponseRateLimit429(), 1))
+        self.assertFalse(policy.should_retry_response('POST', url,
+                                                      MockResponseServiceUnavailable503(), 1))
+        self.assertTrue(policy.should_retry_exception('POST', url,
+                                                      requests.exceptions.ConnectTimeout(), 1))
+        self.assertFalse(policy.should_retry_exception('POST', url,
+                                                       requests.exceptions.ReadTimeout(), 1))
+
+    def test_should_retry_stops_at_max_attempts(self):
+        url = self.base_url + '/lists'
+
+        self.assertTrue(self.policy.should_retry_response('GET', url,
+                                                          MockResponseServiceUnavailable503(), 3))
+        self.assertFalse(self.policy.should_retry_response('GET', url,
+                                                           MockResponseServiceUnavailable503(), 4))
+        self.assertFalse(self.policy.should_retry_response('GET', url, MockResponseGeneric500(), 1))
+
+    def test_backoff_is_exponential_and_capped(self):
+        self.assertEqual([1, 2, 4, 5, 5], [self.policy.backoff(attempt) for attempt in range(1, 6)])
+
+class RateLimiterTests(TestCase):
+
+    def setUp(self):
+        super(RateLimiterTests, self).setUp()
+
+        self.clock = FakeClock()
+        self.rate_limiter = RateLimiter(budgets={RateLimiter.MERGE: (60, 2)}, clock=self.clock,
+                                        sleep=self.clock.sleep)
+
+    def test_classify(self):
+        limiter = self.rate_limiter
+        base_url = 'https://api2-018.responsys.net/rest/api/v1.1'
+
+        self.assertEqual(RateLimiter.AUTH, limiter.classify('POST', base_url + '/auth/token'))
+        self.assertEqual(RateLimiter.MERGE, limiter.classify('POST', base_url + '/lists/a/members'))
+        self.assertEqual(RateLimiter.RETRIEVE, limiter.classify('GET', base_url + '/lists'))
+        self.assertEqual(RateLimiter.DELETE,
+                         limiter.classify('DELETE', base_url + '/lists/a/members/1'))
+
+    def test_wait_paces_after_burst(self):
+        delays = [self.rate_limiter.wait(RateLimiter.MERGE) for _ in range(4)]
+
+        self.assertEqual([0.0, 0.0, 1.0, 1.0], delays)
+        self.assertEqual(1002.0, self.clock.now)
+
+    def test_throttled_backs_off_exponentially_and_recovers(self):
+        limiter = self.rate_limiter
+        bucket = limiter.buckets[RateLimiter.MERGE]
+
+        self.assertEqual(1.0, limiter.throttled(RateLimiter.MERGE))
+        self.assertEqual(2.0, limiter.throttled(RateLimiter.MERGE))
+        self.assertEqual(3.0, limiter.throttled(RateLimiter.MERGE, max_backoff=3))
+        self.assertEqual(0.125, bucket.rate)
+
+        self.assertEqual(3.0, limiter.wait(RateLimiter.MERGE))
+
+        limiter.succeeded(RateLimiter.MERGE)
+        self.assertEqual(0, bucket.consecutive_throttles)
+        self.assertGreater(bucket.rate, 0.125)
+
+    def test_parse_retry_after_http_date(self):
+        self.clock.now = 1476401899.0
+
+        self.assertEqual(30.0, self.rate_limiter.parse_retry_after(
+            'Thu, 13 Oct 2016 23:38:49 GMT'))
+        self.assertIsNone(self.rate_limiter.parse_retry_after('soon'))
+
+class SharedRateLimiterTests(TestCase):
+
+    def setUp(self):
+        super(SharedRateLimiterTests, self).setUp()
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'budgets.sqlite')
+        self.clock = FakeClock()
+
+    def build_limiter(self):
+        # each limiter stands in for a separate worker process
+        return SharedRateLimiter(self.path, budgets={RateLimiter.MERGE: (60, 2)},
+                                 clock=self.clock, sleep=self.clock.sleep)
+
+    def test_participants_draw_from_one_budget(self):
+        first_limiter = self.build_limiter()
+        second_limiter = self.build_limiter()
+
+        delays = [first_limiter.reserve(RateLimiter.MERGE),
+                  second_limiter.reserve(RateLimiter.MERGE),
+                  first_limiter.reserve(RateLimiter.MERGE),
+                  second_limiter.reserve(RateLimiter.MERGE)]
+
+        self.assertEqual([0.0, 0.0, 1.0, 2.0], delays)
+
+    def test_throttling_pauses_every_participant(self):
+        first_limiter = self.build_limiter()
+        second_limiter = self.build_limiter()
+
+        first_limiter.throttled(RateLimiter.MERGE, retry_after='30')
+
+        self.assertEqual(30.0, second_limiter.reserve(RateLimiter.MERGE))
+        self.assertEqual(0.0, second_limiter.reserve(RateLimiter.RETRIEVE))
+        self.assertEqual(0.5, second_limiter.buckets[RateLimiter.MERGE].rate)
+
+    def test_backoff_doubles_with_throttles_seen_by_any_participant(self):
+        first_limiter = self.build_limiter()
+        second_limiter = self.build_limiter()
+
+        waits = [first_limiter.throttled(RateLimiter.MERGE),
+                 first_limiter.throttled(RateLimiter.MERGE),
+                 second_limiter.throttled(RateLimiter.MERGE)]
+        first_limiter.succeeded(RateLimiter.MERGE)
+
+        self.assertEqual([1.0, 2.0, 4.0], waits)
+        self.assertEqual(1.0, second_limiter.throttled(RateLimiter.MERGE))
+
+
+class AdaptiveControllerTests(TestCase):
+
+    def test_successes_grow_batch_size_and_concurrency_up_to_limits(self):
+        controller = AdaptiveController(initial_batch_size=50, max_batch_size=70,
+                                        initial_in_flight=1, max_in_flight=3)
+
+        controller.record(0.5, 1000, 50, 200)
+        self.assertEqual(AdaptiveSettings(60, 2), controller.settings)
+
+        for _ in range(10):
+            controller.record(0.5, 1000, 50, 200)
+
+        self.assertEqual(AdaptiveSettings(70, 3), controller.settings)
+        self.assertEqual(11, controller.snapshot()['succeeded'])
+
+    def test_throttling_halves_concurrency_and_failures_halve_both(self):
+        controller = AdaptiveController(initial_batch_size=100, initial_in_flight=8,
+                                        min_batch_size=30)
+
+        controller.record(0.5, 1000, 100, 429)
+        self.assertEqual(AdaptiveSettings(100, 4), controller.settings)
+
+        controller.record(0.5, 0, 100, 503)
+        controller.record(0.5, 0, 100, None)
+        self.assertEqual(AdaptiveSettings(30, 1), controller.settings)
+
+        # client errors say nothing about load
+        controller.record(0.5, 0, 100, 400)
+        self.assertEqual(AdaptiveSettings(30, 1), controller.settings)
+
+        snapshot = controller.snapshot()
+        self.assertEqual((1, 2), (snapshot['throttled'], snapshot['failed']))
+
+    def test_slow_batches_shrink_batch_size(self):
+        controller = AdaptiveController(initial_batch_size=100, initial_in_flight=2,
+                                        target_latency=2.0)
+
+        controller.record(3.0, 1000, 100, 200)
+
+        self.assertEqual(AdaptiveSettings(50, 2), controller.settings)
+        self.assertEqual(3.0, controller.snapshot()['last_latency'])
+
+    def test_max_payload_bytes_caps_batch_size_by_record_width(self):
+        controller = AdaptiveController(initial_batch_size=100, max_payload_bytes=20000)
+
+        # 500 bytes per record, so 40 fit
+        controller.record(0.5, 50000, 100, 200)
+
+        self.assertEqual(40, controller.settings.batch_size)
+
+    def test_merge_adaptively_grows_batches_and_reports_errors_in_order(self):
+        api = ResponsysClient(username='test_user', password='test_pw',
+                              login_url='https://testloginurl.net')
+        ResponsysClientTests.set_authenticated_api_state(api)
+        controller = AdaptiveController(initial_batch_size=50, initial_in_flight=1,
+                                        max_in_flight=1)
+        profile_dicts = [{'CUSTOMER_ID_': str(customer_id)} for customer_id in range(250)]
+        batch_sizes = []
+
+        def respond(method, url, json=None, **kwargs):
+            batch_sizes.append(len(json['recordData']['records']))
+            if len(batch_sizes) == 3:
+                return MockResponse400()
+            return MockResponse200()
+
+        with patch.object(requests.Session, 'request') as mock_request:
+            mock_request.side_effect = respond
+
+            results = list(api.merge_profile_list_members_adaptively(
+                'test_list', profile_dicts, 'CUSTOMER_ID_', controller=controller))
+
+        # a 400 is the caller's problem, so the third batch leaves the settings alone
+        self.assertEqual([50, 60, 70, 70], batch_sizes)
+        self.assertEqual([0, 1, 2, 3], [result.index for result in results])
+        self.assertIsInstance(results[2].error, ResponsysClientError)
+        self.assertEqual({}, results[3].response)
+        self.assertEqual({'CUSTOMER_ID_': '249'}, results[3].records[-1])
+
+    def test_merge_adaptively_reports_attempts_the_retry_policy_absorbs(self):
+        api = ResponsysClient(username='test_user', password='test_pw',
+                              login_url='https://testloginurl.net')
+        ResponsysClientTests.set_authenticated_api_state(api)
+        controller = AdaptiveController(initial_batch_size=50, initial_in_flight=2)
+        rate_limited_response = MockResponseRateLimit429()
+        rate_limited_response.headers = {'Retry-After': '0'}
+
+        with patch.object(requests.Session, 'request') as mock_request:
+            mock_request.side_effect = [rate_limited_response,
+                                        MockResponseServiceUnavailable503(), MockResponse200()]
+
+            results = list(api.merge_profile_list_members_adaptively(
+                'test_list', [{'CUSTOMER_ID_': '1'}], 'CUSTOMER_ID_', controller=controller))
+
+        self.assertIsNone(results[0].error)
+        snapshot = controller.snapshot()
+        self.assertEqual((1, 1, 1), (snapshot['throttled'], snapshot['failed'],
+                                     snapshot['succeeded']))
+        # halved by the 503 before the final success grows it again
+        self.assertEqual(35, snapshot['batch_size'])
+
+    def test_merge_adaptively_keeps_a_controller_per_table(self):
+        api = ResponsysClient(username='test_user', password='test_pw',
+                              login_url='https://testloginurl.net')
+        ResponsysClientTests.set_authenticated_api_state(api)
+
+        with patch.object(requests.Session, 'request') as mock_request:
+            mock_request.return_value = MockResponse200()
+
+            list(api.merge_supplemental_table_members_adaptively(
+                'folder', 'table', [{'ID': '1'}]))
+
+        path = '/rest/api/v1.1/folders/folder/suppData/table/members'
+        controller = api.adaptive_controllers[path]
+        self.assertIs(controller, api.get_adaptive_controller(path))
+        self.assertEqual(200, controller.max_batch_size)
+        self.assertEqual(1, controller.snapshot()['succeeded'])
+
+
+class PrioritySchedulerTests(TestCase):
+
+    def start_waiting_request(self, scheduler, priority, admitted):
+        def send():
+            with scheduler.slot(priority):
+                admitted.append(priority)
+
+        thread = threading.Thread(target=send)
+        # returns once the request is queued, so requests queue in the order they are started
+        waiting = scheduler.waiting(priority)
+        thread.start()
+        self.addCleanup(thread.join)
+
+        for _ in range(1000):
+            if scheduler.waiting(priority) > waiting:
+                break
+            time.sleep(0.001)
+
+        return thread
+
+    def test_reserved_slots_are_kept_for_higher_priorities(self):
+        scheduler = PriorityScheduler(max_in_flight=2, reserved_slots=1)
+        admitted = []
+
+        scheduler.acquire(PriorityScheduler.LOW)
+        thread = self.start_waiting_request(scheduler, PriorityScheduler.LOW, admitted)
+        self.assertEqual(1, scheduler.waiting(PriorityScheduler.LOW))
+
+        scheduler.acquire(PriorityScheduler.HIGH)
+        self.assertEqual(2, scheduler.in_flight)
+
+        scheduler.release()
+        scheduler.release()
+        thread.join()
+
+        self.assertEqual([PriorityScheduler.LOW], admitted)
+        self.assertEqual(0, scheduler.in_flight)
+
+    def test_waiting_requests_are_admitted_by_weighted_fair_queuing(self):
+        scheduler = PriorityScheduler(max_in_flight=1, reserved_slots=0)
+        admitted = []
+
+        scheduler.acquire()
+        threads = [self.start_waiting_request(scheduler, priority, admitted)
+                   for priority in [PriorityScheduler.LOW] * 3 + [PriorityScheduler.HIGH] * 3]
+        scheduler.release()
+
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(['high', 'low', 'high', 'high', 'low', 'low'], admitted)
+
+    def test_client_sends_batches_at_low_priority(self):
+        scheduler = PriorityScheduler()
+        client = ResponsysClient(username='test_user', password='test_pw',
+                                 login_url='https://testloginurl.net', scheduler=scheduler)
+        ResponsysClientTests.set_authenticated_api_state(client)
+        priorities = []
+
+        def respond(method, url, **kwargs):
+            priorities.append(client._priorities.current)
+            return MockResponse200()
+
+        with patch.object(requests.Session, 'request') as mock_request:
+            mock_request.side_effect = respond
+
+            list(client.merge_profile_list_members_concurrently(
+                'master', [{'CUSTOMER_ID_': '1'}], 'CUSTOMER_ID_'))
+            list(client.merge_supplemental_table_members_in_batches(
+                'folder', 'table', [{'ID': '1'}]))
+            with client.priority(PriorityScheduler.HIGH):
+                client.unsubscribe_list_member('master', '1')
+
+        self.assertEqual([PriorityScheduler.LOW, PriorityScheduler.LOW, PriorityScheduler.HIGH],
+                         priorities)
+
+    def test_high_priority_requests_skip_a_rate_budget_saturated_by_low_ones(self):
+        clock = FakeClock()
+        client = ResponsysClient(username='test_user', password='test_pw',
+                                 login_url='https://testloginurl.net',
+                                 scheduler=PriorityScheduler(),
+                                 rate_limiter=RateLimiter(budgets={RateLimiter.MERGE: (60, 5)},
+                                                          clock=clock, sleep=clock.sleep))
+        ResponsysClientTests.set_authenticated_api_state(client)
+
+        with patch.object(requests.Session, 'request') as mock_request:
+            mock_request.return_value = MockResponse200()
+
+            with client.priority(PriorityScheduler.LOW):
+                for customer_id in range(6):
+                    client.unsubscribe_list_member('master', str(customer_id))
+
+            # the LOW merges have waited for tokens since they used up the unreserved burst
+            self.assertEqual(1003.0, clock.now)
+            self.assertGreater(client.rate_limiter.buckets[RateLimiter.MERGE].acquire_above(2), 0)
+
+            with client.priority(PriorityScheduler.HIGH):
+                client.unsubscribe_list_member('master', 'interactive')
+
+        self.assertEqual(1003.0, clock.now)
+
+    def test_sync_and_bulk_load_keep_the_callers_priority(self):
+        client = ResponsysClient(username='test_user', password='test_pw',
+                                 login_url='https://testloginurl.net',
+                                 scheduler=PriorityScheduler())
+        ResponsysClientTests.set_authenticated_api_state(client)
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'members.jsonl')
+        with open(path, 'w') as data_file:
+            data_file.write('{"CUSTOMER_ID_": "1"}\n')
+        priorities = []
+
+        def respond(method, url, **kwargs):
+            priorities.append(client._priorities.current)
+            return MockResponse200()
+
+        with patch.object(requests.Session, 'request') as mock_request:
+            mock_request.side_effect = respond
+
+            with client.priority(PriorityScheduler.HIGH):
+                ChangeDetectingSync(client).sync_profile_list_members(
+                    'master', [{'CUSTOMER_ID_': '1'}], 'CUSTOMER_ID_')
+                BulkLoader(client).load_profile_list_members(path, 'master', 'CUSTOMER_ID_')
+
+            BulkLoader(client).load_profile_list_members(path, 'master', 'CUSTOMER_ID_')
+
+        self.assertEqual([PriorityScheduler.HIGH, PriorityScheduler.HIGH, PriorityScheduler.LOW],
+                         priorities)
+
+
+class ResponsysClientPoolTests(TestCase):
+
+    def setUp(self):
+        super(ResponsysClientPoolTests, self).setUp()
+
+        self.pool = ResponsysClientPool(max_in_flight=4, max_in_flight_per_account=2)
+        self.addCleanup(self.pool.close)
+        self.pool.register('brand_a', 'user_a', 'password_a', 'https://testloginurl.net')
+        self.pool.register('brand_b', 'user_b', 'password_b', 'https://testloginurl.net',
+                           budgets={RateLimiter.MERGE: (60, 1)})
+
+    def test_clients_are_created_lazily_and_share_resources(self):
+        first_client = self.pool['brand_a']
+        second_client = self.pool.get('brand_b')
+
+        self.assertIs(first_client, self.pool.get('brand_a'))
+        self.assertIs(first_client.transport, second_client.transport)
+        self.assertIs(self.pool.executor, first_client.executor.executor)
+        self.assertIs(self.pool.executor, second_client.executor.executor)
+        self.assertEqual(1, second_client.rate_limiter.buckets[RateLimiter.MERGE].capacity)
+        self.assertEqual('user_b', second_client.username)
+        self.assertEqual(['brand_a', 'brand_b'], self.pool.accounts)
+
+        with self.assertRaises(ResponsysClientError):
+            self.pool.get('brand_c')
+
+    def test_accounts_are_capped_and_queue_fairly_for_shared_slots(self):
+        first_scheduler = self.pool['brand_a'].scheduler
+        second_scheduler = self.pool['brand_b'].scheduler
+        admitted = []
+        in_flight = []
+
+        for _ in range(2):
+            slot = first_scheduler.slot()
+            slot.__enter__()
+            in_flight.append(slot)
+
+        # brand_a is at its cap, so the pool still has slots left for brand_b
+        with second_scheduler.slot():
+            admitted.append('brand_b')
+
+        self.assertEqual(['brand_b'], admitted)
+        self.assertEqual(2, self.pool.scheduler.in_flight)
+
+        for slot in in_flight:
+            slot.__exit__(None, None, None)
+
+        self.assertEqual(0, self.pool.scheduler.in_flight)
+
+    def test_concurrent_merges_run_on_the_shared_executor(self):
+        client = self.pool['brand_a']
+        ResponsysClientTests.set_authenticated_api_state(client)
+        threads = set()
+
+        def respond(method, url, **kwargs):
+            threads.add(threading.current_thread().name)
+            return MockResponse200()
+
+        with patch.object(requests.Session, 'request') as mock_request:
+            mock_request.side_effect = respond
+
+            results = list(client.merge_profile_list_members_concurrently(
+                'master', [{'CUSTOMER_ID_': str(customer_id)} for customer_id in range(600)],
+                'CUSTOMER_ID_', max_in_flight=2))
+
+        self.assertEqual([None, None, None], [result.error for result in results])
+        self.assertTrue(all(name.startswith('ThreadPoolExecutor') for name in threads))
+
+    def test_sync_and_bulk_load_run_on_the_account_executor(self):
+        client = self.pool['brand_a']
+        ResponsysClientTests.set_authenticated_api_state(client)
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'members.jsonl')
+        with open(path, 'w') as data_file:
+            data_file.write('{"CUSTOMER_ID_": "1"}\n')
+
+        with patch.object(requests.Session, 'request') as mock_request, \
+                patch.object(client.executor, 'submit', wraps=client.executor.submit) as submit:
+            mock_request.return_value = MockResponse200()
+
+            ChangeDetectingSync(client).sync_profile_list_members(
+                'master', [{'CUSTOMER_ID_': '1'}], 'CUSTOMER_ID_')
+            BulkLoader(client).load_profile_list_members(path, 'master', 'CUSTOMER_ID_')
+
+        self.assertEqual(2, submit.call_count)
+
+    def test_a_busy_account_does_not_delay_another_accounts_batches(self):
+        busy_client = self.pool['brand_a']
+        idle_client = self.pool['brand_b']
+        ResponsysClientTests.set_authenticated_api_state(busy_client)
+        ResponsysClientTests.set_authenticated_api_state(idle_client)
+        idle_latencies = []
+
+        def respond(method, url, **kwargs):
+            time.sleep(0.05)
+            return MockResponse200()
+
+        def merge_idle_batch():
+            # give the busy account's backlog time to be submitted first
+            time.sleep(0.02)
+            started = time.time()
+            list(idle_client.merge_profile_list_members_concurrently(
+                'master', [{'CUSTOMER_ID_': '1'}], 'CUSTOMER_ID_'))
+            idle_latencies.append(time.time() - started)
+
+        with patch.object(requests.Session, 'request') as mock_request:
+            mock_request.side_effect = respond
+            idle_thread = threading.Thread(target=merge_idle_batch)
+            idle_thread.start()
+
+            list(busy_client.merge_profile_list_members_concurrently(
+                'master', [{'CUSTOMER_ID_': str(customer_id)} for customer_id in range(4000)],
+                'CUSTOMER_ID_', max_in_flight=20))
+            idle_thread.join()
+
+        # one request's latency, rather than a share of the busy account's backlog
+        self.assertLess(idle_latencies[0], 0.15)
+
+
+class ConvertToTableStructureTests(TestCase):
+
+    def test_header_is_union_of_keys(self):
+        header_row, data_rows = convert_to_table_structure([{'b': 1, 'a': 2}, {'c': 3}])
+
+        self.assertEqual(['a', 'b', 'c'], header_row)
+        self.assertEqual([[2, 1, None], [None, None, 3]], data_rows)
+
+    def test_uniform_records(self):
+        header_row, data_rows = convert_to_table_structure([{'b': 1, 'a': 2}, {'a': 4, 'b': 3}])
+
+        self.assertEqual(['a', 'b'], header_row)
+        self.assertEqual([[2, 1], [4, 3]], data_rows)
+
+    def test_explicit_field_names_set_column_order(self):
+        header_row, data_rows = convert_to_table_structure([{'a': 1, 'b': 2}, {'a': 3}],
+                                                           field_names=['b', 'a'])
+
+        self.assertEqual(['b', 'a'], header_row)
+        self.assertEqual([[2, 1], [None, 3]], data_rows)
+
+    def test_single_column(self):
+        self.assertEqual((['a'], [[1], [2]]), convert_to_table_structure([{'a': 1}, {'a': 2}]))
+
+    def test_dict_of_columns(self):
+        header_row, data_rows = convert_to_table_structure({'b': [1, 2], 'a': [3, 4]},
+                                                           field_names=['a', 'b', 'c'])
+
+        self.assertEqual(['a', 'b', 'c'], header_row)
+        self.assertEqual([[3, 1, None], [4, 2, None]], data_rows)
+
+    def test_empty(self):
+        self.assertEqual(([], []), convert_to_table_structure([]))
+
+    def test_dict_of_columns_with_different_lengths_raises(self):
+        with self.assertRaises(ValueError):
+            convert_to_table_structure({'A': [1, 2, 3], 'B': [1]})
+
+class MemberRecordsTests(TestCase):
+
+    def setUp(self):
+        super(MemberRecordsTests, self).setUp()
+
+        self.records = MemberRecords(['RIID_', 'EMAIL_ADDRESS_'],
+                                     [['1', 'a@example.com'], ['2', 'b@example.com']])
+
+    def test_rows_support_attribute_index_and_mapping_access(self):
+        row = self.records[1]
+
+        self.assertEqual('2', row.RIID_)
+        self.assertEqual('2', row[0])
+        self.assertEqual('b@example.com', row['EMAIL_ADDRESS_'])
+        self.assertEqual(['1', 'a@example.com'], self.records[0][:])
+        self.assertEqual(['RIID_', 'EMAIL_ADDRESS_'], list(row))
+        self.assertIsNone(row.get('CUSTOMER_ID_'))
+        self.assertEqual({'RIID_': '2', 'EMAIL_ADDRESS_': 'b@example.com'}, dict(row))
+
+        with self.assertRaises(AttributeError):
+            row.CUSTOMER_ID_
+
+    def test_iteration_is_lazy_and_shares_field_indexes(self):
+        rows = iter(self.records)
+
+        first_row = next(rows)
+        second_row = next(rows)
+
+        self.assertEqual(2, len(self.records))
+        self.assertIs(first_row._field_indexes, second_row._field_indexes)
+        self.assertEqual(self.records.to_dicts(), [dict(first_row), dict(second_row)])
+
+class MergeBufferTests(TestCase):
+
+    def setUp(self):
+        super(MergeBufferTests, self).setUp()
+
+        self.batches = []
+
+    def send_batch(self, records):
+        self.batches.append(records)
+
+    def test_records_are_deduplicated_by_key_with_last_write_winning(self):
+        with MergeBuffer(self.send_batch, 'CUSTOMER_ID_', max_delay=60) as merge_buffer:
+            merge_buffer.add({'CUSTOMER_ID_': '1', 'CITY_': 'Denver'})
+            merge_buffer.add({'CUSTOMER_ID_': '2', 'CITY_': 'Boston'})
+            merge_buffer.add({'CUSTOMER_ID_': '1', 'CITY_': 'Austin'})
+
+            self.assertEqual(2, len(merge_buffer))
+
+        self.assertEqual([[{'CUSTOMER_ID_': '1', 'CITY_': 'Austin'},
+                           {'CUSTOMER_ID_': '2', 'CITY_': 'Boston'}]], self.batches)
+
+    def test_merge_fields_combines_records_for_the_same_key(self):
+        with MergeBuffer(self.send_batch, 'CUSTOMER_ID_', max_delay=60,
+                         merge_fields=True) as merge_buffer:
+            merge_buffer.add({'CUSTOMER_ID_': '1', 'CITY_': 'Denver'})
+            merge_buffer.add({'CUSTOMER_ID_': '1', 'EMAIL_PERMISSION_STATUS_': 'O'})
+
+        self.assertEqual([[{'CUSTOMER_ID_': '1', 'CITY_': 'Denver',
+                            'EMAIL_PERMISSION_STATUS_': 'O'}]], self.batches)
+
+    def test_add_waits_for_room_once_max_pending_batches_are_queued(self):
+        sending = threading.Event()
+        release = threading.Event()
+
+        def send_slowly(records):
+            sending.set()
+            release.wait(5)
+            self.batches.append(records)
+
+        merge_buffer = MergeBuffer(send_slowly, 'CUSTOMER_ID_', max_records=1, max_delay=60,
+                                   max_pending_batches=1, add_timeout=0.1)
+        merge_buffer.add({'CUSTOMER_ID_': '1'})
+        sending.wait(5)
+        merge_buffer.add({'CUSTOMER_ID_': '2'})
+
+        with self.assertRaises(ResponsysClientError):
+            merge_buffer.add({'CUSTOMER_ID_': '3'})
+
+        adding = threading.Thread(target=merge_buffer.add, args=({'CUSTOMER_ID_': '4'},))
+        merge_buffer.add_timeout = None
+        adding.start()
+        adding.join(0.1)
+        self.assertTrue(adding.is_alive())
+
+        release.set()
+        adding.join(5)
+        merge_buffer.close()
+
+        self.assertEqual([[{'CUSTOMER_ID_': '1'}], [{'CUSTOMER_ID_': '2'}],
+                          [{'CUSTOMER_ID_': '4'}]], self.batches)
+
+    def test_full_batches_are_sent_and_records_grouped_by_fields(self):
+        merge_buffer = MergeBuffer(self.send_batch, 'CUSTOMER_ID_', max_records=3, max_delay=60)
+
+        merge_buffer.add_many([{'CUSTOMER_ID_': '1', 'CITY_': 'Denver'},
+                               {'CUSTOMER_ID_': '2'},
+                               {'CUSTOMER_ID_': '3', 'CITY_': 'Boston'},
+                               {'CUSTOMER_ID_': '4'}])
+        merge_buffer.flush()
+
+        self.assertEqual([[{'CUSTOMER_ID_': '1', 'CITY_': 'Denver'},
+                           {'CUSTOMER_ID_': '3', 'CITY_': 'Boston'}],
+                          [{'CUSTOMER_ID_': '2'}],
+                          [{'CUSTOMER_ID_': '4'}]], self.batches)
+
+        merge_buffer.close()
+
+    def test_pending_records_are_sent_after_max_delay(self):
+        merge_buffer = MergeBuffer(self.send_batch, 'CUSTOMER_ID_', max_delay=0.05)
+        merge_buffer.add({'CUSTOMER_ID_': '1'})
+
+        for _ in range(100):
+            if self.batches:
+                break
+            time.sleep(0.01)
+
+        self.assertEqual([[{'CUSTOMER_ID_': '1'}]], self.batches)
+        merge_buffer.close()
+
+    def test_failed_batches_are_reported_to_on_error(self):
+        failures = []
+
+        def send_batch(records):
+            raise ResponsysClientError('merge failed')
+
+        with MergeBuffer(send_batch, ('FOLDER_ID', 'ITEM_ID'), max_delay=60,
+                         on_error=failures.append) as merge_buffer:
+            merge_buffer.add({'FOLDER_ID': 1, 'ITEM_ID': 2})
+
+        self.assertEqual(1, len(failures))
+        self.assertEqual([{'FOLDER_ID': 1, 'ITEM_ID': 2}], failures[0].records)
+        self.assertIsInstance(failures[0].error, ResponsysClientError)
+
+        with self.assertRaises(ResponsysClientError):
+            merge_buffer.add({'FOLDER_ID': 1, 'ITEM_ID': 3})
+
+    def test_client_buffer_merges_in_one_request(self):
+        client = ResponsysClient(username='test_user', password='test_pw',
+                                 login_url='https://testloginurl.net')
+        ResponsysClientTests.set_authenticated_api_state(client)
+
+        with patch.object(requests.Session, 'request') as mock_request:
+            mock_request.return_value = MockResponse200()
+
+            with client.buffer_profile_list_members('master', 'CUSTOMER_ID_') as merge_buffer:
+                for customer_id in range(50):
+                    merge_buffer.add({'CUSTOMER_ID_': str(customer_id % 10)})
+
+            self.assertEqual(1, mock_request.call_count)
+            records = mock_request.call_args[1]['json']['recordData']['records']
+            self.assertEqual(10, len(records))
+
+
+class ChangeDetectingSyncTests(TestCase):
+
+    def setUp(self):
+        super(ChangeDetectingSyncTests, self).setUp()
+
+        self.client = ResponsysClient(username='test_user', password='test_pw',
+                                      login_url='https://testloginurl.net')
+        ResponsysClientTests.set_authenticated_api_state(self.client)
+        self.sync = ChangeDetectingSync(self.client)
+
+    def test_unchanged_records_are_skipped_on_the_next_run(self):
+        profile_dicts = [{'CUSTOMER_ID_': str(customer_id), 'CITY_': 'Denver'}
+                         for customer_id in range(300)]
+
+        with patch.object(requests.Session, 'request') as mock_request:
+            mock_request.return_value = MockResponse200()
+
+            first = self.sync.sync_profile_list_members('master', profile_dicts, 'CUSTOMER_ID_')
+            self.assertEqual(2, mock_request.call_count)
+
+            profile_dicts[5] = {'CUSTOMER_ID_': '5', 'CITY_': 'Boston'}
+            second = self.sync.sync_profile_list_members('master', profile_dicts, 'CUSTOMER_ID_')
+            self.assertEqual(3, mock_request.call_count)
+
+        self.assertEqual((300, 0, []), first)
+        self.assertEqual((1, 299, []), second)
+        records = mock_request.call_args[1]['json']['recordData']['records']
+        self.assertEqual([['Boston', '5']], records)
+
+    def test_failed_batches_are_not_indexed(self):
+        data_dicts = [{'FOLDER_ID': 1, 'ITEM_ID': item_id} for item_id in range(3)]
+
+        with patch.object(requests.Session, 'request') as mock_request:
+            mock_request.return_value = MockResponse400()
+
+            failed_run = self.sync.sync_supplemental_table_members('folder', 'table', data_dicts,
+                                                                   ('FOLDER_ID', 'ITEM_ID'))
+
+            mock_request.return_value = MockResponse200()
+
+            retried_run = self.sync.sync_supplemental_table_members('folder', 'table', data_dicts,
+                                                                    ('FOLDER_ID', 'ITEM_ID'))
+
+        self.assertEqual(0, failed_run.sent)
+        self.assertEqual(data_dicts, failed_run.failed[0].records)
+        self.assertEqual((3, 0, []), retried_run)
+
+    def test_index_persists_hashes_per_table(self):
+        index = ContentHashIndex()
+        index.set_hashes('lists/master', {'1': 'abc', '2': 'def'})
+
+        self.assertEqual({'1': 'abc'}, index.get_hashes('lists/master', ['1', '3']))
+        self.assertEqual({}, index.get_hashes('lists/other', ['1']))
+
+        index.clear('lists/master')
+        self.assertEqual({}, index.get_hashes('lists/master', ['1', '2']))
+        index.close()
+
+    def test_records_rejected_by_responsys_are_not_indexed(self):
+        profile_dicts = [{'CUSTOMER_ID_': '1'}, {'CUSTOMER_ID_': '2'}]
+        response = ResponsysClientTests.get_mock_members_response_200(
+            ['RIID_'], [['101'], ['MERGEFAILED: Record 1 = INVALID_EMAIL_ADDRESS: bad']])
+
+        with patch.object(requests.Session, 'request') as mock_request:
+            mock_request.return_value = response
+            first = self.sync.sync_profile_list_members('master', profile_dicts, 'CUSTOMER_ID_')
+
+            mock_request.return_value = MockResponse200()
+            second = self.sync.sync_profile_list_members('master', profile_dicts, 'CUSTOMER_ID_')
+
+        self.assertEqual((1, 0), first[:2])
+        self.assertEqual([{'CUSTOMER_ID_': '2'}], first.failed[0].records)
+        self.assertEqual('INVALID_EMAIL_ADDRESS', first.failed[0].response[0].error_code)
+        self.assertEqual((1, 1, []), second)
+
+
+
+class MergeSessionTests(TestCase):
+
+    def setUp(self):
+        super(MergeSessionTests, self).setUp()
+
+        self.client = ResponsysClient(username='test_user', password='test_pw',
+                                      login_url='https://testloginurl.net')
+        ResponsysClientTests.set_authenticated_api_state(self.client)
+
+    def test_profile_merges_are_sent_first_in_full_batches_per_table(self):
+        paths = []
+
+        def respond(method, url, json=None, **kwargs):
+            paths.append((url.split('/v1.1/')[1], len(json['recordData']['records'])))
+            return MockResponse200()
+
+        with patch.object(requests.Session, 'request') as mock_request:
+            mock_request.side_effect = respond
+
+            with MergeSession(self.client, max_in_flight=2) as session:
+                for customer_id in range(250):
+                    record = {'CUSTOMER_ID_': str(customer_id)}
+                    session.merge_profile_list_extension_member('master', 'master_pet', record,
+                                                                'CUSTOMER_ID_')
+                    session.merge_profile_list_member('master', record, 'CUSTOMER_ID_')
+                session.merge_supplemental_table_member('folder', 'prices', {'SKU': 'a'})
+
+        self.assertEqual([('lists/master/members', 200), ('lists/master/members', 50)], paths[:2])
+        self.assertEqual(sorted([('lists/master/listExtensions/master_pet/members', 200),
+                                 ('lists/master/listExtensions/master_pet/members', 50),
+                                 ('folders/folder/suppData/prices/members', 1)]),
+                         sorted(paths[2:]))
+        self.assertEqual(501, len(session.results))
+        self.assertEqual(LIST_EXTENSION, session.results[0].operation.kind)
+        self.assertEqual({'SKU': 'a'}, session.results[-1].operation.record)
+        self.assertTrue(all(result.result.succeeded for result in session.results))
+
+    def test_extension_rows_of_failed_profiles_are_not_sent(self):
+        profile_response = ResponsysClientTests.get_mock_members_response_200(
+            ['RIID_'], [['11'], ['MERGEFAILED: RECORD_REJECTED: bad email']])
+        extension_records = []
+
+        def respond(method, url, json=None, **kwargs):
+            if 'listExtensions' in url:
+                extension_records.extend(json['recordData']['records'])
+                return MockResponse200()
+            return profile_response
+
+        session = MergeSession(self.client)
+        for customer_id in ('1', '2'):
+            session.merge_profile_list_member('master', {'CUSTOMER_ID_': customer_id},
+                                              'CUSTOMER_ID_')
+            session.merge_profile_list_extension_member('master', 'master_pet',
+                                                        {'CUSTOMER_ID_': customer_id},
+                                                        'CUSTOMER_ID_')
+
+        with patch.object(requests.Session, 'request') as mock_request:
+            mock_request.side_effect = respond
+
+            results = session.commit()
+
+        self.assertEqual([['1']], extension_records)
+        self.assertEqual('11', results[0].result.riid)
+        self.assertTrue(results[1].result.succeeded)
+        self.assertEqual('RECORD_REJECTED', results[2].result.error_code)
+        self.assertIsNone(results[3].result)
+        self.assertIsInstance(results[3].error, ResponsysClientError)
+        self.assertEqual(0, len(session))
+
+    def test_extension_rows_matching_on_another_column_follow_their_profile(self):
+        profile_response = ResponsysClientTests.get_mock_members_response_200(
+            ['RIID_'], [['11'], ['MERGEFAILED: RECORD_REJECTED: bad email']])
+        extension_records = []
+
+        def respond(method, url, json=None, **kwargs):
+            if 'listExtensions' in url:
+                extension_records.extend(json['recordData']['records'])
+                return MockResponse200()
+            return profile_response
+
+        session = MergeSession(self.client)
+        for customer_id in ('1', '2'):
+            session.merge_profile_list_member(
+                'master', {'EMAIL_ADDRESS_': customer_id + '@example.com',
+                           'CUSTOMER_ID_': customer_id}, 'EMAIL_ADDRESS_')
+            session.merge_profile_list_extension_member('master', 'master_pet',
+                                                        {'CUSTOMER_ID_': customer_id},
+                                                        'CUSTOMER_ID_')
+
+        with patch.object(requests.Session, 'request') as mock_request:
+            mock_request.side_effect = respond
+
+            results = session.commit()
+
+        self.assertEqual([['1']], extension_records)
+        self.assertIsInstance(results[3].error, ResponsysClientError)
+
+    def test_failed_batches_are_reported_on_each_operation(self):
+        with patch.object(requests.Session, 'request') as mock_request:
+            mock_request.return_value = MockResponse400()
+
+            with MergeSession(self.client) as session:
+                session.merge_supplemental_table_member('folder', 'prices', {'SKU': 'a'})
+                session.merge_supplemental_table_member('folder', 'prices', {'SKU': 'b'})
+
+        self.assertEqual(1, mock_request.call_count)
+        self.assertEqual([None, None], [result.result for result in session.results])
+        self.assertIsInstance(session.results[1].error, ResponsysClientError)
+
+    def test_sessions_left_by_an_exception_send_nothing(self):
+        with patch.object(requests.Session, 'request') as mock_request:
+            with self.assertRaises(ValueError):
+                with MergeSession(self.client) as session:
+                    session.merge_profile_list_member('master', {'CUSTOMER_ID_': '1'},
+                                                      'CUSTOMER_ID_')
+                    raise ValueError()
+
+            self.assertEqual(0, mock_request.call_count)
+
+        self.assertEqual(0, len(session))
+        self.assertIsNone(session.results)
+
+
+class BulkLoaderTests(TestCase):
+
+    def setUp(self):
+        super(BulkLoaderTests, self).setUp()
+
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+        self.client = ResponsysClient(username='test_user', password='test_pw',
+                                      login_url='https://testloginurl.net')
+        ResponsysClientTests.set_authenticated_api_state(self.client)
+
+    def write_file(self, name, content):
+        path = os.path.join(self.directory, name)
+        with open(path, 'wb') as data_file:
+            data_file.write(content.encode('utf-8'))
+
+        return path
+
+    def test_read_records_streams_csv_with_resumable_offsets(self):
+        path = self.write_file('members.csv', u'\ufeffCUSTOMER_ID_,NOTE\n1,"two\nlines"\n2,plain\n')
+
+        records = list(read_records(path))
+
+        self.assertEqual([{'CUSTOMER_ID_': '1', 'NOTE': 'two\nlines'},
+                          {'CUSTOMER_ID_': '2', 'NOTE': 'plain'}],
+                         [record for record, _ in records])
+        self.assertEqual([{'CUSTOMER_ID_': '2', 'NOTE': 'plain'}],
+                         [record for record, _ in read_records(path,
+                                                               start_offset=records[0][1])])
+
+    def test_read_records_strips_byte_order_mark_from_jsonl(self):
+        path = self.write_file('members.jsonl', u'\ufeff{"id": "1"}\n{"id": "2"}\n')
+
+        records = list(read_records(path))
+
+        self.assertEqual([{'id': '1'}, {'id': '2'}], [record for record, _ in records])
+        self.assertEqual([{'id': '2'}], [record for record, _ in read_records(
+            path, start_offset=records[0][1])])
+
+    def test_load_maps_fields_and_batches_jsonl(self):
+        lines = ['{{"id": "{}", "city": "Denver", "ignored": 1}}'.format(customer_id)
+                 for customer_id in range(250)]
+        path = self.write_file('members.jsonl', '\n'.join(lines) + '\n')
+        loader = BulkLoader(self.client, field_map={'id': 'CUSTOMER_ID_', 'city': 'CITY_'})
+
+        with patch.object(requests.Session, 'request') as mock_request:
+            mock_request.return_value = MockResponse200()
+
+            result = loader.load_profile_list_members(path, 'master', 'CUSTOMER_ID_')
+
+            self.assertEqual(2, mock_request.call_count)
+            record_data = mock_request.call_args[1]['json']['recordData']
+
+        self.assertEqual((250, [], 0), result)
+        self.assertEqual(['CITY_', 'CUSTOMER_ID_'], record_data['fieldNames'])
+        self.assertEqual(50, len(record_data['records']))
+
+    def test_load_resends_only_the_batches_that_failed(self):
+        lines = ['{{"CUSTOMER_ID_": "{}"}}'.format(customer_id) for customer_id in range(500)]
+        path = self.write_file('members.jsonl', '\n'.join(lines) + '\n')
+        loader = BulkLoader(self.client, max_in_flight=1,
+                            checkpoint_path=os.path.join(self.directory, 'journal'))
+
+        def fail_second_batch(method, url, json=None, **kwargs):
+            if json['recordData']['records'][0] == ['200']:
+                return MockResponse400()
+            return MockResponse200()
+
+        with patch.object(requests.Session, 'request') as mock_request:
+            mock_request.side_effect = fail_second_batch
+            first_run = loader.load_profile_list_members(path, 'master', 'CUSTOMER_ID_')
+
+            mock_request.side_effect = None
+            mock_request.return_value = MockResponse200()
+            second_run = loader.load_profile_list_members(path, 'master', 'CUSTOMER_ID_')
+
+            self.assertEqual(4, mock_request.call_count)
+            self.assertEqual(['200'], mock_request.call_args[1]['json']['recordData']['records'][0])
+
+        self.assertEqual(300, first_run.loaded)
+        self.assertEqual(200, first_run.failed[0].record_count)
+        self.assertEqual(200, second_run.loaded)
+        self.assertEqual(first_run.failed[0].start_offset, second_run.resumed_from)
+        self.assertEqual(os.path.getsize(path), loader.journal.resume_offset())
+
+    def test_load_counts_and_resends_records_responsys_rejects(self):
+        path = self.write_file('members.jsonl', '{"CUSTOMER_ID_": "1"}\n{"CUSTOMER_ID_": "2"}\n'
+                                                '{"CUSTOMER_ID_": "3"}\n')
+        loader = BulkLoader(self.client, checkpoint_path=os.path.join(self.directory, 'journal'))
+        first_response = ResponsysClientTests.get_mock_members_response_200(
+            ['RIID_'], [['101'], ['MERGEFAILED: Record 1 = INVALID_EMAIL_ADDRESS: bad'], ['103']])
+
+        with patch.object(requests.Session, 'request') as mock_request:
+            mock_request.return_value = first_response
+            first_run = loader.load_profile_list_members(path, 'master', 'CUSTOMER_ID_')
+
+            mock_request.return_value = MockResponse200()
+            second_run = loader.load_profile_list_members(path, 'master', 'CUSTOMER_ID_')
+
+            self.assertEqual([['2']], mock_request.call_args[1]['json']['recordData']['records'])
+
+        self.assertEqual(2, first_run.loaded)
+        self.assertEqual([1], [failed_batch.record_count for failed_batch in first_run.failed])
+        self.assertIn('INVALID_EMAIL_ADDRESS', str(first_run.failed[0].error))
+        self.assertEqual((1, []), (second_run.loaded, second_run.failed))
+        self.assertEqual(os.path.getsize(path), loader.journal.resume_offset())
+
+    def test_cli_loads_a_csv_file_into_a_profile_list(self):
+        clock = FakeClock()
+        clock.now = time.time()
+        server = FakeResponsysServer(clock=clock).start()
+        self.addCleanup(server.stop)
+        path = self.write_file('members.csv', 'id,email\n1,a@example.com\n2,b@example.com\n')
+
+        exit_code = main(['--username', server.username, '--password', server.password,
+                          '--login-url', server.url, '--map', 'id=CUSTOMER_ID_',
+                          '--map', 'email=EMAIL_ADDRESS_', 'profile-list', 'master', path])
+
+        self.assertEqual(0, exit_code)
+        self.assertEqual(2, len(server.tables[('list', 'master')].members))
+        self.assertTrue(os.path.exists(path + '.checkpoint'))
+
+
+class TokenStoreTests(TestCase):
+
+    def setUp(self):
+        super(TokenStoreTests, self).setUp()
+
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+        timestamp_js = time.time() * 1000
+        self.login_response = ResponsysClientTests.get_mock_auth_success_response_200(
+            'shared_token', 'https://api2-018.responsys.net', timestamp_js)
+
+    def build_client(self, token_store):
+        client = ResponsysClient(username='test_user', password='test_pw',
+                                 login_url='https://testloginurl.net', token_store=token_store)
+        self.addCleanup(client.close)
+
+        return client
+
+    def test_clients_sharing_a_store_log_in_once(self):
+        token_store = MemoryTokenStore()
+        first_client = self.build_client(token_store)
+        second_client = self.build_client(token_store)
+
+        with patch.object(requests.Session, 'request') as mock_request:
+            mock_request.side_effect = [self.login_response, MockResponse200(),
+                                        MockResponse200()]
+
+            first_client.send_request('GET', '/rest/api/v1.1/lists')
+            second_client.send_request('GET', '/rest/api/v1.1/lists')
+
+            self.assertEqual(3, mock_request.call_count)
+
+        self.assertEqual('shared_token', second_client.auth_token)
+
+    def test_file_store_shares_a_token_between_processes(self):
+        path = os.path.join(self.directory, 'token.json')
+        first_client = self.build_client(FileTokenStore(path))
+
+        with patch.object(requests.Session, 'request') as mock_request:
+            mock_request.return_value = self.login_response
+            first_client._login()
+
+        # a second store on the same path stands in for another process
+        access_items = FileTokenStore(path).get()
+
+        self.assertEqual(('shared_token', 'https://api2-018.responsys.net'), access_items[:2])
+        self.assertEqual(first_client.refresh_timestamp.replace(microsecond=0),
+                         access_items.refresh_timestamp.replace(microsecond=0))
+
+    def test_inter_process_lock_is_reentrant(self):
+        lock = InterProcessLock(os.path.join(self.directory, 'lock'))
+
+        with lock:
+            with lock:
+                pass
+
+        self.assertIsNone(lock._lock_file)
+
+    def test_proactive_refresh_refreshes_tokens_close_to_expiring(self):
+        client = self.build_client(MemoryTokenStore())
+        ResponsysClientTests.set_authenticated_api_state(client)
+        client.refresh_timestamp -= timedelta(minutes=57)
+
+        with patch.object(requests.Session, 'request') as mock_request:
+            mock_request.return_value = self.login_response
+            client._refresh_access_items_proactively()
+
+            self.assertEqual(1, mock_request.call_count)
+            self.assertEqual({'auth_type': 'token'}, mock_request.call_args[1]['params'])
+
+        self.assertEqual('shared_token', client.auth_token)
+
+    def test_requests_do_not_wait_on_a_slow_proactive_refresh(self):
+        client = self.build_client(MemoryTokenStore())
+        ResponsysClientTests.set_authenticated_api_state(client)
+        client.refresh_timestamp -= timedelta(minutes=57)
+        stale_token = client.auth_token
+        refresh_started = threading.Event()
+        release_refresh = threading.Event()
+
+        def respond(method, url, headers=None, **kwargs):
+            if url.endswith(client.RESPONSYS_AUTH_PATH):
+                refresh_started.set()
+                release_refresh.wait(5)
+                return self.login_response
+
+            return MockResponse200()
+
+        with patch.object(requests.Session, 'request') as mock_request:
+            mock_request.side_effect = respond
+            refresh = threading.Thread(target=client._refresh_access_items_proactively)
+            refresh.start()
+            refresh_started.wait(5)
+
+            started_at = time.time()
+            client.send_request('GET', '/rest/api/v1.1/lists')
+            latency = time.time() - started_at
+
+            self.assertEqual(stale_token, mock_request.call_args[1]['headers']['Authorization'])
+            release_refresh.set()
+            refresh.join()
+
+        self.assertLess(latency, 0.5)
+        self.assertEqual('shared_token', client.auth_token)
+
+    def test_background_refresh_logs_in_before_the_first_request(self):
+        client = self.build_client(MemoryTokenStore())
+
+        with patch.object(requests.Session, 'request') as mock_request:
+            mock_request.return_value = self.login_response
+
+            client.start_background_token_refresh(check_interval=60)
+            for _ in range(100):
+                if client.auth_token:
+                    break
+                time.sleep(0.01)
+            client.stop_background_token_refresh()
+
+        self.assertEqual('shared_token', client.auth_token)
+
+
+class InstrumentationTests(TestCase):
+
+    def setUp(self):
+        super(InstrumentationTests, self).setUp()
+
+        self.clock = FakeClock()
+        self.metrics = MetricsAggregator(clock=self.clock)
+        self.client = ResponsysClient(username='test_user', password='test_pw',
+                                      login_url='https://testloginurl.net',
+                                      retry_policy=RetryPolicy(sleep=self.clock.sleep,
+                                                               random_fraction=lambda: 1.0),
+                                      instrumentation=self.metrics)
+        ResponsysClientTests.set_authenticated_api_state(self.client)
+
+    def test_build_path_template_replaces_identifiers(self):
+        self.assertEqual('/rest/api/v1.1/lists/{list}/listExtensions/{extension}/members/{riid}',
+                         build_path_template('https://api2-018.responsys.net/rest/api/v1.1/lists/'
+                                             'master/listExtensions/ext_pet/members/1234'))
+        self.assertEqual('/rest/api/v1.1/lists/{list}/members?action=get',
+                         build_path_template('/rest/api/v1.1/lists/master/members?action=get'))
+        self.assertEqual('/rest/api/v1.1/folders/{folder}/suppData/{table}/members',
+                         build_path_template('/rest/api/v1.1/folders/f/suppData/t/members?x=1'))
+
+    def test_histogram_percentiles_use_bucket_bounds(self):
+        histogram = Histogram(bounds=(1, 2, 4))
+        for value in (0.5, 1.5, 1.5, 3, 10):
+            histogram.observe(value)
+
+        self.assertEqual(2, histogram.percentile(0.5))
+        self.assertEqual(10, histogram.percentile(0.99))
+        self.assertEqual(0.5, histogram.min)
+        self.assertEqual(16.5, histogram.sum)
+
+    def test_merge_records_retries_wait_and_records(self):
+        def respond(method, url, **kwargs):
+            self.clock.sleep(0.2)
+
+            if mock_request.call_count == 1:
+                return MockResponseServiceUnavailable503()
+            return MockResponse200()
+
+        with patch.object(requests.Session, 'request') as mock_request:
+            mock_request.side_effect = respond
+
+            self.client.merge_profile_list_members('master', [{'CUSTOMER_ID_': '1'},
+                                                              {'CUSTOMER_ID_': '2'}],
+                                                   'CUSTOMER_ID_')
+
+        stats = self.metrics.snapshot()['requests'][
+            'POST /rest/api/v1.1/lists/{list}/members 200']
+        self.assertEqual(1, stats['latency']['count'])
+        self.assertAlmostEqual(0.9, stats['latency']['sum'])
+        self.assertEqual(1, stats['retries'])
+        self.assertEqual(2, stats['records'])
+
+    def test_rejected_token_records_a_relogin(self):
+        login_response = ResponsysClientTests.get_mock_auth_success_response_200(
+            'new_token', 'https://api2-018.responsys.net', 1500000000000)
+
+        with patch.object(requests.Session, 'request') as mock_request:
+            mock_request.side_effect = [MockResponse401(), login_response, MockResponse200()]
+
+            self.client.send_request('GET', '/rest/api/v1.1/lists')
+
+        snapshot = self.metrics.snapshot()
+        self.assertEqual(['relogin'], list(snapshot['auth']))
+        self.assertEqual(1, snapshot['requests']['GET /rest/api/v1.1/lists 401']
+                         ['latency']['count'])
+
+    def test_errors_are_recorded_without_a_status(self):
+        with patch.object(requests.Session, 'request') as mock_request:
+            mock_request.side_effect = requests.exceptions.ConnectionError()
+
+            with self.assertRaises(requests.exceptions.ConnectionError):
+                self.client.send_request('GET', '/rest/api/v1.1/lists')
+
+        snapshot = self.metrics.snapshot()
+        stats = snapshot['requests']['GET /rest/api/v1.1/lists error']
+        self.assertEqual(1, stats['errors'])
+        self.assertEqual(2, stats['retries'])
+        self.assertEqual(snapshot, json.loads(json.dumps(snapshot)))
+
+
+class PayloadEncoderTests(TestCase):
+
+    def test_codecs_encode_the_same_payload_as_the_builders(self):
+        records = [['1', u'caf\xe9'], ['2', None]]
+        payloads = [
+            BaseResponsysClient._build_profile_list_merge_json('CUSTOMER_ID_', ['ID', 'CITY'],
+                                                               records),
+            BaseResponsysClient._build_extension_table_merge_json('CUSTOMER_ID_', ['ID', 'CITY'],
+                                                                  records),
+            BaseResponsysClient._build_supplemental_table_merge_json(['ID', 'CITY'], records),
+        ]
+
+        for codec in (JSONCodec(), get_default_codec()):
+            encoder = PayloadEncoder(codec=codec)
+
+            for payload in payloads:
+                body = encoder.encode_merge(payload)
+
+                self.assertEqual(payload, json.loads(body.data.decode('utf-8')))
+                self.assertEqual(2, body.record_count)
+                self.assertNotIn('Content-Encoding', body.headers)
+
+    def test_bodies_over_the_threshold_are_gzipped(self):
+        encoder = PayloadEncoder(codec=JSONCodec(), compress_threshold=100)
+        records = [[str(customer_id)] for customer_id in range(50)]
+
+        small = encoder.encode(b'{}')
+        large = encoder.encode_merge(
+            BaseResponsysClient._build_supplemental_table_merge_json(['ID'], records))
+
+        self.assertEqual(b'{}', small.data)
+        self.assertEqual('gzip', large.headers['Content-Encoding'])
+        payload = json.loads(gzip.GzipFile(fileobj=io.BytesIO(large.data)).read().decode('utf-8'))
+        self.assertEqual(records, payload['recordData']['records'])
+
+    def test_client_sends_encoded_merges_and_decodes_the_response(self):
+        events = []
+        instrumentation = Instrumentation()
+        instrumentation.request_finished = events.append
+        api = ResponsysClient(username='test_user', password='test_pw',
+                              login_url='https://testloginurl.net',
+                              instrumentation=instrumentation,
+                              payload_encoder=PayloadEncoder(codec=JSONCodec()))
+        ResponsysClientTests.set_authenticated_api_state(api)
+        mock_response = MockResponse200()
+        mock_response.content = b'{"recordData": {"fieldNames": ["RIID_"], "records": [["7"]]}}'
+
+        with patch.object(requests.Session, 'request') as mock_request:
+            mock_request.return_value = mock_response
+
+            response = api.merge_profile_list_members('test_list', [{'CUSTOMER_ID_': '1'}],
+                                                      'CUSTOMER_ID_')
+
+            kwargs = mock_request.call_args[1]
+
+        self.assertIsNone(kwargs['json'])
+        self.assertEqual('application/json', kwargs['headers']['Content-Type'])
+        self.assertEqual(api.auth_token, kwargs['headers']['Authorization'])
+        payload = json.loads(kwargs['data'].decode('utf-8'))
+        self.assertEqual('CUSTOMER_ID_', payload['mergeRule']['matchColumnName1'])
+        self.assertEqual([['7']], response['recordData']['records'])
+        self.assertEqual(1, events[0].record_count)
+
+    def test_orjson_codec_requires_orjson(self):
+        with patch('responsys_client.serialization.orjson', None):
+            self.assertIsInstance(get_default_codec(), JSONCodec)
+            self.assertRaises(ResponsysClientError, OrjsonCodec)
+
+
+class FakeResponsysServerTests(TestCase):
+
+    def setUp(self):
+        super(FakeResponsysServerTests, self).setUp()
+
+        # tokens are issued at the fake time, so it must be close to now to avoid refreshes
+        self.clock = FakeClock()
+        self.clock.now = time.time()
+        self.server = FakeResponsysServer(clock=self.clock).start()
+        self.addCleanup(self.server.stop)
+
+        self.client = ResponsysClient(self.server.username, self.server.password, self.server.url,
+                                      retry_policy=RetryPolicy(sleep=lambda seconds: None))
+        self.addCleanup(self.client.close)
+
+    def test_merge_lookup_and_delete_round_trip(self):
+        profiles = [{'CUSTOMER_ID_': str(customer_id)} for customer_id in range(250)]
+
+        results = list(self.client.merge_profile_list_members_in_batches('test_list', profiles,
+                                                                         'CUSTOMER_ID_'))
+        members = self.client.get_profile_list_members('test_list', ['3', '249', 'missing'])
+        self.client.delete_profile_list_member('test_list', '3')
+
+        self.assertEqual(2, len(results))
+        self.assertEqual(['249', '3'], sorted(members))
+        self.assertEqual({}, self.client.get_profile_list_members('test_list', ['3']))
+        self.assertEqual(1, self.server.connection_count)
+
+    def test_encoded_and_gzipped_merges_round_trip(self):
+        self.client.payload_encoder = PayloadEncoder(compress_threshold=0)
+        profiles = [{'CUSTOMER_ID_': str(customer_id)} for customer_id in range(250)]
+
+        results = list(self.client.merge_profile_list_members_in_batches('test_list', profiles,
+                                                                         'CUSTOMER_ID_'))
+        members = self.client.get_profile_list_members('test_list', ['3', '249'])
+
+        self.assertEqual([200, 50], [len(result['recordData']['records']) for result in results])
+        self.assertEqual(['249', '3'], sorted(members))
+
+    def test_expired_token_triggers_login(self):
+        self.server.token_ttl = 60
+
+        self.client.get_profile_lists()
+        expired_auth_token = self.client.auth_token
+        self.clock.sleep(61)
+        self.client.get_profile_lists()
+
+        self.assertNotEqual(expired_auth_token, self.client.auth_token)
+        self.assertEqual(5, self.server.request_count)
+
+    def test_requests_over_the_rate_limit_are_throttled(self):
+        self.server.rate_limit_per_second = 1
+        self.server.retry_after = 7
+        self.client.retry_policy = RetryPolicy(max_attempts=1)
+
+        self.client.get_profile_lists()
+        response = self.client.send_request('GET', '/rest/api/v1.1/lists')
+
+        self.assertEqual(429, response.status_code)
+        self.assertEqual('7', response.headers['Retry-After'])
+        self.assertEqual(1, self.server.throttled_count)
+
+
+class MockAsyncTransport(object):
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.calls = []
+
+    def request(self, method, url, **kwargs):
+        import asyncio
+
+        self.calls.append((method, url, kwargs))
+
+        future = asyncio.Future()
+        future.set_result(self.responses.pop(0))
+        return future
+
+
+@skipIf(AsyncResponsysClient is None, 'asyncio client requires Python 3.5+')
+class AsyncResponsysClientTests(TestCase):
+
+    def run_coroutine(self, coroutine):
+        import asyncio
+
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(coroutine)
+        finally:
+            loop.close()
+
+    def get_client(self, responses):
+        return AsyncResponsysClient(username='test_user', password='test_pw',
+                                    login_url='https://testloginurl.net',
+                                    transport=MockAsyncTransport(responses))
+
+    def test_get_profile_lists_logs_in_first(self):
+        auth_response = ResponsysClientTests.get_mock_auth_success_response_200(
+            u'E1sB4M4PSXHCDuXwnzJeGoiHo2RSs', u'https://api2-018.responsys.net', 1476401899000)
+        api = self.get_client([auth_response, MockResponse200()])
+
+        result = self.run_coroutine(api.get_profile_lists())
+
+        self.assertEqual({}, result)
+        self.assertEqual(u'E1sB4M4PSXHCDuXwnzJeGoiHo2RSs', api.auth_token)
+        self.assertEqual(['https://testloginurl.net/rest/api/v1.1/auth/token',
+                          'https://api2-018.responsys.net/rest/api/v1.1/lists'],
+                         [call[1] for call in api.transport.calls])
+
+    def test_send_request_retries_after_invalid_token(self):
+        auth_response = ResponsysClientTests.get_mock_auth_success_response_200(
+            u'E1sB4M4PSXHCDuXwnzJeGoiHo2RSs', u'https://api2-018.responsys.net', 1476401899000)
+        api = self.get_client([MockResponseInvalidToken500(), auth_response, MockResponse200()])
+        ResponsysClientTests.set_authenticated_api_state(api)
+
+        response = self.run_coroutine(api.send_request('GET', '/rest/api/v1.1/lists'))
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(3, len(api.transport.calls))
+        self.assertEqual({'Authorization': u'E1sB4M4PSXHCDuXwnzJeGoiHo2RSs'},
+                         api.transport.calls[2][2]['headers'])
+
+    def test_merge_profile_list_members_failure_raises(self):
+        api = self.get_client([MockResponseGeneric500()])
+        ResponsysClientTests.set_authenticated_api_state(api)
+
+        with self.assertRaises(ResponsysClientError):
+            self.run_coroutine(api.unsubscribe_list_member('test_list', 1234))
+
+        records = api.transport.calls[0][2]['json']['recordData']['records']
+        self.assertEqual([['1234', 'O']], records)
+
+
+@skipIf(aiohttp is None, 'the aiohttp transport requires aiohttp')
+class AiohttpTransportTests(TestCase):
+
+    def setUp(self):
+        super(AiohttpTransportTests, self).setUp()
+
+        # tokens are issued at the fake time, so it must be close to now to avoid refreshes
+        self.clock = FakeClock()
+        self.clock.now = time.time()
+        self.server = FakeResponsysServer(clock=self.clock).start()
+        self.addCleanup(self.server.stop)
+
+    def run_with_client(self, use_client):
+        import asyncio
+
+        async def run():
+            async with AsyncResponsysClient(self.server.username, self.server.password,
+                                            self.server.url) as client:
+                return await use_client(client)
+
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(run())
+        finally:
+            loop.close()
+
+    def test_merge_get_and_delete_round_trip(self):
+        async def use_client(client):
+            merged = await client.merge_profile_list_members(
+                'test_list', [{'CUSTOMER_ID_': '1'}, {'CUSTOMER_ID_': '2'}], 'CUSTOMER_ID_')
+            member = await client.get_profile_list_member('test_list', '2')
+            await client.delete_profile_list_member('test_list', '2')
+
+            with self.assertRaises(ResponsysClientError):
+                await client.get_profile_list_member('test_list', '2')
+
+            return merged, member
+
+        merged, member = self.run_with_client(use_client)
+
+        self.assertEqual([['1'], ['2']], merged['recordData']['records'])
+        self.assertEqual('2', member['RIID_'])
+        self.assertEqual(1, self.server.connection_count)
+
+    def test_supplemental_lookups_send_repeated_query_parameters(self):
+        async def use_client(client):
+            await client.merge_supplemental_table_members(
+                'folder', 'prices', [{'STORE_ID': '1', 'SKU': 'a'}, {'STORE_ID': '1', 'SKU': 'b'}])
+            return await client.get_supplemental_table_members(
+                'folder', 'prices', {'STORE_ID': '1', 'SKU': 'b'})
+
+        response = self.run_with_client(use_client)
+
+        record_data = response['recordData']
+        self.assertEqual([{'RIID_': '2', 'SKU': 'b', 'STORE_ID': '1'}],
+                         [dict(zip(record_data['fieldNames'], record))
+                          for record in record_data['records']])
+        self.assertEqual([('fs', 'all'), ('qa', 'SKU'), ('qa', 'STORE_ID'), ('id', '1')],
+                         AiohttpTransport._encode_params(
+                             {'fs': 'all', 'qa': ['SKU', 'STORE_ID'], 'id': [1], 'skip': None}))
+
+    def test_closing_the_transport_drops_its_session(self):
+        async def use_client(client):
+            await client.get_profile_lists()
+            first_session = client.transport._session
+            await client.transport.close()
+            closed_session = client.transport._session
+
+            await client.get_profile_lists()
+
+            return first_session, closed_session, client.transport._session
+
+        first_session, closed_session, second_session = self.run_with_client(use_client)
+
+        self.assertTrue(first_session.closed)
+        self.assertIsNone(closed_session)
+        self.assertIsNot(first_session, second_session)
+        self.assertEqual(2, self.server.connection_count)
+
+    def test_throttled_requests_are_retried(self):
+        import asyncio
+
+        self.server.rate_limit_per_second = 1
+        self.server.retry_after = 0.1
+
+        async def move_to_the_next_window():
+            while not self.server.throttled_count:
+                await asyncio.sleep(0.01)
+            self.clock.sleep(1)
+
+        async def use_client(client):
+            await client.get_profile_lists()
+            window = asyncio.ensure_future(move_to_the_next_window())
+            lists = await client.get_profile_lists()
+            await window
+
+            return lists
+
+        self.assertEqual([], self.run_with_client(use_client))
+        self.assertEqual(1, self.server.throttled_count)
+
+    def test_expired_token_triggers_login(self):
+        self.server.token_ttl = 60
+
+        async def use_client(client):
+            await client.get_profile_lists()
+            expired_auth_token = client.auth_token
+            self.clock.sleep(61)
+            await client.get_profile_lists()
+
+            return expired_auth_token, client.auth_token
+
+        expired_auth_token, auth_token = self.run_with_client(use_client)
+
+        self.assertNotEqual(expired_auth_token, auth_token)
+        self.assertEqual(5, self.server.request_count)
@@ -0,0 +1,81 @@
+import io
+import json
+import os
+import tempfile
+import threading
+from collections import namedtuple
+from datetime import datetime
+
+import pytz
+
+from .locking import InterProcessLock
+
+
+AccessItems = namedtuple('AccessItems', ['auth_token', 'issued_url', 'refresh_timestamp'])
+
+
+class MemoryTokenStore(object):
+    """Keeps access items in memory, so clients sharing the store share one token.
+
+    lock() serializes logins and refreshes between those clients.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._access_items = None
+
+    def get(self):
+        return self._access_items
+
+    def set(self, access_items):
+        self._access_items = access_items
+
+    def lock(self):
+        return self._lock
+
+
+class FileTokenStore(object):
+    """Keeps access items in a JSON file so every process on a host shares one token.
+
+    lock() is held across processes while one of them logs in or refreshes, and the others then
+    read the new token instead of logging in themselves. Writes replace the file atomically.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = InterProcessLock(path + '.lock')
+
+    def get(self):
+        try:
+            with io.open(self.path, 'r', encoding='utf-8') as token_file:
+                stored = json.load(token_file)
+        except (IOError, OSError, ValueError):
+            return None
+
+        refresh_timestamp = datetime.utcfromtimestamp(stored['refreshedAt']).replace(
+            tzinfo=pytz.utc)
+
+        return AccessItems(stored['authToken'], stored['endPoint'], refresh_timestamp)
+
+    def set(self, access_items):
+        epoch = datetime(1970, 1, 1, tzinfo=pytz.utc)
+        stored = {
+            'authToken': access_items.auth_token,
+            'endPoint': access_items.issued_url,
+            'refreshedAt': (access_items.refresh_timestamp - epoch).total_seconds(),
+        }
+
+        directory = os.path.dirname(os.path.abspath(self.path))
+        # mkstemp creates the file readable by its owner only, which suits a credential
+        file_descriptor, temporary_path = tempfile.mkstemp(dir=directory)
+        try:
+            with os.fdopen(file_descriptor, 'w') as token_file:
+                json.dump(stored, token_file)
+
+            os.rename(temporary_path, self.path)
+        except Exception:
+            os.remove(temporary_path)
+            raise
+
+    def lock(self):
+        return self._lock
@@ -0,0 +1,45 @@
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class RequestsTransport(object):
+    """Sends HTTP requests through a shared, keep-alive ``requests.Session``.
+
+    Connections are pooled per host, so repeated calls to the same Responsys endpoint reuse a warm
+    TCP/TLS connection instead of performing a new handshake. The underlying urllib3 pools are
+    thread-safe, which allows a single transport to be shared between threads and clients.
+    """
+
+    DEFAULT_POOL_CONNECTIONS = 10
+    DEFAULT_POOL_MAXSIZE = 10
+
+    def __init__(self, pool_connections=DEFAULT_POOL_CONNECTIONS,
+                 pool_maxsize=DEFAULT_POOL_MAXSIZE, pool_block=False):
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.pool_block = pool_block
+        self.session = self._build_session()
+
+    def request(self, method, url, params=None, json=None, headers=None, timeout=None,
+                data=None):
+        return self.session.request(method, url, params=params, json=json, headers=headers,
+                                    timeout=timeout, data=data)
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _build_session(self):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.pool_connections,
+                              pool_maxsize=self.pool_maxsize,
+                              pool_block=self.pool_block)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+
+        return session
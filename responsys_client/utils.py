@@ -1,18 +1,50 @@
+from collections import OrderedDict
+from itertools import islice
+from operator import itemgetter
+
+
+MAX_CACHED_ROW_GETTERS = 256
+_row_getters = {}
+
+
 def convert_to_list_of_dicts(header_row, data_rows):
     return [dict(zip(header_row, data_row)) for data_row in data_rows]
 
 
-def convert_to_table_structure(list_of_dicts):
-    header_row = sorted(list_of_dicts[0].keys())
-    data_rows = []
+def convert_to_table_structure(data, field_names=None):
+    """Converts records into a header row and a list of data rows.
 
-    for dictionary in list_of_dicts:
-        data_row = []
+    data may be a list of dicts, a dict of equally long column lists, or a pandas or Arrow style
+    table. Unless field_names gives an explicit column order, the header is the sorted union of
+    every record's keys and values missing from a record are None.
+    """
+    if _is_column_oriented(data):
+        return _convert_columns_to_table_structure(data, field_names)
 
-        for key in header_row:
-            data_row.append(dictionary.get(key))
+    if field_names is None:
+        table = _convert_uniform_dicts_to_table_structure(data)
+        if table is not None:
+            return table
 
-        data_rows.append(data_row)
+        keys = set()
+        for dictionary in data:
+            keys.update(dictionary)
+
+        field_names = sorted(keys)
+
+    header_row = list(field_names)
+    if not header_row:
+        return header_row, [[] for _ in data]
+
+    get_row = _get_row_getter(tuple(header_row))
+    data_rows = []
+    append = data_rows.append
+
+    for dictionary in data:
+        try:
+            append(list(get_row(dictionary)))
+        except KeyError:
+            append([dictionary.get(key) for key in header_row])
 
     return header_row, data_rows
 
@@ -26,3 +58,109 @@ def split_dict(data):
         values.append(value)
 
     return headers, values
+
+
+def chunk_iterable(iterable, size):
+    iterator = iter(iterable)
+
+    while True:
+        chunk = list(islice(iterator, size))
+
+        if not chunk:
+            return
+
+        yield chunk
+
+
+def group_by_field_set(items, get_record=None, get_group=None):
+    """Groups items by the set of fields of their record, in the order groups first appear.
+
+    Merging each group separately means a partial record never blanks the fields it does not
+    carry. get_record returns an item's record, the item itself by default, and get_group adds a
+    key that must match too, such as the table the record goes to.
+    """
+    groups = OrderedDict()
+
+    for item in items:
+        record = item if get_record is None else get_record(item)
+        group = frozenset(record)
+        if get_group is not None:
+            group = (get_group(item), group)
+
+        groups.setdefault(group, []).append(item)
+
+    return list(groups.values())
+
+
+def _get_row_getter(header_row):
+    row_getter = _row_getters.get(header_row)
+
+    if row_getter is None:
+        if len(_row_getters) >= MAX_CACHED_ROW_GETTERS:
+            _row_getters.clear()
+
+        if len(header_row) == 1:
+            # itemgetter returns a bare value rather than a tuple for a single key
+            key = header_row[0]
+            row_getter = lambda dictionary: (dictionary[key],)
+        else:
+            row_getter = itemgetter(*header_row)
+
+        _row_getters[header_row] = row_getter
+
+    return row_getter
+
+
+def _convert_uniform_dicts_to_table_structure(list_of_dicts):
+    # the common case is every record sharing the first record's keys, which needs a single pass;
+    # None is returned as soon as a record differs so the caller can build the union of keys
+    if not list_of_dicts:
+        return [], []
+
+    header_row = sorted(list_of_dicts[0])
+    if not header_row:
+        return None
+
+    key_count = len(header_row)
+    get_row = _get_row_getter(tuple(header_row))
+    data_rows = []
+    append = data_rows.append
+
+    for dictionary in list_of_dicts:
+        if len(dictionary) != key_count:
+            return None
+
+        try:
+            append(list(get_row(dictionary)))
+        except KeyError:
+            return None
+
+    return header_row, data_rows
+
+
+def _is_column_oriented(data):
+    return (isinstance(data, dict) or hasattr(data, 'itertuples')
+            or hasattr(data, 'column_names'))
+
+
+def _convert_columns_to_table_structure(data, field_names):
+    if isinstance(data, dict):
+        header_row = list(field_names) if field_names is not None else sorted(data)
+        column_lengths = set(len(column) for column in data.values())
+        if len(column_lengths) > 1:
+            # zip would silently drop the rows beyond the shortest column
+            raise ValueError('Columns must all have the same length, got lengths {}.'
+                             .format(sorted(column_lengths)))
+
+        row_count = column_lengths.pop() if column_lengths else 0
+        columns = [data[key] if key in data else [None] * row_count for key in header_row]
+        return header_row, [list(row) for row in zip(*columns)]
+
+    if hasattr(data, 'itertuples'):
+        header_row = list(field_names) if field_names is not None else sorted(data.columns)
+        rows = data[header_row].itertuples(index=False, name=None)
+        return header_row, [list(row) for row in rows]
+
+    header_row = list(field_names) if field_names is not None else sorted(data.column_names)
+    columns = [data.column(key).to_pylist() for key in header_row]
+    return header_row, [list(row) for row in zip(*columns)]
@@ -8,7 +8,15 @@ setup(
         'pytz==2018.4',
         'requests==2.18.4',
         'mock==2.0.0',
+        'futures==3.2.0; python_version < "3.0"',
     ],
+    extras_require={
+        'async': ['aiohttp>=3.3'],
+        'fast-json': ['orjson>=3; python_version >= "3.6"'],
+    },
+    entry_points={
+        'console_scripts': ['responsys-load=responsys_client.cli:main'],
+    },
     description='This is an Oracle Responsys REST API client written in Python 2.7.',
     author='Nicholas Kincaid',
     author_email='nbkincaid@gmail.com',